@@ -22,11 +22,11 @@ class BlingTokenAdmin(admin.ModelAdmin):
 
 @admin.register(BlingPedidoEnviado)
 class BlingPedidoEnviadoAdmin(admin.ModelAdmin):
-    list_display = ['numero_pedido', 'empresa', 'nome_cliente', 'telefone', 'canal', 'enviado_em']
-    list_filter = ['empresa', 'canal', 'enviado_em']
+    list_display = ['numero_pedido', 'empresa', 'nome_cliente', 'telefone', 'canal', 'situacao', 'enviado_em']
+    list_filter = ['empresa', 'canal', 'situacao', 'enviado_em']
     search_fields = ['numero_pedido', 'nome_cliente', 'telefone', 'bling_pedido_id']
     readonly_fields = ['empresa', 'bling_pedido_id', 'numero_pedido', 'telefone',
-                       'nome_cliente', 'canal', 'enviado_em']
+                       'nome_cliente', 'canal', 'situacao', 'agendar_para', 'tentativas', 'enviado_em']
     ordering = ['-enviado_em']
 
     def has_add_permission(self, request):
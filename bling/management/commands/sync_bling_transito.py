@@ -6,12 +6,13 @@ Uso:
     python manage.py sync_bling_transito --empresa=tarragona
     python manage.py sync_bling_transito --empresa=tarragona --dry-run
     python manage.py sync_bling_transito --empresa=tarragona --status=embalado --dry-run
+    python manage.py sync_bling_transito --empresa=tarragona --completo
     python manage.py sync_bling_transito --list-situacoes --empresa=tarragona
 """
 from django.core.management.base import BaseCommand
 
 from tenants.models import Empresa
-from bling.tasks import sync_empresa_pedidos_por_status, BLING_STATUS_MAP
+from bling.tasks import sincronizar_empresa, BLING_STATUS_MAP
 
 
 class Command(BaseCommand):
@@ -30,6 +31,10 @@ class Command(BaseCommand):
             '--status', type=str,
             help=f'Status específico para sincronizar ({", ".join(BLING_STATUS_MAP.keys())}). Se omitido, processa todos configurados.'
         )
+        parser.add_argument(
+            '--completo', action='store_true',
+            help='Ignora a marca d\'água e relê todos os pedidos das situações'
+        )
         parser.add_argument(
             '--list-situacoes', action='store_true',
             help='Lista situações de venda do Bling (para descobrir IDs)'
@@ -88,6 +93,7 @@ class Command(BaseCommand):
                     configurados.append(f"{s} (ID: {sit_id})")
             self.stdout.write(f"  Status configurados: {', '.join(configurados) or 'Nenhum'}")
 
+            a_processar = []
             for status in statuses:
                 config = BLING_STATUS_MAP[status]
                 sit_id = getattr(empresa, config['campo_situacao'], '')
@@ -97,18 +103,29 @@ class Command(BaseCommand):
                             f"  [{status}] Situação não configurada (campo {config['campo_situacao']} vazio)"
                         ))
                     continue
-
-                try:
-                    stats = sync_empresa_pedidos_por_status(empresa, status, dry_run=dry_run)
-                    self.stdout.write(self.style.SUCCESS(
-                        f"  [{status}] {stats['total']} total, "
-                        f"{stats['enviados']} enviados, "
-                        f"{stats['ja_enviados']} já enviados, "
-                        f"{stats['erros']} erros, "
-                        f"{stats['sem_telefone']} sem telefone"
-                    ))
-                except Exception as e:
-                    self.stderr.write(self.style.ERROR(f"  [{status}] Erro: {e}"))
+                a_processar.append(status)
+
+            if not a_processar:
+                continue
+
+            try:
+                resultados = sincronizar_empresa(
+                    empresa, a_processar, dry_run=dry_run, completo=options['completo'],
+                )
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"  Erro: {e}"))
+                continue
+
+            for status, stats in resultados.items():
+                estilo = self.style.ERROR if stats['erros'] else self.style.SUCCESS
+                self.stdout.write(estilo(
+                    f"  [{status}] {stats['total']} total, "
+                    f"{stats['agendados']} agendados, "
+                    f"{stats['reagendados']} reagendados, "
+                    f"{stats['ja_enviados']} já enviados, "
+                    f"{stats['erros']} erros, "
+                    f"{stats['sem_telefone']} sem telefone"
+                ))
 
     def _list_situacoes(self, empresa_slug):
         """Lista situações de venda do Bling."""
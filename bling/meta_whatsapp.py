@@ -6,6 +6,8 @@ Docs: https://developers.facebook.com/docs/whatsapp/cloud-api
 import logging
 import requests
 
+from customer_intelligence import http
+
 logger = logging.getLogger(__name__)
 
 
@@ -76,8 +78,10 @@ class MetaWhatsAppClient:
         }
 
         try:
-            response = requests.post(
+            response = http.request(
+                'meta', 'POST',
                 f"{self.BASE_URL}/{self.phone_number_id}/messages",
+                credencial=self.access_token,
                 json=payload,
                 headers=self._headers(),
                 timeout=30,
@@ -91,7 +95,12 @@ class MetaWhatsAppClient:
             error_data = response.json() if response.content else {}
             error_msg = error_data.get('error', {}).get('message', response.text)
             logger.error(f"Erro Meta WhatsApp {response.status_code}: {error_msg}")
-            return {'success': False, 'error': error_msg}
+            return {
+                'success': False,
+                'error': error_msg,
+                'status_code': response.status_code,
+                'error_code': error_data.get('error', {}).get('code'),
+            }
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Erro ao enviar Meta WhatsApp: {e}")
@@ -113,8 +122,10 @@ class MetaWhatsAppClient:
         }
 
         try:
-            response = requests.post(
+            response = http.request(
+                'meta', 'POST',
                 f"{self.BASE_URL}/{self.phone_number_id}/messages",
+                credencial=self.access_token,
                 json=payload,
                 headers=self._headers(),
                 timeout=30,
@@ -127,7 +138,12 @@ class MetaWhatsAppClient:
             error_data = response.json() if response.content else {}
             error_msg = error_data.get('error', {}).get('message', response.text)
             logger.error(f"Erro Meta WhatsApp {response.status_code}: {error_msg}")
-            return {'success': False, 'error': error_msg}
+            return {
+                'success': False,
+                'error': error_msg,
+                'status_code': response.status_code,
+                'error_code': error_data.get('error', {}).get('code'),
+            }
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Erro ao enviar Meta WhatsApp: {e}")
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-19 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bling', '0002_add_status_to_pedido_enviado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blingpedidoenviado',
+            name='agendar_para',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='blingpedidoenviado',
+            name='situacao',
+            field=models.CharField(choices=[('agendado', 'Agendado'), ('enviando', 'Enviando'), ('enviado', 'Enviado')], default='enviado', max_length=20),
+        ),
+    ]
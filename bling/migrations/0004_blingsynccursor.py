@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-19 06:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0013_empresa_meta_template_lead_nao_cliente_cupom'),
+        ('bling', '0003_pedido_enviado_agendamento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlingSyncCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultima_alteracao', models.DateTimeField(blank=True, null=True)),
+                ('ultima_reconciliacao', models.DateTimeField(blank=True, null=True)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('empresa', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='bling_sync_cursor', to='tenants.empresa')),
+            ],
+            options={
+                'db_table': 'bling_sync_cursor',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-19 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bling', '0004_blingsynccursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blingpedidoenviado',
+            name='tentativas',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='blingpedidoenviado',
+            name='situacao',
+            field=models.CharField(choices=[('agendado', 'Agendado'), ('enviando', 'Enviando'), ('enviado', 'Enviado'), ('falha', 'Falha')], default='enviado', max_length=20),
+        ),
+    ]
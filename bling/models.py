@@ -27,7 +27,22 @@ class BlingToken(models.Model):
 
 
 class BlingPedidoEnviado(models.Model):
-    """Log de pedidos já notificados via WhatsApp (evita duplicata)"""
+    """
+    Log de pedidos já notificados via WhatsApp (evita duplicata).
+
+    O sync grava o pedido como 'agendado' e agenda o envio numa task
+    (bling.enviar_notificacao_pedido); a task passa para 'enviando' e,
+    após o envio, 'enviado'. Se o envio falhar o registro fica em 'falha'
+    com agendar_para = próxima tentativa, e o sync o reagenda (até
+    bling.tasks.MAX_TENTATIVAS_ENVIO tentativas).
+    """
+    SITUACAO_CHOICES = [
+        ('agendado', 'Agendado'),
+        ('enviando', 'Enviando'),
+        ('enviado', 'Enviado'),
+        ('falha', 'Falha'),
+    ]
+
     empresa = models.ForeignKey(
         Empresa, on_delete=models.CASCADE, related_name='bling_pedidos_enviados'
     )
@@ -45,6 +60,9 @@ class BlingPedidoEnviado(models.Model):
         choices=[('meta', 'Meta Cloud API'), ('wapi', 'W-API')],
         help_text='Canal usado para envio'
     )
+    situacao = models.CharField(max_length=20, choices=SITUACAO_CHOICES, default='enviado')
+    agendar_para = models.DateTimeField(null=True, blank=True)
+    tentativas = models.PositiveSmallIntegerField(default=0)
 
     class Meta:
         db_table = 'bling_pedidos_enviados'
@@ -55,3 +73,24 @@ class BlingPedidoEnviado(models.Model):
 
     def __str__(self):
         return f"Pedido #{self.numero_pedido} - {self.empresa.nome}"
+
+
+class BlingSyncCursor(models.Model):
+    """
+    Marca d'água do sync de pedidos por empresa: o próximo sync só pede ao
+    Bling os pedidos alterados depois de ultima_alteracao (dataAlteracao).
+    A cada BLING_RECONCILIACAO_HORAS um sync completo refaz a comparação
+    com todos os pedidos de cada situação.
+    """
+    empresa = models.OneToOneField(
+        Empresa, on_delete=models.CASCADE, related_name='bling_sync_cursor'
+    )
+    ultima_alteracao = models.DateTimeField(null=True, blank=True)
+    ultima_reconciliacao = models.DateTimeField(null=True, blank=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'bling_sync_cursor'
+
+    def __str__(self):
+        return f"BlingSyncCursor - {self.empresa.nome}"
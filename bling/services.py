@@ -1,20 +1,99 @@
 """
 Cliente Bling API V3 com OAuth2 e auto-refresh de tokens.
 Docs: https://developer.bling.com.br/api
+
+Limite da API: 3 requisições/s por aplicativo. Um token bucket por
+client_id no Redis (BucketRedis, compartilhado por todos os workers:
+sync, views, management commands) espaça as chamadas; sem REDIS_URL o
+bucket é local ao processo. HTTP 429 reduz a taxa e pausa o bucket
+antes de tentar de novo.
+
+Tokens: o access token fica em cache no processo (até
+BLING_TOKEN_CACHE_SEGUNDOS ou 5 min antes de expirar), sem consultar
+bling_tokens a cada requisição. A renovação é single-flight: feita com a
+linha do BlingToken travada (SELECT FOR UPDATE); quem esperou o lock e
+encontra um token diferente do que tinha usa o novo sem chamar o Bling
+(o refresh token é invalidado a cada uso).
 """
 import logging
 import base64
+import threading
+import time
 from datetime import timedelta
 
-import requests
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
+from customer_intelligence import http
+from comunicacao.services.ratelimit import BucketRedis, TokenBucket
+from comunicacao.services.redis_conn import get_redis
+
 logger = logging.getLogger(__name__)
 
 BLING_API_BASE = 'https://www.bling.com.br/Api/v3'
 BLING_OAUTH_AUTHORIZE = 'https://www.bling.com.br/Api/v3/oauth/authorize'
 BLING_OAUTH_TOKEN = 'https://www.bling.com.br/Api/v3/oauth/token'
 
+# Máximo de pedidos por página aceito pela API
+LIMITE_PAGINA = 100
+# Proteção contra paginação sem fim (100k pedidos por situação)
+MAX_PAGINAS = 1000
+# Tentativas após HTTP 429
+TENTATIVAS_429 = 3
+
+# Renovar quando faltar menos que isso para expirar
+MARGEM_RENOVACAO = timedelta(minutes=5)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+# {empresa_id: (access_token, expires_at, valido_ate monotônico)}
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+def _token_em_cache(empresa_id):
+    with _tokens_lock:
+        entrada = _tokens.get(empresa_id)
+    if entrada and entrada[2] > time.monotonic() and entrada[1] > timezone.now() + MARGEM_RENOVACAO:
+        return entrada[0]
+    return None
+
+
+def _guardar_token(empresa_id, token):
+    ttl = getattr(settings, 'BLING_TOKEN_CACHE_SEGUNDOS', 300)
+    with _tokens_lock:
+        _tokens[empresa_id] = (token.access_token, token.expires_at, time.monotonic() + ttl)
+
+
+def _descartar_token(empresa_id, access_token=None):
+    """Remove o token do cache (só se ainda for access_token, quando informado)."""
+    with _tokens_lock:
+        entrada = _tokens.get(empresa_id)
+        if entrada and (access_token is None or entrada[0] == access_token):
+            del _tokens[empresa_id]
+
+
+def _bucket(client_id):
+    """Bucket do client_id: no Redis quando configurado, senão local (também o fallback)."""
+    with _buckets_lock:
+        local = _buckets.get(client_id)
+        if local is None:
+            local = _buckets[client_id] = TokenBucket(getattr(settings, 'BLING_TAXA_REQUISICOES', 3))
+    r = get_redis()
+    return BucketRedis(r, ('bling', client_id), local) if r is not None else local
+
+
+def _aguardar_vez(client_id):
+    """Bloqueia até o bucket do client_id liberar uma requisição."""
+    bucket = _bucket(client_id)
+    while True:
+        espera = bucket.tentar()
+        if not espera:
+            return
+        time.sleep(min(espera, 1.0))
+
 
 class BlingClient:
     """Cliente para Bling API V3 com OAuth2."""
@@ -28,10 +107,10 @@ class BlingClient:
     def _load_token(self):
         """Carrega token do banco."""
         if self._token is None:
-            try:
-                self._token = self.empresa.bling_token
-            except Exception:
-                self._token = None
+            from bling.models import BlingToken
+            # Consulta direta: a empresa pode vir do cache de tenants
+            # (empresa.bling_token ficaria guardado na instância compartilhada)
+            self._token = BlingToken.objects.filter(empresa_id=self.empresa.id).first()
         return self._token
 
     def get_authorization_url(self, redirect_uri):
@@ -52,8 +131,9 @@ class BlingClient:
 
     def exchange_code(self, code, redirect_uri):
         """Troca authorization code por access/refresh tokens."""
-        response = requests.post(
-            BLING_OAUTH_TOKEN,
+        response = http.request(
+            'bling', 'POST', BLING_OAUTH_TOKEN,
+            credencial=self.client_id,
             headers={
                 'Authorization': self._basic_auth(),
                 'Content-Type': 'application/x-www-form-urlencoded',
@@ -71,27 +151,44 @@ class BlingClient:
         logger.info(f"Bling OAuth tokens salvos para {self.empresa.nome}")
         return data
 
-    def refresh_access_token(self):
-        """Renova access token usando refresh token."""
-        token = self._load_token()
-        if not token:
-            raise ValueError(f"Nenhum token Bling encontrado para {self.empresa.nome}")
+    def refresh_access_token(self, token_visto=None):
+        """
+        Renova access token usando refresh token (single-flight por empresa).
+
+        token_visto: access token que o chamador tinha ao decidir renovar.
+        Se, com o lock, o token do banco já for outro, um worker concorrente
+        renovou primeiro: usa o novo e retorna None sem chamar o Bling.
+        """
+        from bling.models import BlingToken
+
+        with transaction.atomic():
+            token = BlingToken.objects.select_for_update().filter(empresa_id=self.empresa.id).first()
+            if not token:
+                raise ValueError(f"Nenhum token Bling encontrado para {self.empresa.nome}")
+
+            if token_visto and token.access_token != token_visto:
+                self._token = token
+                _guardar_token(self.empresa.id, token)
+                logger.info(f"Bling token de {self.empresa.nome} já renovado por outro worker")
+                return None
+
+            response = http.request(
+                'bling', 'POST', BLING_OAUTH_TOKEN,
+                credencial=self.client_id,
+                headers={
+                    'Authorization': self._basic_auth(),
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                },
+                data={
+                    'grant_type': 'refresh_token',
+                    'refresh_token': token.refresh_token,
+                },
+                timeout=30,
+            )
+            response.raise_for_status()
+            data = response.json()
+            self._save_tokens(data)
 
-        response = requests.post(
-            BLING_OAUTH_TOKEN,
-            headers={
-                'Authorization': self._basic_auth(),
-                'Content-Type': 'application/x-www-form-urlencoded',
-            },
-            data={
-                'grant_type': 'refresh_token',
-                'refresh_token': token.refresh_token,
-            },
-            timeout=30,
-        )
-        response.raise_for_status()
-        data = response.json()
-        self._save_tokens(data)
         logger.info(f"Bling token renovado para {self.empresa.nome}")
         return data
 
@@ -111,58 +208,94 @@ class BlingClient:
             }
         )
         self._token = token
+        _guardar_token(self.empresa.id, token)
 
     def _get_access_token(self):
         """Retorna access token válido, renovando se necessário."""
+        access_token = _token_em_cache(self.empresa.id)
+        if access_token:
+            return access_token
+
+        # Cache vencido: relê do banco (outro worker pode ter renovado)
+        self._token = None
         token = self._load_token()
         if not token:
             raise ValueError(f"Bling não autorizado para {self.empresa.nome}")
 
         # Renovar se expira em menos de 5 minutos
-        if token.expires_at <= timezone.now() + timedelta(minutes=5):
-            self.refresh_access_token()
+        if token.expires_at <= timezone.now() + MARGEM_RENOVACAO:
+            self.refresh_access_token(token_visto=token.access_token)
             token = self._load_token()
 
+        _guardar_token(self.empresa.id, token)
         return token.access_token
 
+    def _chamar(self, method, url, **kwargs):
+        """http.request respeitando o limite de taxa do client_id (com retry em 429)."""
+        bucket = _bucket(self.client_id)
+        for tentativa in range(TENTATIVAS_429 + 1):
+            _aguardar_vez(self.client_id)
+            response = http.request(
+                'bling', method, url, credencial=self.client_id, timeout=30, **kwargs
+            )
+            if response.status_code != 429 or tentativa == TENTATIVAS_429:
+                break
+            # O bucket fica pausado: a próxima volta de _aguardar_vez espera
+            pausa = bucket.penalizar()
+            logger.warning(f"Bling 429 para {self.empresa.nome}, aguardando {pausa:.0f}s")
+        if response.status_code < 400:
+            bucket.sucesso()
+        return response
+
     def _request(self, method, endpoint, **kwargs):
         """Request autenticado com auto-refresh."""
         url = f"{BLING_API_BASE}{endpoint}"
         headers = kwargs.pop('headers', {})
-        headers['Authorization'] = f"Bearer {self._get_access_token()}"
+        access_token = self._get_access_token()
+        headers['Authorization'] = f"Bearer {access_token}"
 
-        response = requests.request(
-            method, url, headers=headers, timeout=30, **kwargs
-        )
+        response = self._chamar(method, url, headers=headers, **kwargs)
 
         # Token expirado - tentar refresh uma vez
         if response.status_code == 401:
             logger.warning(f"Bling 401 para {self.empresa.nome}, renovando token...")
-            self.refresh_access_token()
+            _descartar_token(self.empresa.id, access_token)
+            self.refresh_access_token(token_visto=access_token)
             headers['Authorization'] = f"Bearer {self._get_access_token()}"
-            response = requests.request(
-                method, url, headers=headers, timeout=30, **kwargs
-            )
+            response = self._chamar(method, url, headers=headers, **kwargs)
 
         response.raise_for_status()
         return response.json()
 
-    def get_pedidos_por_situacao(self, situacao_id, pagina=1):
+    def get_pedidos_por_situacao(self, situacao_id, pagina=1, alterados_desde=None):
         """
-        Busca pedidos de venda por situação.
+        Busca uma página (até LIMITE_PAGINA) de pedidos de venda por situação.
+        alterados_desde: datetime; só pedidos com dataAlteracao a partir dele.
         Retorna lista de pedidos do Bling.
         """
-        data = self._request(
-            'GET',
-            '/pedidos/vendas',
-            params={
-                'idsSituacoes[]': situacao_id,
-                'pagina': pagina,
-                'limite': 100,
-            }
-        )
+        params = {
+            'idsSituacoes[]': situacao_id,
+            'pagina': pagina,
+            'limite': LIMITE_PAGINA,
+        }
+        if alterados_desde:
+            # Horário local (o Bling não recebe fuso)
+            params['dataAlteracaoInicial'] = timezone.localtime(alterados_desde).strftime('%Y-%m-%d %H:%M:%S')
+        data = self._request('GET', '/pedidos/vendas', params=params)
         return data.get('data', [])
 
+    def iter_pedidos_por_situacao(self, situacao_id, alterados_desde=None):
+        """Itera as páginas de pedidos da situação (listas), até a última."""
+        for pagina in range(1, MAX_PAGINAS + 1):
+            pedidos = self.get_pedidos_por_situacao(
+                situacao_id, pagina=pagina, alterados_desde=alterados_desde,
+            )
+            if pedidos:
+                yield pedidos
+            if len(pedidos) < LIMITE_PAGINA:
+                return
+        logger.warning(f"[{self.empresa.slug}] Situação {situacao_id}: paginação interrompida em {MAX_PAGINAS} páginas")
+
     def get_pedido_detalhe(self, pedido_id):
         """Busca detalhes de um pedido específico."""
         data = self._request('GET', f'/pedidos/vendas/{pedido_id}')
@@ -1,12 +1,33 @@
 """
 Celery tasks para sincronização Bling → WhatsApp.
 Suporta TODOS os status de pedido: processando, embalado, em-transito, concluido, cancelado.
+
+O sync só busca os pedidos e compara com os já notificados: cada pedido
+novo é reservado em BlingPedidoEnviado ('agendado') e enviado por uma
+task própria (enviar_notificacao_pedido) agendada com countdown. Os
+envios de uma empresa ficam espaçados por um intervalo aleatório
+(BLING_ENVIO_INTERVALO_MIN/MAX), inclusive entre execuções do sync.
+Envios que falham ficam em 'falha' e o sync os reagenda com espera
+crescente (a marca d'água não traria o pedido de volta).
+
+As páginas de pedidos de todos os status/empresas são buscadas num pool
+de threads (só HTTP) e processadas à medida que chegam.
+
+Incremental: BlingSyncCursor guarda a marca d'água (dataAlteracao) por
+empresa e o sync só pede os pedidos alterados desde ela; a cada
+BLING_RECONCILIACAO_HORAS um sync completo relê todas as situações.
 """
 import logging
+import queue
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connections
 from django.utils import timezone
 
 from tenants.models import Empresa
@@ -14,6 +35,24 @@ from customers.services.wapi import formatar_telefone
 
 logger = logging.getLogger(__name__)
 
+# Reservas 'agendado'/'enviando' mais antigas que isso além do horário
+# agendado são de tasks perdidas (worker reiniciado): o sync as passa
+# para 'falha' e as reagenda
+RESERVA_EXPIRA = timedelta(hours=1)
+
+# Envio que falhou: o sync reagenda após FALHA_ESPERA * 2^(tentativas-1),
+# até MAX_TENTATIVAS_ENVIO tentativas
+FALHA_ESPERA = timedelta(minutes=15)
+MAX_TENTATIVAS_ENVIO = 3
+
+# Recuo da marca d'água (diferença de relógio com o Bling, pedidos
+# gravados durante o sync anterior)
+MARGEM_MARCA_DAGUA = timedelta(minutes=10)
+
+# Trava do sync completo (evita execuções sobrepostas)
+SYNC_LOCK_KEY = 'bling:sync_todos_status'
+SYNC_LOCK_TTL = 25 * 60
+
 # Mapa de status → campo da situação na Empresa + tipo de mensagem W-API
 BLING_STATUS_MAP = {
     'processando': {
@@ -86,43 +125,81 @@ def _enviar_via_wapi(empresa, telefone, nome, numero_pedido, status):
     return client.enviar_mensagem(telefone, mensagem)
 
 
-def sync_empresa_pedidos_por_status(empresa, status, dry_run=False):
+def _intervalo_envio():
+    return random.uniform(
+        getattr(settings, 'BLING_ENVIO_INTERVALO_MIN', 45),
+        getattr(settings, 'BLING_ENVIO_INTERVALO_MAX', 120),
+    )
+
+
+def _proximo_horario_envio(empresa):
     """
-    Sincroniza pedidos de um status específico de uma empresa.
-    Retorna dict com estatísticas.
+    Próximo horário de envio da empresa (epoch). Os envios ficam espaçados
+    por um intervalo aleatório; o último horário reservado fica no cache,
+    então syncs seguidos continuam a fila em vez de enviar juntos.
+    """
+    key = f'bling:proximo_envio:{empresa.id}'
+    agora = time.time()
+    horario = max(agora, cache.get(key) or 0)
+    proximo = horario + _intervalo_envio()
+    cache.set(key, proximo, timeout=int(proximo - agora) + 60)
+    return horario
+
+
+def _liberar_reservas_expiradas(empresa, status):
+    """
+    Reservas de tasks que nunca rodaram viram 'falha' vencida (sem contar
+    tentativa), para _reagendar_falhas reenviar: o sync incremental não
+    traria o pedido de volta antes da reconciliação.
     """
-    from bling.services import BlingClient
     from bling.models import BlingPedidoEnviado
 
-    stats = {'status': status, 'total': 0, 'enviados': 0, 'ja_enviados': 0, 'erros': 0, 'sem_telefone': 0}
+    agora = timezone.now()
+    liberados = BlingPedidoEnviado.objects.filter(
+        empresa=empresa, status=status,
+        situacao__in=['agendado', 'enviando'],
+        agendar_para__lt=agora - RESERVA_EXPIRA,
+    ).update(situacao='falha', agendar_para=agora)
+    if liberados:
+        logger.warning(f"[{empresa.slug}] [{status}] {liberados} reservas de envio expiradas liberadas")
 
-    config = BLING_STATUS_MAP.get(status)
-    if not config:
-        logger.error(f"[{empresa.nome}] Status '{status}' não reconhecido")
-        return stats
 
-    situacao_id = getattr(empresa, config['campo_situacao'], '')
-    if not empresa.bling_client_id or not situacao_id:
-        logger.debug(f"[{empresa.nome}] Bling não configurado para status '{status}'")
-        return stats
+def _reagendar_falhas(empresa, status, stats):
+    """Reagenda os envios que falharam e cuja espera já passou."""
+    from bling.models import BlingPedidoEnviado
+
+    agora = timezone.now()
+    falhas = BlingPedidoEnviado.objects.filter(
+        empresa=empresa, status=status, situacao='falha',
+        tentativas__lt=MAX_TENTATIVAS_ENVIO, agendar_para__lte=agora,
+    ).values_list('id', 'bling_pedido_id')
+    for reserva_id, pedido_id in list(falhas):
+        espera = max(0, int(_proximo_horario_envio(empresa) - time.time()))
+        if not BlingPedidoEnviado.objects.filter(id=reserva_id, situacao='falha').update(
+            situacao='agendado', agendar_para=agora + timedelta(seconds=espera),
+        ):
+            continue
+        enviar_notificacao_pedido.apply_async(
+            args=[empresa.id, status, pedido_id],
+            countdown=espera,
+        )
+        stats['reagendados'] += 1
+    if stats['reagendados']:
+        logger.info(f"[{empresa.slug}] [{status}] {stats['reagendados']} envios com falha reagendados")
 
-    client = BlingClient(empresa)
 
-    try:
-        pedidos = client.get_pedidos_por_situacao(situacao_id)
-    except Exception as e:
-        logger.error(f"[{empresa.nome}] Erro ao buscar pedidos Bling (status={status}): {e}")
-        stats['erros'] += 1
-        return stats
+def _novo_stats(status):
+    return {
+        'status': status, 'total': 0, 'agendados': 0, 'reagendados': 0,
+        'ja_enviados': 0, 'erros': 0, 'sem_telefone': 0,
+    }
 
-    stats['total'] = len(pedidos)
-    logger.info(f"[{empresa.nome}] {len(pedidos)} pedidos '{status}' encontrados")
 
-    # IDs já enviados para esta empresa + status
-    ids_enviados = set(
-        BlingPedidoEnviado.objects.filter(empresa=empresa, status=status)
-        .values_list('bling_pedido_id', flat=True)
-    )
+def _processar_pagina(empresa, status, pedidos, stats, ids_enviados, dry_run):
+    """Compara uma página de pedidos com os já enviados e agenda os novos."""
+    from bling.models import BlingPedidoEnviado
+
+    stats['total'] += len(pedidos)
 
     for pedido in pedidos:
         pedido_id = str(pedido.get('id', ''))
@@ -141,13 +218,13 @@ def sync_empresa_pedidos_por_status(empresa, status, dry_run=False):
         nome = _extrair_nome_pedido(pedido)
 
         if dry_run:
-            logger.info(f"[DRY-RUN] [{status}] Enviaria WhatsApp para {nome} ({telefone}) - Pedido #{numero}")
-            stats['enviados'] += 1
+            logger.info(f"[DRY-RUN] [{status}] Agendaria WhatsApp para {nome} ({telefone}) - Pedido #{numero}")
+            ids_enviados.add(pedido_id)
+            stats['agendados'] += 1
             continue
 
-        resultado = _enviar_via_wapi(empresa, telefone, nome, numero, status)
-
-        if resultado.get('success'):
+        espera = max(0, int(_proximo_horario_envio(empresa) - time.time()))
+        try:
             BlingPedidoEnviado.objects.create(
                 empresa=empresa,
                 bling_pedido_id=pedido_id,
@@ -156,19 +233,259 @@ def sync_empresa_pedidos_por_status(empresa, status, dry_run=False):
                 nome_cliente=nome,
                 status=status,
                 canal='wapi',
+                situacao='agendado',
+                agendar_para=timezone.now() + timedelta(seconds=espera),
             )
-            stats['enviados'] += 1
-            logger.info(f"[{empresa.nome}] WhatsApp enviado [{status}] - Pedido #{numero} → {telefone}")
-        else:
+        except IntegrityError:
+            # Outro sync (ex: action do admin) reservou o mesmo pedido
+            stats['ja_enviados'] += 1
+            continue
+
+        enviar_notificacao_pedido.apply_async(
+            args=[empresa.id, status, pedido_id],
+            countdown=espera,
+        )
+        ids_enviados.add(pedido_id)
+        stats['agendados'] += 1
+        logger.info(
+            f"[{empresa.nome}] WhatsApp agendado [{status}] - Pedido #{numero} → {telefone} "
+            f"em {espera}s"
+        )
+
+
+def _ja_enviados(empresa, status, pedidos):
+    """IDs da página já enviados/agendados (IN limitado aos ids da página)."""
+    from bling.models import BlingPedidoEnviado
+
+    ids = [str(p.get('id', '')) for p in pedidos]
+    return set(
+        BlingPedidoEnviado.objects.filter(empresa=empresa, status=status, bling_pedido_id__in=ids)
+        .values_list('bling_pedido_id', flat=True)
+    )
+
+
+def _marca_dagua(empresa):
+    """
+    (cursor, alterados_desde) da empresa. alterados_desde None = sync
+    completo (primeira vez ou reconciliação vencida).
+    """
+    from bling.models import BlingSyncCursor
+
+    cursor, _ = BlingSyncCursor.objects.get_or_create(empresa=empresa)
+    reconciliacao = timedelta(hours=getattr(settings, 'BLING_RECONCILIACAO_HORAS', 24))
+    if (
+        not cursor.ultima_alteracao
+        or not cursor.ultima_reconciliacao
+        or cursor.ultima_reconciliacao <= timezone.now() - reconciliacao
+    ):
+        return cursor, None
+    return cursor, cursor.ultima_alteracao - MARGEM_MARCA_DAGUA
+
+
+def _status_configurados(empresa):
+    return [
+        status for status, config in BLING_STATUS_MAP.items()
+        if getattr(empresa, config['campo_situacao'], '')
+    ]
+
+
+def _buscar_paginas(client, situacao_id, alterados_desde, alvo, fila):
+    """
+    Executado no pool: só HTTP. Publica cada página na fila assim que
+    chega e, no fim, (alvo, None, erro ou None).
+    """
+    try:
+        for pedidos in client.iter_pedidos_por_situacao(situacao_id, alterados_desde=alterados_desde):
+            fila.put((alvo, pedidos, None))
+        fila.put((alvo, None, None))
+    except Exception as e:
+        fila.put((alvo, None, e))
+    finally:
+        # Renovação de token pode ter aberto conexão nesta thread
+        connections.close_all()
+
+
+def sincronizar(alvos, dry_run=False, completo=False):
+    """
+    Sincroniza uma lista de (empresa, status).
+
+    As páginas de todos os alvos são buscadas em paralelo
+    (BLING_SYNC_CONCORRENCIA threads, limitadas pelo token bucket de cada
+    client_id) e cada página é processada na thread principal assim que
+    chega: o banco só é acessado aqui.
+
+    Só pedidos alterados desde a marca d'água da empresa, exceto na
+    reconciliação periódica ou com completo=True. A marca avança quando
+    todos os status configurados da empresa sincronizaram sem erro.
+    Retorna {(empresa.id, status): stats}.
+    """
+    from bling.services import BlingClient
+
+    inicio = timezone.now()
+    resultados = {}
+    clientes = {}
+    marcas = {}
+    buscas = []
+    for empresa, status in alvos:
+        stats = resultados[(empresa.id, status)] = _novo_stats(status)
+
+        config = BLING_STATUS_MAP.get(status)
+        if not config:
+            logger.error(f"[{empresa.nome}] Status '{status}' não reconhecido")
+            continue
+
+        situacao_id = getattr(empresa, config['campo_situacao'], '')
+        if not empresa.bling_client_id or not situacao_id:
+            logger.debug(f"[{empresa.nome}] Bling não configurado para status '{status}'")
+            continue
+
+        if empresa.id not in clientes:
+            client = BlingClient(empresa)
+            try:
+                # Carrega (e renova, se preciso) o token antes das threads
+                client._get_access_token()
+            except Exception as e:
+                logger.error(f"[{empresa.nome}] Erro ao autenticar no Bling: {e}")
+                client = None
+            clientes[empresa.id] = client
+        if clientes[empresa.id] is None:
             stats['erros'] += 1
-            logger.error(f"[{empresa.nome}] Erro Pedido #{numero} [{status}]: {resultado.get('error')}")
+            continue
+
+        if empresa.id not in marcas:
+            cursor, desde = _marca_dagua(empresa)
+            marcas[empresa.id] = (cursor, None if completo else desde)
+        stats['incremental'] = marcas[empresa.id][1] is not None
+
+        if not dry_run:
+            _liberar_reservas_expiradas(empresa, status)
+            _reagendar_falhas(empresa, status, stats)
+        buscas.append((empresa, status, situacao_id))
+
+    if not buscas:
+        return resultados
+
+    fila = queue.Queue()
+    agendados_por_alvo = {}
+    concorrencia = getattr(settings, 'BLING_SYNC_CONCORRENCIA', 4)
+    with ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix='bling') as pool:
+        for empresa, status, situacao_id in buscas:
+            pool.submit(
+                _buscar_paginas, clientes[empresa.id], situacao_id,
+                marcas[empresa.id][1], (empresa, status), fila,
+            )
+
+        ativos = len(buscas)
+        while ativos:
+            (empresa, status), pedidos, erro = fila.get()
+            stats = resultados[(empresa.id, status)]
+            if pedidos is None:
+                ativos -= 1
+                if erro:
+                    logger.error(f"[{empresa.nome}] Erro ao buscar pedidos Bling (status={status}): {erro}")
+                    stats['erros'] += 1
+                else:
+                    logger.info(f"[{empresa.nome}] {stats['total']} pedidos '{status}' encontrados")
+                continue
+
+            try:
+                if (empresa.id, status) not in agendados_por_alvo:
+                    agendados_por_alvo[(empresa.id, status)] = set()
+                # Já enviados: os desta página no banco + os agendados neste sync
+                ids_enviados = agendados_por_alvo[(empresa.id, status)]
+                ids_enviados |= _ja_enviados(empresa, status, pedidos)
+                _processar_pagina(empresa, status, pedidos, stats, ids_enviados, dry_run)
+            except Exception as e:
+                logger.error(f"[{empresa.nome}] [{status}] Erro ao processar página: {e}")
+                stats['erros'] += 1
+
+    if not dry_run:
+        _avancar_marcas(alvos, resultados, marcas, inicio)
+
+    return resultados
+
+
+def _avancar_marcas(alvos, resultados, marcas, inicio):
+    """Avança o cursor das empresas cujos status configurados sincronizaram todos sem erro."""
+    por_empresa = {}
+    for empresa, status in alvos:
+        por_empresa.setdefault(empresa.id, (empresa, set()))[1].add(status)
+
+    for empresa_id, (empresa, statuses) in por_empresa.items():
+        if empresa_id not in marcas:
+            continue
+        if not set(_status_configurados(empresa)) <= statuses:
+            continue
+        if any(resultados[(empresa_id, status)]['erros'] for status in statuses):
+            logger.warning(f"[{empresa.slug}] Sync Bling com erros, marca d'água mantida")
+            continue
+        cursor, desde = marcas[empresa_id]
+        cursor.ultima_alteracao = inicio
+        campos = ['ultima_alteracao', 'atualizado_em']
+        if desde is None:
+            cursor.ultima_reconciliacao = inicio
+            campos.append('ultima_reconciliacao')
+        cursor.save(update_fields=campos)
+
+
+def sincronizar_empresa(empresa, statuses=None, dry_run=False, completo=False):
+    """Sincroniza os status configurados da empresa (ou só `statuses`). Retorna {status: stats}."""
+    statuses = statuses or _status_configurados(empresa)
+    resultados = sincronizar([(empresa, status) for status in statuses], dry_run=dry_run, completo=completo)
+    return {status: resultados[(empresa.id, status)] for status in statuses}
+
+
+def sync_empresa_pedidos_por_status(empresa, status, dry_run=False):
+    """
+    Sincroniza pedidos de um status específico de uma empresa: agenda o
+    envio dos pedidos ainda não notificados e retorna sem esperar.
+    Retorna dict com estatísticas.
+    """
+    return sincronizar_empresa(empresa, [status], dry_run=dry_run)[status]
 
-        # Delay aleatório entre mensagens (45-120s)
-        delay = random.uniform(45, 120)
-        logger.debug(f"Aguardando {delay:.0f}s antes do próximo envio")
-        time.sleep(delay)
 
-    return stats
+@shared_task(name='bling.enviar_notificacao_pedido')
+def enviar_notificacao_pedido(empresa_id, status, bling_pedido_id):
+    """
+    Envia a notificação de um pedido reservado pelo sync.
+    Só uma execução por reserva (agendado → enviando); em falha a reserva
+    fica em 'falha' e um sync depois da espera reagenda o envio.
+    """
+    from bling.models import BlingPedidoEnviado
+
+    reserva = BlingPedidoEnviado.objects.filter(
+        empresa_id=empresa_id, status=status, bling_pedido_id=bling_pedido_id,
+    )
+    if not reserva.filter(situacao='agendado').update(situacao='enviando'):
+        return {'success': False, 'error': 'Reserva inexistente ou já processada'}
+
+    registro = reserva.select_related('empresa').get()
+    empresa = registro.empresa
+
+    try:
+        resultado = _enviar_via_wapi(empresa, registro.telefone, registro.nome_cliente, registro.numero_pedido, status)
+    except Exception as e:
+        resultado = {'success': False, 'error': str(e)}
+
+    if resultado.get('success'):
+        reserva.update(situacao='enviado', enviado_em=timezone.now())
+        logger.info(
+            f"[{empresa.nome}] WhatsApp enviado [{status}] - Pedido #{registro.numero_pedido} → {registro.telefone}"
+        )
+    else:
+        tentativas = registro.tentativas + 1
+        reserva.update(
+            situacao='falha',
+            tentativas=tentativas,
+            agendar_para=timezone.now() + FALHA_ESPERA * 2 ** (tentativas - 1),
+        )
+        desistiu = ' (sem novas tentativas)' if tentativas >= MAX_TENTATIVAS_ENVIO else ''
+        logger.error(
+            f"[{empresa.nome}] Erro Pedido #{registro.numero_pedido} [{status}], "
+            f"tentativa {tentativas}{desistiu}: {resultado.get('error')}"
+        )
+
+    return resultado
 
 
 # Manter compatibilidade com código existente
@@ -180,32 +497,37 @@ def sync_empresa_pedidos_transito(empresa, dry_run=False):
 @shared_task(name='bling.sync_todos_status')
 def sync_todos_status_bling():
     """
-    Task Celery: busca pedidos de TODOS os status configurados no Bling e envia WhatsApp.
-    Roda via Celery Beat a cada 30 minutos.
+    Task Celery: busca pedidos de TODOS os status configurados no Bling e
+    agenda os envios de WhatsApp.
+    Roda via Celery Beat a cada 30 minutos; uma execução por vez.
     """
-    empresas = Empresa.objects.filter(
+    if not cache.add(SYNC_LOCK_KEY, 1, timeout=SYNC_LOCK_TTL):
+        logger.warning("Sync Bling anterior ainda em andamento, pulando")
+        return {'ignorado': 'sync em andamento'}
+    try:
+        return _sync_todos_status()
+    finally:
+        cache.delete(SYNC_LOCK_KEY)
+
+
+def _sync_todos_status():
+    empresas = list(Empresa.objects.filter(
         ativo=True,
         bling_client_id__gt='',
-    )
+    ))
 
-    resultados = {}
-    for empresa in empresas:
-        resultados[empresa.slug] = {}
-        for status, config in BLING_STATUS_MAP.items():
-            situacao_id = getattr(empresa, config['campo_situacao'], '')
-            if not situacao_id:
-                continue  # Status não configurado para esta empresa
-            try:
-                stats = sync_empresa_pedidos_por_status(empresa, status)
-                resultados[empresa.slug][status] = stats
-                logger.info(
-                    f"[{empresa.nome}] [{status}] Sync concluído: "
-                    f"{stats['enviados']} enviados, {stats['ja_enviados']} já enviados, "
-                    f"{stats['erros']} erros, {stats['sem_telefone']} sem telefone"
-                )
-            except Exception as e:
-                logger.error(f"[{empresa.nome}] [{status}] Erro fatal no sync: {e}")
-                resultados[empresa.slug][status] = {'erro': str(e)}
+    alvos = [(empresa, status) for empresa in empresas for status in _status_configurados(empresa)]
+    por_alvo = sincronizar(alvos)
+
+    resultados = {empresa.slug: {} for empresa in empresas}
+    for empresa, status in alvos:
+        stats = por_alvo[(empresa.id, status)]
+        resultados[empresa.slug][status] = stats
+        logger.info(
+            f"[{empresa.nome}] [{status}] Sync concluído: "
+            f"{stats['agendados']} agendados, {stats['ja_enviados']} já enviados, "
+            f"{stats['erros']} erros, {stats['sem_telefone']} sem telefone"
+        )
 
     return resultados
 
@@ -237,7 +559,8 @@ def refresh_bling_tokens():
     for token in tokens:
         try:
             client = BlingClient(token.empresa)
-            client.refresh_access_token()
-            logger.info(f"Token Bling renovado para {token.empresa.nome}")
+            # Se um worker renovou desde a consulta acima, não renova de novo
+            if client.refresh_access_token(token_visto=token.access_token) is not None:
+                logger.info(f"Token Bling renovado para {token.empresa.nome}")
         except Exception as e:
             logger.error(f"Erro ao renovar token Bling para {token.empresa.nome}: {e}")
@@ -0,0 +1,208 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from bling import services, tasks
+from bling.models import BlingPedidoEnviado, BlingSyncCursor, BlingToken
+from comunicacao.services.ratelimit import PAUSA_BASE, BucketRedis
+from tenants.models import Empresa
+
+
+def _pedido(pedido_id, telefone='16999990000'):
+    return {
+        'id': pedido_id, 'numero': str(1000 + pedido_id),
+        'contato': {'nome': 'Ana Souza', 'celular': telefone},
+    }
+
+
+@override_settings(BLING_ENVIO_INTERVALO_MIN=45, BLING_ENVIO_INTERVALO_MAX=45)
+class SyncPedidosTests(TestCase):
+    """Testes do sync Bling → WhatsApp com envios agendados"""
+
+    def setUp(self):
+        cache.clear()
+        self.empresa = Empresa.objects.create(
+            nome='Loja', slug='loja', bling_client_id='cid', bling_situacao_transito_id='15',
+        )
+
+    def _sync(self, pedidos, enviar=None):
+        enviar = enviar or mock.Mock(return_value={'success': True})
+        with mock.patch('bling.services.BlingClient._get_access_token', return_value='tok'), \
+                mock.patch('bling.services.BlingClient.get_pedidos_por_situacao', return_value=pedidos), \
+                mock.patch('bling.tasks._enviar_via_wapi', enviar), \
+                mock.patch('bling.tasks.enviar_notificacao_pedido.apply_async') as agendar, \
+                mock.patch('bling.tasks.time.sleep') as sleep:
+            stats = tasks.sync_empresa_pedidos_por_status(self.empresa, 'em-transito')
+        sleep.assert_not_called()
+        return stats, agendar
+
+    def _desde_pedido(self, side_effect=None):
+        """alterados_desde usado na busca do próximo sync."""
+        with mock.patch('bling.services.BlingClient._get_access_token', return_value='tok'), \
+                mock.patch(
+                    'bling.services.BlingClient.get_pedidos_por_situacao',
+                    return_value=[], side_effect=side_effect,
+                ) as buscar:
+            stats = tasks.sync_empresa_pedidos_por_status(self.empresa, 'em-transito')
+        return buscar.call_args.kwargs['alterados_desde'], stats
+
+    def test_agenda_envios_espacados_sem_esperar(self):
+        stats, agendar = self._sync([_pedido(1), _pedido(2), _pedido(3, telefone='')])
+
+        self.assertEqual((stats['agendados'], stats['sem_telefone']), (2, 1))
+        countdowns = [c.kwargs['countdown'] for c in agendar.call_args_list]
+        self.assertEqual(countdowns[0], 0)
+        self.assertAlmostEqual(countdowns[1], 45, delta=1)
+        self.assertEqual(
+            set(BlingPedidoEnviado.objects.values_list('situacao', flat=True)), {'agendado'},
+        )
+
+        # Sync seguinte: reservados não são agendados de novo; novos vão para o fim da fila
+        stats, agendar = self._sync([_pedido(1), _pedido(2), _pedido(4)])
+        self.assertEqual((stats['agendados'], stats['ja_enviados']), (1, 2))
+        self.assertAlmostEqual(agendar.call_args.kwargs['countdown'], 90, delta=2)
+
+    def test_task_envia_uma_vez(self):
+        self._sync([_pedido(1)])
+        enviar = mock.Mock(return_value={'success': True})
+        with mock.patch('bling.tasks._enviar_via_wapi', enviar):
+            tasks.enviar_notificacao_pedido(self.empresa.id, 'em-transito', '1')
+            repetido = tasks.enviar_notificacao_pedido(self.empresa.id, 'em-transito', '1')
+
+        enviar.assert_called_once()
+        self.assertFalse(repetido['success'])
+        self.assertEqual(BlingPedidoEnviado.objects.get().situacao, 'enviado')
+
+    def test_falha_reagendada_pelo_sync(self):
+        self._sync([_pedido(1)])
+        falhar = mock.patch('bling.tasks._enviar_via_wapi', return_value={'success': False, 'error': 'x'})
+        with falhar:
+            tasks.enviar_notificacao_pedido(self.empresa.id, 'em-transito', '1')
+
+        registro = BlingPedidoEnviado.objects.get()
+        self.assertEqual((registro.situacao, registro.tentativas), ('falha', 1))
+
+        # Sync incremental sem o pedido: só reagenda depois da espera
+        stats, agendar = self._sync([])
+        self.assertEqual(stats['reagendados'], 0)
+        BlingPedidoEnviado.objects.update(agendar_para=timezone.now())
+        stats, agendar = self._sync([])
+        self.assertEqual(stats['reagendados'], 1)
+        agendar.assert_called_once()
+        self.assertEqual(agendar.call_args.kwargs['args'], [self.empresa.id, 'em-transito', '1'])
+
+        # Sem novas tentativas depois de MAX_TENTATIVAS_ENVIO
+        BlingPedidoEnviado.objects.update(tentativas=tasks.MAX_TENTATIVAS_ENVIO - 1)
+        with falhar:
+            tasks.enviar_notificacao_pedido(self.empresa.id, 'em-transito', '1')
+        BlingPedidoEnviado.objects.update(agendar_para=timezone.now())
+        stats, _ = self._sync([])
+        self.assertEqual(stats['reagendados'], 0)
+        self.assertEqual(BlingPedidoEnviado.objects.get().situacao, 'falha')
+
+    def test_reserva_perdida_reagendada_sem_reconciliacao(self):
+        self._sync([_pedido(1)])
+        # Task perdida (worker reiniciado): reserva 'agendado' vencida
+        BlingPedidoEnviado.objects.update(agendar_para=timezone.now() - tasks.RESERVA_EXPIRA * 2)
+
+        stats, agendar = self._sync([])
+
+        self.assertEqual(stats['reagendados'], 1)
+        agendar.assert_called_once()
+        registro = BlingPedidoEnviado.objects.get()
+        self.assertEqual((registro.situacao, registro.tentativas), ('agendado', 0))
+
+    def test_pagina_ate_o_fim(self):
+        paginas = {1: [_pedido(i) for i in range(100)], 2: [_pedido(100 + i) for i in range(5)]}
+        with mock.patch('bling.services.BlingClient._get_access_token', return_value='tok'), \
+                mock.patch(
+                    'bling.services.BlingClient.get_pedidos_por_situacao',
+                    side_effect=lambda situacao_id, pagina=1, **kwargs: paginas.get(pagina, []),
+                ) as buscar, \
+                mock.patch('bling.tasks.enviar_notificacao_pedido.apply_async'):
+            stats = tasks.sync_empresa_pedidos_por_status(self.empresa, 'em-transito')
+
+        self.assertEqual(buscar.call_count, 2)
+        self.assertEqual((stats['total'], stats['agendados']), (105, 105))
+
+
+    def test_marca_dagua_incremental_e_reconciliacao(self):
+        desde, stats = self._desde_pedido()
+        self.assertIsNone(desde)  # primeiro sync: completo
+        self.assertFalse(stats['incremental'])
+        cursor = BlingSyncCursor.objects.get(empresa=self.empresa)
+
+        desde, stats = self._desde_pedido()
+        self.assertEqual(desde, cursor.ultima_alteracao - tasks.MARGEM_MARCA_DAGUA)
+        self.assertTrue(stats['incremental'])
+
+        # Erro na busca: a marca não avança
+        cursor.refresh_from_db()
+        antes = cursor.ultima_alteracao
+        self._desde_pedido(side_effect=RuntimeError('timeout'))
+        cursor.refresh_from_db()
+        self.assertEqual(cursor.ultima_alteracao, antes)
+
+        # Reconciliação vencida: completo de novo
+        BlingSyncCursor.objects.update(ultima_reconciliacao=timezone.now() - timedelta(days=2))
+        desde, _ = self._desde_pedido()
+        self.assertIsNone(desde)
+
+
+class BlingClientTests(TestCase):
+    """Testes do limite de taxa e dos tokens do cliente Bling"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja', bling_client_id='cid-taxa')
+        services._buckets.clear()
+        services._tokens.clear()
+
+    def _token(self, access_token='tok-1', minutos=60):
+        return BlingToken.objects.create(
+            empresa=self.empresa, access_token=access_token, refresh_token='ref-1',
+            expires_at=timezone.now() + timedelta(minutes=minutos),
+        )
+
+    def test_token_em_cache_sem_consulta(self):
+        self._token()
+        self.assertEqual(services.BlingClient(self.empresa)._get_access_token(), 'tok-1')
+        with self.assertNumQueries(0):
+            self.assertEqual(services.BlingClient(self.empresa)._get_access_token(), 'tok-1')
+
+    def test_renovacao_single_flight(self):
+        self._token(minutos=2)
+        resposta = mock.Mock(status_code=200, json=lambda: {
+            'access_token': 'tok-2', 'refresh_token': 'ref-2', 'expires_in': 21600,
+        })
+        with mock.patch('bling.services.http.request', return_value=resposta) as request:
+            # Perto de expirar: renova uma vez
+            self.assertEqual(services.BlingClient(self.empresa)._get_access_token(), 'tok-2')
+            # Quem decidiu renovar com o token antigo encontra o novo e não chama o Bling
+            self.assertIsNone(services.BlingClient(self.empresa).refresh_access_token(token_visto='tok-1'))
+
+        request.assert_called_once()
+        self.assertEqual(BlingToken.objects.get().refresh_token, 'ref-2')
+
+    def test_429_pausa_e_repete(self):
+        respostas = [mock.Mock(status_code=429), mock.Mock(status_code=200, json=lambda: {'data': [1]})]
+        client = services.BlingClient(self.empresa)
+        with mock.patch.object(client, '_get_access_token', return_value='tok'), \
+                mock.patch('bling.services.http.request', side_effect=respostas) as request, \
+                mock.patch('bling.services._aguardar_vez') as aguardar:
+            self.assertEqual(client.get_pedidos_por_situacao('15'), [1])
+
+        self.assertEqual((request.call_count, aguardar.call_count), (2, 2))
+        bucket = services._bucket('cid-taxa')
+        self.assertLess(bucket.taxa, 3)
+        self.assertGreater(bucket.tentar(), PAUSA_BASE - 1)
+
+    @mock.patch('bling.services.get_redis')
+    def test_bucket_compartilhado_no_redis(self, get_redis):
+        bucket = services._bucket('cid-taxa')
+
+        self.assertIsInstance(bucket, BucketRedis)
+        self.assertEqual(bucket.key, 'rl:bling:cid-taxa')
+        self.assertEqual(bucket.local.taxa_base, 3)
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from comunicacao.models import (
-    RegraComunicacao, ContatoBlacklist, FilaEnvio, EventoRecebido,
+    RegraComunicacao, ContatoBlacklist, ContatoEstado, FilaEnvio, EventoRecebido,
+    ConversaoAtribuida,
 )
 
 
@@ -47,7 +48,7 @@ class RegraComunicacaoAdmin(admin.ModelAdmin):
         ('Estatísticas', {
             'fields': (
                 'total_enviados', 'total_entregues', 'total_lidos',
-                'total_respondidos', 'total_convertidos',
+                'total_respondidos', 'total_convertidos', 'receita_convertida',
             ),
             'classes': ('collapse',),
         }),
@@ -55,7 +56,7 @@ class RegraComunicacaoAdmin(admin.ModelAdmin):
 
     readonly_fields = [
         'total_enviados', 'total_entregues', 'total_lidos',
-        'total_respondidos', 'total_convertidos',
+        'total_respondidos', 'total_convertidos', 'receita_convertida',
     ]
 
     def ativo_badge(self, obj):
@@ -88,6 +89,33 @@ class ContatoBlacklistAdmin(admin.ModelAdmin):
     detalhes_curto.short_description = 'Detalhes'
 
 
+@admin.register(ContatoEstado)
+class ContatoEstadoAdmin(admin.ModelAdmin):
+    list_display = [
+        'telefone', 'empresa', 'ultimo_envio_em', 'total_enviados',
+        'ignorados_consecutivos', 'bloqueado',
+    ]
+    list_filter = ['empresa', 'bloqueado']
+    search_fields = ['telefone']
+    readonly_fields = [
+        'empresa', 'telefone', 'ultimo_envio_em', 'total_enviados', 'envios_semana',
+        'ignorados_consecutivos', 'ultima_leitura_em', 'ultima_resposta_em',
+        'bloqueado', 'atualizado_em',
+    ]
+
+
+@admin.register(ConversaoAtribuida)
+class ConversaoAtribuidaAdmin(admin.ModelAdmin):
+    list_display = [
+        'order', 'regra', 'valor', 'carrinho_recuperado', 'enviado_em', 'convertido_em',
+    ]
+    list_filter = ['empresa', 'carrinho_recuperado', 'regra__gatilho']
+    readonly_fields = [
+        'empresa', 'order', 'mensagem', 'regra', 'fila_envio', 'valor',
+        'carrinho_recuperado', 'enviado_em', 'convertido_em', 'created_at',
+    ]
+
+
 @admin.register(FilaEnvio)
 class FilaEnvioAdmin(admin.ModelAdmin):
     list_display = [
@@ -131,9 +159,10 @@ class EventoRecebidoAdmin(admin.ModelAdmin):
     list_display = ['tipo', 'plataforma', 'empresa', 'processado', 'created_at']
     list_filter = ['empresa', 'tipo', 'plataforma', 'processado']
     readonly_fields = [
-        'empresa', 'tipo', 'plataforma', 'payload', 'lead', 'cart', 'customer',
-        'processado', 'processado_em', 'erro', 'created_at',
+        'empresa', 'tipo', 'plataforma', 'id_externo', 'payload', 'lead', 'cart', 'customer',
+        'processado', 'processado_em', 'erro', 'resultado', 'created_at',
     ]
+    search_fields = ['id_externo']
     ordering = ['-created_at']
 
     def has_add_permission(self, request):
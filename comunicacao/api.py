@@ -1,40 +1,34 @@
 """
 API genérica de eventos.
 POST /api/v1/events/ — recebe eventos de qualquer plataforma.
+POST /api/v1/events/batch/ — lote de eventos (array JSON ou NDJSON),
+    avaliados em background.
+
+Idempotência: header Idempotency-Key (ou campo "event_id" do evento; no
+lote, só o campo). Reenvios com a mesma chave devolvem o resultado
+original sem passar pelo motor de réguas.
 
 Autenticação: header X-API-Key com o slug da empresa + woo_webhook_secret.
 Formato: X-API-Key: slug:secret
 """
 import logging
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.utils import timezone
 import json
 
-from tenants.models import Empresa
+from tenants.cache import get_empresa_por_slug
 from comunicacao.models import EventoRecebido
+from comunicacao.services.capping import chunks
+from comunicacao.services.eventos import contato_do_evento, gatilhos_do_evento, resolver_customers
 from comunicacao.services.motor import avaliar_regras_para_gatilho
 
 logger = logging.getLogger(__name__)
 
-# Mapeamento tipo de evento → gatilho(s) de régua
-EVENTO_TO_GATILHO = {
-    'cart.abandoned': ['cart_abandoned'],
-    'order.created': ['order_created'],
-    'order.status_changed': [],  # resolvido dinamicamente
-    'lead.created': ['lead_new'],
-    'customer.created': ['customer_first_purchase'],
-}
-
-STATUS_TO_GATILHO = {
-    'processing': 'order_processing',
-    'embalado': 'order_shipped',
-    'em-transito': 'order_in_transit',
-    'completed': 'order_delivered',
-    'cancelled': 'order_cancelled',
-}
-
+ID_EXTERNO_MAX = EventoRecebido._meta.get_field('id_externo').max_length
 
 def _autenticar(request):
     """Autentica via X-API-Key header. Retorna Empresa ou None."""
@@ -43,9 +37,8 @@ def _autenticar(request):
         return None
 
     slug, secret = api_key.split(':', 1)
-    try:
-        empresa = Empresa.objects.get(slug=slug, ativo=True)
-    except Empresa.DoesNotExist:
+    empresa = get_empresa_por_slug(slug)
+    if not empresa:
         return None
 
     if empresa.woo_webhook_secret and empresa.woo_webhook_secret == secret:
@@ -54,6 +47,26 @@ def _autenticar(request):
     return None
 
 
+def _normalizar_chave(valor):
+    """Chave de idempotência como texto ('' se ausente, None se inválida)."""
+    if valor is None or isinstance(valor, (dict, list, bool)):
+        return '' if valor is None else None
+    chave = str(valor).strip()
+    return chave if len(chave) <= ID_EXTERNO_MAX else None
+
+
+def _resposta_duplicada(evento):
+    """Resultado original de um evento já recebido com a mesma chave."""
+    if not evento.processado:
+        # Ainda em processamento (requisição concorrente ou lote em background)
+        return JsonResponse({
+            'ok': True, 'event_id': evento.id, 'duplicate': True, 'processing': True,
+        }, status=202)
+    return JsonResponse({
+        'ok': True, 'event_id': evento.id, 'duplicate': True, **evento.resultado,
+    })
+
+
 @csrf_exempt
 @require_POST
 def receber_evento(request):
@@ -81,7 +94,8 @@ def receber_evento(request):
             "form_id": "form_123",
             "whatsapp": "16999999999",
             "nome": "João Silva",
-        }
+        },
+        "event_id": "id-unico-no-cliente"  // opcional (ou header Idempotency-Key)
     }
     """
     empresa = _autenticar(request)
@@ -107,76 +121,209 @@ def receber_evento(request):
             'error': f'invalid type. Valid: {tipos_validos}'
         }, status=400)
 
-    # Registrar evento
-    evento = EventoRecebido.objects.create(
-        empresa=empresa,
-        tipo=tipo,
-        plataforma=plataforma,
-        payload=data,
-    )
+    chave = _normalizar_chave(request.headers.get('Idempotency-Key') or body.get('event_id'))
+    if chave is None:
+        return JsonResponse({'error': 'invalid idempotency key'}, status=400)
 
-    # Processar evento → disparar réguas
-    resultados = _processar_evento(evento, empresa, tipo, data)
+    if chave:
+        existente = EventoRecebido.objects.filter(empresa=empresa, id_externo=chave).first()
+        if existente:
+            return _resposta_duplicada(existente)
 
-    evento.processado = True
-    evento.processado_em = timezone.now()
-    evento.save(update_fields=['processado', 'processado_em'])
+    # Registrar e processar na mesma transação: se a avaliação das réguas
+    # falhar, o evento não fica gravado como "em processamento" e um
+    # reenvio com a mesma chave processa de novo
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                evento = EventoRecebido.objects.create(
+                    empresa=empresa,
+                    tipo=tipo,
+                    plataforma=plataforma,
+                    payload=data,
+                    id_externo=chave,
+                )
+        except IntegrityError:
+            # Outra requisição com a mesma chave gravou primeiro
+            return _resposta_duplicada(
+                EventoRecebido.objects.get(empresa=empresa, id_externo=chave)
+            )
+
+        # Processar evento → disparar réguas
+        resultados = _processar_evento(evento, empresa, tipo, data)
+
+        evento.processado = True
+        evento.processado_em = timezone.now()
+        evento.resultado = {'rules_triggered': len([r for r in resultados if r[0]])}
+        evento.save(update_fields=['customer', 'processado', 'processado_em', 'resultado'])
 
     return JsonResponse({
         'ok': True,
         'event_id': evento.id,
-        'rules_triggered': len([r for r in resultados if r[0]]),
+        **evento.resultado,
     })
 
 
 def _processar_evento(evento, empresa, tipo, data):
-    """Processa evento e dispara réguas correspondentes."""
-    telefone = data.get('phone', data.get('whatsapp', ''))
-    nome = data.get('name', data.get('nome', 'Cliente'))
-
-    # Resolver gatilhos
-    gatilhos = list(EVENTO_TO_GATILHO.get(tipo, []))
-
-    # Para order.status_changed, resolver gatilho pelo novo status
-    if tipo == 'order.status_changed':
-        new_status = data.get('status', '')
-        gatilho = STATUS_TO_GATILHO.get(new_status)
-        if gatilho:
-            gatilhos.append(gatilho)
-
-    # Tentar encontrar objetos existentes
-    lead = None
-    cart = None
-    customer = None
-
-    if data.get('email'):
-        from customers.models import Customer
-        customer = Customer.objects.filter(
-            empresa=empresa, email=data['email'],
-        ).first()
-
-    if data.get('phone') and not customer:
-        from customers.models import Customer
-        from customers.services.wapi import formatar_telefone
-        tel = formatar_telefone(data['phone'])
-        if tel:
-            customer = Customer.objects.filter(
-                empresa=empresa, phone__endswith=tel[-8:],
-            ).first()
-
-    # Atualizar referências no evento
-    if customer:
-        evento.customer = customer
-    evento.save(update_fields=['customer'])
+    """Processa evento e dispara réguas correspondentes (preenche evento.customer)."""
+    gatilhos = gatilhos_do_evento(tipo, data)
+    customer = resolver_customers(empresa, [data])[0]
+    evento.customer = customer
 
     # Disparar réguas
     resultados = []
     for gatilho in gatilhos:
-        r = avaliar_regras_para_gatilho(
-            empresa, gatilho,
-            lead=lead, cart=cart, customer=customer,
-            telefone=telefone, nome=nome,
-        )
+        r = avaliar_regras_para_gatilho(empresa, gatilho, **contato_do_evento(data, customer))
         resultados.extend(r)
 
     return resultados
+
+
+def _ler_lote(request):
+    """
+    Eventos do corpo: array JSON, {"events": [...]} ou NDJSON (um evento
+    por linha). Retorna lista ou None se o corpo for inválido.
+    """
+    corpo = request.body.decode('utf-8', errors='replace')
+    ndjson = 'ndjson' in request.content_type or 'jsonlines' in request.content_type
+
+    if not ndjson:
+        try:
+            body = json.loads(corpo)
+        except json.JSONDecodeError:
+            ndjson = True
+        else:
+            if isinstance(body, dict):
+                body = body.get('events')
+            return body if isinstance(body, list) else None
+
+    eventos = []
+    for linha in corpo.splitlines():
+        if not linha.strip():
+            continue
+        try:
+            eventos.append(json.loads(linha))
+        except json.JSONDecodeError:
+            return None
+    return eventos
+
+
+@csrf_exempt
+@require_POST
+def receber_eventos_lote(request):
+    """
+    POST /api/v1/events/batch/
+
+    Body: array JSON de eventos no formato de /api/v1/events/, ou NDJSON
+    (Content-Type: application/x-ndjson). Máximo EVENTOS_LOTE_MAX eventos.
+
+    Os eventos válidos são gravados de uma vez e as réguas avaliadas em
+    background (tasks.processar_eventos). Resposta 202 com um item por
+    evento, na ordem recebida:
+        {"index": 0, "event_id": 123} ou {"index": 1, "error": "..."}
+    Eventos com "event_id" já recebido (antes ou no mesmo lote) não são
+    gravados de novo: {"index": 2, "event_id": 120, "duplicate": true}
+    """
+    empresa = _autenticar(request)
+    if not empresa:
+        return JsonResponse({'error': 'unauthorized'}, status=401)
+
+    eventos = _ler_lote(request)
+    if eventos is None:
+        return JsonResponse({'error': 'invalid json'}, status=400)
+    if not eventos:
+        return JsonResponse({'error': 'empty batch'}, status=400)
+
+    maximo = getattr(settings, 'EVENTOS_LOTE_MAX', 1000)
+    if len(eventos) > maximo:
+        return JsonResponse({'error': f'batch too large (max {maximo})'}, status=413)
+
+    tipos_validos = {c[0] for c in EventoRecebido.TIPO_CHOICES}
+    itens = []
+    novos = []
+    duplicados = []
+    vistos = set()
+    for i, body in enumerate(eventos):
+        if not isinstance(body, dict):
+            itens.append({'index': i, 'error': 'invalid event'})
+            continue
+        tipo = body.get('type', '')
+        data = body.get('data', {})
+        if not tipo:
+            itens.append({'index': i, 'error': 'missing type'})
+            continue
+        if tipo not in tipos_validos:
+            itens.append({'index': i, 'error': 'invalid type'})
+            continue
+        if not isinstance(data, dict):
+            itens.append({'index': i, 'error': 'invalid data'})
+            continue
+        chave = _normalizar_chave(body.get('event_id'))
+        if chave is None:
+            itens.append({'index': i, 'error': 'invalid event_id'})
+            continue
+        item = {'index': i}
+        itens.append(item)
+        if chave and chave in vistos:
+            duplicados.append((item, chave))
+            continue
+        if chave:
+            vistos.add(chave)
+        novos.append((item, EventoRecebido(
+            empresa=empresa,
+            tipo=tipo,
+            plataforma=body.get('platform', 'api'),
+            payload=data,
+            id_externo=chave,
+        )))
+
+    criados, ids_por_chave = _gravar_lote(empresa, novos, duplicados)
+    for item, chave in duplicados:
+        item['event_id'] = ids_por_chave[chave]
+        item['duplicate'] = True
+
+    if criados:
+        from comunicacao.tasks import processar_eventos
+        ids = [e.id for e in criados]
+        transaction.on_commit(lambda: processar_eventos.delay(ids))
+
+    return JsonResponse({
+        'ok': True,
+        'accepted': len(criados),
+        'duplicates': len(duplicados),
+        'rejected': len(itens) - len(criados) - len(duplicados),
+        'events': itens,
+    }, status=202)
+
+
+def _gravar_lote(empresa, novos, duplicados):
+    """
+    bulk_create dos eventos novos. Os de chave já gravada (inclusive por
+    um lote concorrente) passam para duplicados.
+    Retorna (criados, {id_externo: event_id}).
+    """
+    ids_por_chave = {}
+    for tentativa in range(2):
+        chaves = [e.id_externo for _, e in novos if e.id_externo and e.id_externo not in ids_por_chave]
+        for bloco in chunks(chaves):
+            ids_por_chave.update(
+                EventoRecebido.objects.filter(empresa=empresa, id_externo__in=bloco)
+                .values_list('id_externo', 'id')
+            )
+        duplicados.extend((item, e.id_externo) for item, e in novos if e.id_externo in ids_por_chave)
+        novos = [(item, e) for item, e in novos if e.id_externo not in ids_por_chave]
+        try:
+            with transaction.atomic():
+                criados = EventoRecebido.objects.bulk_create([e for _, e in novos], batch_size=500)
+            break
+        except IntegrityError:
+            if tentativa:
+                raise
+            for _, e in novos:
+                e.pk = None
+
+    for item, evento in novos:
+        item['event_id'] = evento.id
+        if evento.id_externo:
+            ids_por_chave[evento.id_externo] = evento.id
+    return criados, ids_por_chave
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ComunicacaoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'comunicacao'
+
+    def ready(self):
+        from comunicacao import signals  # noqa: F401
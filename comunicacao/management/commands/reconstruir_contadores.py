@@ -0,0 +1,46 @@
+"""
+Management command para reconstruir os contadores de capping no Redis
+a partir do banco (mensagens_whatsapp / fila_envio).
+
+Uso:
+    python manage.py reconstruir_contadores
+    python manage.py reconstruir_contadores --empresa=tarragona
+"""
+from django.core.management.base import BaseCommand
+
+from tenants.models import Empresa
+from comunicacao.services import contadores
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói os contadores de frequency capping (Redis) a partir do banco'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--empresa', type=str,
+            help='Slug da empresa (se omitido, processa todas ativas)'
+        )
+
+    def handle(self, *args, **options):
+        empresa_slug = options.get('empresa')
+
+        if empresa_slug:
+            empresas = Empresa.objects.filter(slug=empresa_slug)
+            if not empresas.exists():
+                self.stderr.write(f"Empresa '{empresa_slug}' não encontrada")
+                return
+        else:
+            empresas = Empresa.objects.filter(ativo=True)
+
+        for empresa in empresas:
+            resultado = contadores.reconstruir(empresa)
+            if not resultado['success']:
+                self.stderr.write(self.style.ERROR(
+                    f"{empresa.nome}: {resultado['error']}"
+                ))
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f"{empresa.nome}: {resultado['telefones']} telefones, "
+                f"{resultado['envios_hoje']} envios hoje, "
+                f"{resultado['cooldowns']} cooldowns"
+            ))
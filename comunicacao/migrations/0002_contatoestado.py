@@ -0,0 +1,40 @@
+# Generated by Django 4.2.16 on 2026-10-19 06:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0014_add_meta_webhook_fields'),
+        ('comunicacao', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContatoEstado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telefone', models.CharField(max_length=20)),
+                ('ultimo_envio_em', models.DateTimeField(blank=True, null=True)),
+                ('total_enviados', models.IntegerField(default=0)),
+                ('envios_por_dia', models.JSONField(blank=True, default=dict, help_text='Envios dos últimos 7 dias: {"AAAA-MM-DD": n}')),
+                ('ignorados_consecutivos', models.IntegerField(default=0, help_text='Mensagens Meta seguidas sem leitura nem resposta.')),
+                ('ultima_leitura_em', models.DateTimeField(blank=True, null=True)),
+                ('ultima_resposta_em', models.DateTimeField(blank=True, null=True)),
+                ('bloqueado', models.BooleanField(default=False, help_text='Espelho da ContatoBlacklist.')),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='contatos_estado', to='tenants.empresa')),
+            ],
+            options={
+                'verbose_name': 'Estado do Contato',
+                'verbose_name_plural': 'Estados dos Contatos',
+                'db_table': 'contato_estado',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='contatoestado',
+            constraint=models.UniqueConstraint(fields=('empresa', 'telefone'), name='unique_estado_per_empresa'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-19 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comunicacao', '0002_contatoestado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filaenvio',
+            name='lease_ate',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='filaenvio',
+            name='lease_dono',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.16 on 2026-10-19 06:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0014_add_meta_webhook_fields'),
+        ('customers', '0013_mensagemwhatsapp_resposta_a'),
+        ('comunicacao', '0003_fila_envio_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='regracomunicacao',
+            name='receita_convertida',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Soma dos pedidos atribuídos à régua (services.atribuicao).', max_digits=12),
+        ),
+        migrations.CreateModel(
+            name='AtribuicaoCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultimo_order_id', models.BigIntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('empresa', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='atribuicao_cursor', to='tenants.empresa')),
+            ],
+            options={
+                'db_table': 'atribuicao_cursor',
+            },
+        ),
+        migrations.CreateModel(
+            name='ConversaoAtribuida',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valor', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('carrinho_recuperado', models.BooleanField(default=False, help_text='A mensagem atribuída era de carrinho abandonado.')),
+                ('enviado_em', models.DateTimeField()),
+                ('convertido_em', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversoes', to='tenants.empresa')),
+                ('fila_envio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='conversoes', to='comunicacao.filaenvio')),
+                ('mensagem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversoes', to='customers.mensagemwhatsapp')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='conversao', to='customers.order')),
+                ('regra', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='conversoes', to='comunicacao.regracomunicacao')),
+            ],
+            options={
+                'verbose_name': 'Conversão Atribuída',
+                'verbose_name_plural': 'Conversões Atribuídas',
+                'db_table': 'conversoes_atribuidas',
+                'indexes': [models.Index(fields=['empresa', '-convertido_em'], name='conversoes__empresa_417153_idx'), models.Index(fields=['regra', '-convertido_em'], name='conversoes__regra_i_56075a_idx')],
+            },
+        ),
+    ]
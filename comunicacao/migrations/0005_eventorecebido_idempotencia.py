@@ -0,0 +1,27 @@
+# Generated by Django 4.2.16 on 2026-10-19 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comunicacao', '0004_atribuicao_conversoes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventorecebido',
+            name='id_externo',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='eventorecebido',
+            name='resultado',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddConstraint(
+            model_name='eventorecebido',
+            constraint=models.UniqueConstraint(condition=models.Q(('id_externo', ''), _negated=True), fields=('empresa', 'id_externo'), name='unique_evento_id_externo_per_empresa'),
+        ),
+    ]
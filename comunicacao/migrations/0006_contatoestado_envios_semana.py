@@ -0,0 +1,47 @@
+# Generated by Django 4.2.16 on 2026-10-19 10:00
+
+from datetime import datetime, time, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def converter_envios_por_dia(apps, schema_editor):
+    """
+    Contadores por dia → horários dos envios. Sem o horário real, cada
+    envio fica no fim do seu dia (limitado a agora): o contato continua
+    contando pelo maior tempo possível, nunca menos que antes.
+    """
+    ContatoEstado = apps.get_model('comunicacao', 'ContatoEstado')
+    agora = timezone.now()
+    inicio = timezone.localdate(agora) - timedelta(days=7)
+    for estado in ContatoEstado.objects.exclude(envios_por_dia={}).iterator(chunk_size=2000):
+        horarios = []
+        for dia, n in estado.envios_por_dia.items():
+            data = datetime.strptime(dia, '%Y-%m-%d').date()
+            if data < inicio:
+                continue
+            fim_do_dia = min(timezone.make_aware(datetime.combine(data, time.max)), agora)
+            horarios += [fim_do_dia.timestamp()] * n
+        if horarios:
+            ContatoEstado.objects.filter(pk=estado.pk).update(envios_semana=sorted(horarios))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comunicacao', '0005_eventorecebido_idempotencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contatoestado',
+            name='envios_semana',
+            field=models.JSONField(blank=True, default=list, help_text='Horários (epoch) dos envios dos últimos 7 dias.'),
+        ),
+        migrations.RunPython(converter_envios_por_dia, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='contatoestado',
+            name='envios_por_dia',
+        ),
+    ]
@@ -4,7 +4,10 @@ Motor de Réguas de Comunicação Inteligente.
 Permite configurar regras automatizadas de envio por empresa,
 com frequency capping, multi-step campaigns, e engagement tracking.
 """
+from datetime import timedelta
+
 from django.db import models
+from django.utils import timezone
 
 
 class RegraComunicacao(models.Model):
@@ -159,6 +162,10 @@ class RegraComunicacao(models.Model):
     total_lidos = models.IntegerField(default=0)
     total_respondidos = models.IntegerField(default=0)
     total_convertidos = models.IntegerField(default=0)
+    receita_convertida = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0,
+        help_text='Soma dos pedidos atribuídos à régua (services.atribuicao).',
+    )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -226,6 +233,77 @@ class ContatoBlacklist(models.Model):
         return f"{self.telefone} - {self.get_motivo_display()}"
 
 
+class ContatoEstado(models.Model):
+    """
+    Estado de engajamento por (empresa, telefone).
+    Mantido pelo sender e pelo webhook de status da Meta, para o motor
+    ler uma linha por contato em vez de varrer o histórico de mensagens.
+    Linhas que não existem são montadas a partir do histórico na primeira
+    avaliação (comunicacao.services.estado).
+
+    A janela semanal é deslizante (7×24h até agora), a mesma dos
+    contadores Redis (services.contadores), por isso os horários dos
+    envios são guardados em vez de um total por dia.
+    """
+    JANELA = timedelta(days=7)
+
+    empresa = models.ForeignKey(
+        'tenants.Empresa',
+        on_delete=models.CASCADE,
+        related_name='contatos_estado',
+    )
+    telefone = models.CharField(max_length=20)
+
+    # Envios
+    ultimo_envio_em = models.DateTimeField(null=True, blank=True)
+    total_enviados = models.IntegerField(default=0)
+    envios_semana = models.JSONField(
+        default=list, blank=True,
+        help_text='Horários (epoch) dos envios dos últimos 7 dias.',
+    )
+
+    # Engajamento
+    ignorados_consecutivos = models.IntegerField(
+        default=0,
+        help_text='Mensagens Meta seguidas sem leitura nem resposta.',
+    )
+    ultima_leitura_em = models.DateTimeField(null=True, blank=True)
+    ultima_resposta_em = models.DateTimeField(null=True, blank=True)
+
+    bloqueado = models.BooleanField(
+        default=False,
+        help_text='Espelho da ContatoBlacklist.',
+    )
+
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'contato_estado'
+        verbose_name = 'Estado do Contato'
+        verbose_name_plural = 'Estados dos Contatos'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['empresa', 'telefone'],
+                name='unique_estado_per_empresa'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.telefone} ({self.empresa_id})"
+
+    def msgs_semana(self, agora=None):
+        """Total de envios nos últimos 7×24h."""
+        inicio = ((agora or timezone.now()) - self.JANELA).timestamp()
+        return sum(1 for t in self.envios_semana if t >= inicio)
+
+    def somar_envio(self, quando):
+        """Guarda o horário do envio e descarta os que saíram da janela."""
+        inicio = (quando - self.JANELA).timestamp()
+        self.envios_semana = sorted(
+            [t for t in self.envios_semana if t >= inicio] + [quando.timestamp()]
+        )
+
+
 class FilaEnvio(models.Model):
     """
     Fila de mensagens agendadas para envio.
@@ -283,6 +361,11 @@ class FilaEnvio(models.Model):
     )
     erro = models.TextField(blank=True)
 
+    # Reserva do item por um worker (status=enviando). Leases vencidos
+    # voltam para pendente (tasks.liberar_leases_expirados).
+    lease_dono = models.CharField(max_length=100, blank=True)
+    lease_ate = models.DateTimeField(null=True, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
     processado_em = models.DateTimeField(null=True, blank=True)
 
@@ -305,6 +388,10 @@ class EventoRecebido(models.Model):
     """
     Log de eventos recebidos de qualquer plataforma.
     API genérica: POST /api/v1/events/
+
+    id_externo: chave de idempotência do cliente (header Idempotency-Key
+    ou campo event_id), única por empresa; reenvios devolvem o resultado
+    guardado em vez de criar outro evento.
     """
     TIPO_CHOICES = [
         ('cart.abandoned', 'Carrinho Abandonado'),
@@ -335,6 +422,7 @@ class EventoRecebido(models.Model):
 
     # Dados do evento
     payload = models.JSONField(default=dict)
+    id_externo = models.CharField(max_length=100, blank=True, default='')
 
     # Referências (preenchidas após processamento)
     lead = models.ForeignKey(
@@ -354,6 +442,8 @@ class EventoRecebido(models.Model):
     processado = models.BooleanField(default=False)
     processado_em = models.DateTimeField(null=True, blank=True)
     erro = models.TextField(blank=True)
+    # Resposta devolvida ao cliente (ex: {"rules_triggered": 2})
+    resultado = models.JSONField(default=dict, blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -366,6 +456,84 @@ class EventoRecebido(models.Model):
             models.Index(fields=['empresa', 'tipo', '-created_at']),
             models.Index(fields=['processado', '-created_at']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['empresa', 'id_externo'],
+                condition=~models.Q(id_externo=''),
+                name='unique_evento_id_externo_per_empresa',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.tipo} ({self.plataforma}) - {self.empresa.slug}"
+
+
+class ConversaoAtribuida(models.Model):
+    """
+    Pedido atribuído a uma mensagem enviada antes dele (janela e modelo de
+    atribuição em settings). regra/fila_envio vazios quando a mensagem não
+    veio de uma régua (ex: promoções).
+    Gerado por comunicacao.services.atribuicao.
+    """
+    empresa = models.ForeignKey(
+        'tenants.Empresa',
+        on_delete=models.CASCADE,
+        related_name='conversoes',
+    )
+    order = models.OneToOneField(
+        'customers.Order',
+        on_delete=models.CASCADE,
+        related_name='conversao',
+    )
+    mensagem = models.ForeignKey(
+        'customers.MensagemWhatsApp',
+        on_delete=models.CASCADE,
+        related_name='conversoes',
+    )
+    regra = models.ForeignKey(
+        RegraComunicacao, null=True, blank=True,
+        on_delete=models.SET_NULL, related_name='conversoes',
+    )
+    fila_envio = models.ForeignKey(
+        FilaEnvio, null=True, blank=True,
+        on_delete=models.SET_NULL, related_name='conversoes',
+    )
+
+    valor = models.DecimalField(max_digits=10, decimal_places=2)
+    carrinho_recuperado = models.BooleanField(
+        default=False,
+        help_text='A mensagem atribuída era de carrinho abandonado.',
+    )
+    enviado_em = models.DateTimeField()
+    convertido_em = models.DateTimeField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'conversoes_atribuidas'
+        verbose_name = 'Conversão Atribuída'
+        verbose_name_plural = 'Conversões Atribuídas'
+        indexes = [
+            models.Index(fields=['empresa', '-convertido_em']),
+            models.Index(fields=['regra', '-convertido_em']),
+        ]
+
+    def __str__(self):
+        return f"Pedido {self.order_id} ← mensagem {self.mensagem_id}"
+
+
+class AtribuicaoCursor(models.Model):
+    """Último pedido (pk) já processado pela atribuição, por empresa."""
+    empresa = models.OneToOneField(
+        'tenants.Empresa',
+        on_delete=models.CASCADE,
+        related_name='atribuicao_cursor',
+    )
+    ultimo_order_id = models.BigIntegerField(default=0)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'atribuicao_cursor'
+
+    def __str__(self):
+        return f"{self.empresa_id}: pedido {self.ultimo_order_id}"
@@ -0,0 +1,204 @@
+"""
+Atribuição de conversões: pedidos (customers.Order) creditados à mensagem
+WhatsApp enviada ao mesmo cliente/telefone dentro da janela anterior ao
+pedido.
+
+- Modelo: último toque (padrão) ou primeiro toque
+  (settings.ATRIBUICAO_MODELO = 'ultimo_toque' | 'primeiro_toque')
+- Janela: settings.ATRIBUICAO_JANELA_HORAS (padrão 7 dias)
+- Incremental: AtribuicaoCursor guarda o último pedido (pk) processado
+  por empresa; cada execução só olha pedidos inseridos depois
+- Por régua: total_convertidos e receita_convertida somados com F() na
+  mesma transação que grava as ConversaoAtribuida e avança o cursor
+
+Mensagens sem régua (promoções) também recebem crédito: se o último
+toque foi uma promoção, nenhuma régua converte aquele pedido.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+
+from comunicacao.models import AtribuicaoCursor, ConversaoAtribuida, FilaEnvio, RegraComunicacao
+from comunicacao.services.capping import chunks
+from customers.services.wapi import formatar_telefone
+
+logger = logging.getLogger(__name__)
+
+# Pedidos por página (uma transação por página)
+LOTE = 1000
+
+STATUS_ENVIADO = ['enviado', 'entregue', 'lido']
+
+# Status de pedido que não contam como conversão (com ou sem prefixo wc-)
+STATUS_NAO_CONVERSAO = {'cancelled', 'failed', 'refunded', 'trash'}
+
+
+def _janela():
+    return timedelta(hours=getattr(settings, 'ATRIBUICAO_JANELA_HORAS', 7 * 24))
+
+
+def _primeiro_toque():
+    return getattr(settings, 'ATRIBUICAO_MODELO', 'ultimo_toque') == 'primeiro_toque'
+
+
+def _conta_como_conversao(order):
+    status = (order.status or '').lower()
+    if status.startswith('wc-'):
+        status = status[3:]
+    return status not in STATUS_NAO_CONVERSAO
+
+
+def _toques(empresa, pedidos, janela):
+    """
+    Mensagens enviadas aos clientes dos pedidos dentro da janela (uma
+    consulta por bloco de clientes). Retorna (por_customer, por_telefone),
+    conjuntos de (enviado_em, mensagem_id, tipo).
+    """
+    from customers.models import MensagemWhatsApp
+
+    customer_ids = list({p.customer_id for p in pedidos})
+    telefones = list({t for t in (formatar_telefone(p.customer.phone) for p in pedidos) if t})
+    inicio = min(p.created_at for p in pedidos) - janela
+    fim = max(p.created_at for p in pedidos)
+
+    por_customer = {}
+    por_telefone = {}
+    blocos = max(len(customer_ids), len(telefones), 1)
+    for i in range(0, blocos, 500):
+        ids, tels = customer_ids[i:i + 500], telefones[i:i + 500]
+        if not ids and not tels:
+            break
+        msgs = MensagemWhatsApp.objects.filter(
+            empresa=empresa,
+            status__in=STATUS_ENVIADO,
+            created_at__gte=inicio,
+            created_at__lte=fim,
+        ).filter(
+            Q(customer_id__in=ids) | Q(cart__customer_id__in=ids) | Q(destinatario_telefone__in=tels),
+        ).exclude(tipo='resposta_cliente').values_list(
+            'id', 'created_at', 'tipo', 'customer_id', 'cart__customer_id', 'destinatario_telefone',
+        )
+        for msg_id, enviado_em, tipo, customer_id, cart_customer_id, telefone in msgs:
+            toque = (enviado_em, msg_id, tipo)
+            for cid in {customer_id, cart_customer_id} - {None}:
+                por_customer.setdefault(cid, set()).add(toque)
+            por_telefone.setdefault(telefone, set()).add(toque)
+
+    return por_customer, por_telefone
+
+
+def _atribuir_pagina(empresa, pedidos):
+    """Retorna lista de ConversaoAtribuida (não salvas) para a página de pedidos."""
+    pedidos = [p for p in pedidos if _conta_como_conversao(p)]
+    if not pedidos:
+        return []
+
+    janela = _janela()
+    primeiro = _primeiro_toque()
+    por_customer, por_telefone = _toques(empresa, pedidos, janela)
+
+    escolhidos = []
+    for pedido in pedidos:
+        candidatos = por_customer.get(pedido.customer_id, set()) | por_telefone.get(
+            formatar_telefone(pedido.customer.phone), set(),
+        )
+        candidatos = [
+            t for t in candidatos
+            if pedido.created_at - janela <= t[0] <= pedido.created_at
+        ]
+        if not candidatos:
+            continue
+        toque = min(candidatos) if primeiro else max(candidatos)
+        escolhidos.append((pedido, toque))
+
+    if not escolhidos:
+        return []
+
+    # Régua de cada mensagem escolhida
+    filas = {}
+    for ids in chunks([t[1] for _, t in escolhidos]):
+        for fila_id, regra_id, mensagem_id in FilaEnvio.objects.filter(
+            mensagem_id__in=ids,
+        ).values_list('id', 'regra_id', 'mensagem_id'):
+            filas[mensagem_id] = (fila_id, regra_id)
+
+    conversoes = []
+    for pedido, (enviado_em, mensagem_id, tipo) in escolhidos:
+        fila_id, regra_id = filas.get(mensagem_id, (None, None))
+        conversoes.append(ConversaoAtribuida(
+            empresa=empresa,
+            order=pedido,
+            mensagem_id=mensagem_id,
+            regra_id=regra_id,
+            fila_envio_id=fila_id,
+            valor=pedido.total or Decimal('0'),
+            carrinho_recuperado=tipo == 'cart',
+            enviado_em=enviado_em,
+            convertido_em=pedido.created_at,
+        ))
+    return conversoes
+
+
+def _somar_nas_regras(conversoes):
+    por_regra = {}
+    for c in conversoes:
+        if c.regra_id:
+            n, receita = por_regra.get(c.regra_id, (0, Decimal('0')))
+            por_regra[c.regra_id] = (n + 1, receita + c.valor)
+
+    # update() não dispara signals (o cache de réguas segue válido)
+    for regra_id, (n, receita) in por_regra.items():
+        RegraComunicacao.objects.filter(id=regra_id).update(
+            total_convertidos=F('total_convertidos') + n,
+            receita_convertida=F('receita_convertida') + receita,
+        )
+
+
+def atribuir_empresa(empresa):
+    """
+    Processa os pedidos novos da empresa desde a última execução.
+    Retorna {'pedidos': n, 'conversoes': m, 'receita': Decimal}.
+    """
+    from customers.models import Order
+
+    AtribuicaoCursor.objects.get_or_create(empresa=empresa)
+
+    total_pedidos = 0
+    total_conversoes = 0
+    receita = Decimal('0')
+
+    while True:
+        with transaction.atomic():
+            # Trava o cursor: duas execuções simultâneas não atribuem o mesmo pedido
+            cursor = AtribuicaoCursor.objects.select_for_update().get(empresa=empresa)
+            pedidos = list(
+                Order.objects.filter(empresa=empresa, pk__gt=cursor.ultimo_order_id)
+                .select_related('customer').order_by('pk')[:LOTE]
+            )
+            if not pedidos:
+                break
+
+            conversoes = _atribuir_pagina(empresa, pedidos)
+            ConversaoAtribuida.objects.bulk_create(conversoes)
+            _somar_nas_regras(conversoes)
+
+            cursor.ultimo_order_id = pedidos[-1].pk
+            cursor.save(update_fields=['ultimo_order_id', 'atualizado_em'])
+
+        total_pedidos += len(pedidos)
+        total_conversoes += len(conversoes)
+        receita += sum((c.valor for c in conversoes), Decimal('0'))
+
+        if len(pedidos) < LOTE:
+            break
+
+    if total_pedidos:
+        logger.info(
+            f'[{empresa.slug}] Atribuição: {total_pedidos} pedidos, '
+            f'{total_conversoes} conversões (R$ {receita})'
+        )
+    return {'pedidos': total_pedidos, 'conversoes': total_conversoes, 'receita': receita}
@@ -0,0 +1,106 @@
+"""
+Cache em processo das réguas ativas por (empresa, gatilho).
+
+Cada worker guarda as réguas ativas da empresa (ordenadas por etapa e
+prioridade) e a cadeia de etapas, carregadas numa consulta só. A validade
+é controlada por um contador de versão no cache do Django (Redis em
+produção), incrementado pelos signals de save/delete de RegraComunicacao:
+por evento, uma leitura de chave no Redis em vez de uma consulta em
+regras_comunicacao.
+
+Os objetos RegraComunicacao do cache são compartilhados: não alterar.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+
+from comunicacao.models import RegraComunicacao
+
+# Idade máxima de uma entrada local, mesmo sem mudança de versão
+# (proteção contra invalidação perdida, ex: cache reiniciado)
+TTL_LOCAL = 300
+
+_entradas = {}
+_lock = threading.Lock()
+
+
+class RegrasGatilho:
+    """Réguas ativas de um gatilho, em ordem de etapa/prioridade."""
+
+    def __init__(self, regras):
+        self.regras = tuple(regras)
+        self._anterior = {}
+        for regra in self.regras:
+            if regra.etapa > 1:
+                self._anterior[regra.id] = next(
+                    (r for r in self.regras if r.etapa == regra.etapa - 1), None,
+                )
+
+    def __iter__(self):
+        return iter(self.regras)
+
+    def __len__(self):
+        return len(self.regras)
+
+    def etapa_anterior(self, regra):
+        """Régua da etapa anterior (None na etapa 1 ou se não existir)."""
+        return self._anterior.get(regra.id)
+
+
+_VAZIO = RegrasGatilho([])
+
+
+def _key_versao(empresa_id):
+    return f'regras:versao:{empresa_id}'
+
+
+def versao(empresa_id):
+    return cache.get(_key_versao(empresa_id))
+
+
+def invalidar(empresa_id):
+    """Incrementa a versão das réguas da empresa (todos os workers recarregam)."""
+    key = _key_versao(empresa_id)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Chave expirou entre o add e o incr
+        cache.set(key, 1, timeout=None)
+    with _lock:
+        _entradas.pop(empresa_id, None)
+
+
+def _carregar(empresa_id):
+    por_gatilho = {}
+    for regra in RegraComunicacao.objects.filter(
+        empresa_id=empresa_id, ativo=True,
+    ).order_by('gatilho', 'etapa', 'prioridade'):
+        por_gatilho.setdefault(regra.gatilho, []).append(regra)
+    return {gatilho: RegrasGatilho(regras) for gatilho, regras in por_gatilho.items()}
+
+
+def regras_da_empresa(empresa_id):
+    """{gatilho: RegrasGatilho} das réguas ativas da empresa."""
+    atual = versao(empresa_id)
+    agora = time.monotonic()
+    with _lock:
+        entrada = _entradas.get(empresa_id)
+    if entrada and entrada[0] == atual and agora - entrada[1] < TTL_LOCAL:
+        return entrada[2]
+
+    por_gatilho = _carregar(empresa_id)
+    with _lock:
+        _entradas[empresa_id] = (atual, agora, por_gatilho)
+    return por_gatilho
+
+
+def regras_do_gatilho(empresa_id, gatilho):
+    """RegrasGatilho ativas de (empresa, gatilho); vazio se não houver."""
+    return regras_da_empresa(empresa_id).get(gatilho, _VAZIO)
+
+
+def limpar():
+    with _lock:
+        _entradas.clear()
@@ -0,0 +1,209 @@
+"""
+Frequency capping em lote.
+
+Calcula todos os fatos de capping de uma régua para N telefones com
+consultas agrupadas, em vez de ~6 queries por telefone:
+
+1. Estado do contato (ContatoEstado): blacklist, mensagens na semana
+   e sequência de ignorados, uma linha indexada por telefone
+2. Último envio + total de envios desta régua por telefone
+3. Envios da régua hoje (um único COUNT)
+
+Com os contadores Redis ativos (services.contadores), a contagem da
+semana, o cooldown (2) e os envios do dia (3) vêm do Redis em um round-trip.
+
+Uso:
+    lote = CappingLote(regra, telefones)
+    ok, motivo = lote.pode_enviar(telefone)
+    lote.reservar_envio()            # envios em paralelo: vaga no max_dia
+    ...
+    lote.liberar_reserva()           # envio concluído, reagendado ou falhou
+    lote.registrar_envio(telefone)   # após envio com sucesso
+    lote.salvar_bloqueios()          # grava blacklist automática pendente
+"""
+import logging
+from datetime import timedelta
+
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from comunicacao.models import ContatoBlacklist, FilaEnvio
+from comunicacao.services import contadores, estado
+
+logger = logging.getLogger(__name__)
+
+# Tamanho máximo das listas IN (...) por consulta
+CHUNK_TELEFONES = 500
+
+
+def chunks(itens, tamanho=CHUNK_TELEFONES):
+    for i in range(0, len(itens), tamanho):
+        yield itens[i:i + tamanho]
+
+
+class CappingLote:
+    """Fatos de frequency capping de uma régua para um lote de telefones."""
+
+    def __init__(self, regra, telefones):
+        self.regra = regra
+        self.empresa_id = regra.empresa_id
+        self.telefones = list(dict.fromkeys(t for t in telefones if t))
+
+        self.blacklist = set()
+        self.msgs_semana = {}
+        self.cooldown_ate = {}
+        self.envios_regra = {}
+        self.ignorados = {}
+        self.envios_hoje = 0
+        # Envios aprovados ainda sem resultado (contam para o max_dia)
+        self.reservados = 0
+
+        self._bloqueios_pendentes = {}
+
+        if self.telefones:
+            self._carregar()
+
+    # ------------------------------------------------------------------
+    # Carga (consultas agrupadas)
+    # ------------------------------------------------------------------
+
+    def _carregar(self):
+        regra = self.regra
+        agora = timezone.now()
+
+        redis = contadores.carregar(regra, self.telefones)
+        if redis is not None:
+            self.msgs_semana = redis['msgs_semana']
+            self.cooldown_ate = redis['cooldown_ate']
+            self.envios_hoje = redis['envios_hoje']
+
+        for tels in chunks(self.telefones):
+            for tel, est in estado.carregar(self.empresa_id, tels).items():
+                if est.bloqueado:
+                    self.blacklist.add(tel)
+                if redis is None:
+                    self.msgs_semana[tel] = est.msgs_semana(agora)
+                self.ignorados[tel] = est.ignorados_consecutivos
+
+            precisa_cooldown = regra.cooldown_horas > 0 and redis is None
+            if precisa_cooldown or regra.max_envios_total > 0:
+                for tel, ultimo, total in (
+                    FilaEnvio.objects.filter(
+                        regra=regra, telefone__in=tels, status='enviado',
+                    ).values('telefone')
+                    .annotate(ultimo=Max('processado_em'), total=Count('id'))
+                    .values_list('telefone', 'ultimo', 'total')
+                ):
+                    if precisa_cooldown and ultimo:
+                        self.cooldown_ate[tel] = ultimo + timedelta(hours=regra.cooldown_horas)
+                    self.envios_regra[tel] = total
+
+        if regra.max_envios_dia > 0 and redis is None:
+            hoje_inicio = agora.replace(hour=0, minute=0, second=0, microsecond=0)
+            self.envios_hoje = FilaEnvio.objects.filter(
+                regra=regra,
+                status='enviado',
+                processado_em__gte=hoje_inicio,
+            ).count()
+
+    # ------------------------------------------------------------------
+    # Avaliação
+    # ------------------------------------------------------------------
+
+    def pode_enviar(self, telefone):
+        """
+        Mesmas regras (e mesma ordem) de motor.pode_enviar.
+        Retorna (pode, motivo).
+        """
+        regra = self.regra
+
+        # 1. Blacklist
+        if telefone in self.blacklist:
+            return False, 'blacklist'
+
+        # 2. Max msgs por semana
+        if self.msgs_semana.get(telefone, 0) >= regra.max_msgs_semana_telefone:
+            return False, f'max_semana ({regra.max_msgs_semana_telefone})'
+
+        # 3. Cooldown da régra
+        if regra.cooldown_horas > 0:
+            cooldown_ate = self.cooldown_ate.get(telefone)
+            if cooldown_ate and timezone.now() < cooldown_ate:
+                return False, f'cooldown ({regra.cooldown_horas}h)'
+
+        # 4. Max envios total por contato
+        if regra.max_envios_total > 0:
+            if self.envios_regra.get(telefone, 0) >= regra.max_envios_total:
+                return False, f'max_total ({regra.max_envios_total})'
+
+        # 5. Ignorados consecutivos → blacklist automática
+        if regra.max_ignorados_consecutivos > 0:
+            ign = self.ignorados.get(telefone, 0)
+            if ign >= regra.max_ignorados_consecutivos:
+                self.blacklist.add(telefone)
+                self._bloqueios_pendentes[telefone] = ign
+                return False, f'ignorados ({ign}x)'
+
+        # 6. Max envios da régra por dia (anti-spam global)
+        if regra.max_envios_dia > 0 and self.envios_hoje + self.reservados >= regra.max_envios_dia:
+            return False, f'max_dia ({regra.max_envios_dia})'
+
+        return True, 'ok'
+
+    def reservar_envio(self):
+        """
+        Reserva uma vaga do max_envios_dia para um envio aprovado que
+        ainda vai acontecer (o sender envia a rodada em paralelo e só
+        registra os envios no fim).
+        """
+        self.reservados += 1
+
+    def liberar_reserva(self):
+        self.reservados = max(self.reservados - 1, 0)
+
+    def registrar_envio(self, telefone, mesma_regra=True, canal='meta'):
+        """
+        Atualiza os contadores em memória após um envio com sucesso,
+        para que os próximos itens do mesmo lote vejam o envio.
+        mesma_regra=False: envio de outra régua da mesma empresa
+        (só conta para o limite semanal e ignorados).
+        """
+        self.msgs_semana[telefone] = self.msgs_semana.get(telefone, 0) + 1
+        if canal == 'meta':
+            self.ignorados[telefone] = self.ignorados.get(telefone, 0) + 1
+        if mesma_regra:
+            self.cooldown_ate[telefone] = timezone.now() + timedelta(hours=self.regra.cooldown_horas)
+            self.envios_regra[telefone] = self.envios_regra.get(telefone, 0) + 1
+            self.envios_hoje += 1
+
+    def salvar_bloqueios(self):
+        """Grava na blacklist os contatos bloqueados por ignorar mensagens."""
+        if not self._bloqueios_pendentes:
+            return 0
+        ContatoBlacklist.objects.bulk_create(
+            [
+                ContatoBlacklist(
+                    empresa_id=self.empresa_id,
+                    telefone=tel,
+                    motivo='too_many_ignored',
+                    detalhes=f'{ign} mensagens ignoradas consecutivamente',
+                )
+                for tel, ign in self._bloqueios_pendentes.items()
+            ],
+            ignore_conflicts=True,
+        )
+        estado.marcar_bloqueado(self.empresa_id, self._bloqueios_pendentes)
+        total = len(self._bloqueios_pendentes)
+        self._bloqueios_pendentes = {}
+        return total
+
+
+def pode_enviar_lote(regra, telefones):
+    """
+    Avalia capping de uma régua para vários telefones de uma vez.
+    Retorna {telefone: (pode, motivo)}.
+    """
+    lote = CappingLote(regra, telefones)
+    resultado = {tel: lote.pode_enviar(tel) for tel in lote.telefones}
+    lote.salvar_bloqueios()
+    return resultado
@@ -0,0 +1,206 @@
+"""
+Circuit breaker por provedor e instância ('meta', phone_number_id) /
+('wapi', instance).
+
+- fechado: envios normais; falhas seguidas de provedor (timeout, erro de
+  conexão, HTTP 5xx) são contadas
+- aberto: após CIRCUITO_FALHAS falhas seguidas, por CIRCUITO_ABERTO_SEGUNDOS;
+  o sender reagenda os itens em vez de tentar
+- meio-aberto: passado o tempo aberto, uma sonda por vez é liberada;
+  resposta do provedor fecha o circuito, falha abre de novo
+
+Erros do destinatário (4xx, número inválido) e rate limit não contam.
+
+Estado compartilhado entre workers no Redis:
+    cb:{provedor}:{instancia}:falhas   contador de falhas seguidas
+    cb:{provedor}:{instancia}:aberto   presente enquanto aberto (TTL)
+    cb:{provedor}:{instancia}:sonda    sonda em andamento (SET NX, TTL)
+Sem REDIS_URL (dev), o estado fica no processo.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from comunicacao.services.ratelimit import eh_limite_de_taxa
+from comunicacao.services.redis_conn import get_redis
+
+logger = logging.getLogger(__name__)
+
+# TTL do contador de falhas: falhas espaçadas além disso não se acumulam
+JANELA_FALHAS = 10 * 60
+# Tempo máximo de uma sonda (acima do timeout HTTP de 30s)
+TTL_SONDA = 45
+
+
+def _falhas_para_abrir():
+    return getattr(settings, 'CIRCUITO_FALHAS', 5)
+
+
+def _segundos_aberto():
+    return getattr(settings, 'CIRCUITO_ABERTO_SEGUNDOS', 60)
+
+
+def _key(provedor, instancia, sufixo):
+    return f'cb:{provedor}:{instancia}:{sufixo}'
+
+
+class _EstadoLocal:
+    """Subconjunto de comandos Redis usados aqui, em memória (dev/testes)."""
+
+    def __init__(self):
+        self._dados = {}
+        self._lock = threading.Lock()
+
+    def _vivo(self, key):
+        valor = self._dados.get(key)
+        if valor and valor[1] is not None and valor[1] <= time.monotonic():
+            del self._dados[key]
+            return None
+        return valor
+
+    def get(self, key):
+        with self._lock:
+            valor = self._vivo(key)
+            return valor[0] if valor else None
+
+    def ttl(self, key):
+        with self._lock:
+            valor = self._vivo(key)
+            if not valor:
+                return -2
+            return int(valor[1] - time.monotonic()) if valor[1] else -1
+
+    def set(self, key, valor, ex=None, nx=False):
+        with self._lock:
+            if nx and self._vivo(key):
+                return None
+            self._dados[key] = (valor, time.monotonic() + ex if ex else None)
+            return True
+
+    def incr_expire(self, key, ex):
+        with self._lock:
+            valor = self._vivo(key)
+            novo = int(valor[0] if valor else 0) + 1
+            self._dados[key] = (novo, time.monotonic() + ex)
+            return novo
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._dados.pop(key, None)
+
+
+_local = _EstadoLocal()
+
+
+class _EstadoRedis:
+    def __init__(self, r):
+        self.r = r
+
+    def get(self, key):
+        return self.r.get(key)
+
+    def ttl(self, key):
+        return self.r.ttl(key)
+
+    def set(self, key, valor, ex=None, nx=False):
+        return self.r.set(key, valor, ex=ex, nx=nx)
+
+    def incr_expire(self, key, ex):
+        pipe = self.r.pipeline(transaction=True)
+        pipe.incr(key)
+        pipe.expire(key, ex)
+        return pipe.execute()[0]
+
+    def delete(self, *keys):
+        self.r.delete(*keys)
+
+
+def _estado():
+    r = get_redis()
+    return _EstadoRedis(r) if r is not None else _local
+
+
+def falha_de_provedor(resultado):
+    """True se o resultado indica provedor degradado (não erro do destinatário)."""
+    if resultado.get('success') or eh_limite_de_taxa(resultado):
+        return False
+    status = resultado.get('status_code')
+    return status is None or status >= 500
+
+
+def permitir(provedor, instancia):
+    """
+    Retorna 0 se pode enviar, ou os segundos até a próxima tentativa
+    (circuito aberto, ou meio-aberto com sonda já em andamento).
+    Em erro de Redis, libera o envio.
+    """
+    if not instancia:
+        return 0
+    try:
+        estado = _estado()
+        if estado.get(_key(provedor, instancia, 'aberto')):
+            return max(estado.ttl(_key(provedor, instancia, 'aberto')), 1)
+        falhas = int(estado.get(_key(provedor, instancia, 'falhas')) or 0)
+        if falhas < _falhas_para_abrir():
+            return 0
+        # Meio-aberto: só uma sonda por vez
+        if estado.set(_key(provedor, instancia, 'sonda'), 1, ex=TTL_SONDA, nx=True):
+            logger.info(f'Circuito {provedor}:{instancia} meio-aberto, enviando sonda')
+            return 0
+        return max(estado.ttl(_key(provedor, instancia, 'sonda')), 1)
+    except Exception as e:
+        logger.warning(f'Circuito {provedor}:{instancia}: erro ao ler estado ({e})')
+        return 0
+
+
+def registrar(provedor, instancia, resultado):
+    """Registra o resultado de uma chamada ao provedor."""
+    if not instancia:
+        return
+    try:
+        estado = _estado()
+        if not falha_de_provedor(resultado):
+            # O provedor respondeu (mesmo que com erro do destinatário)
+            if estado.get(_key(provedor, instancia, 'falhas')):
+                estado.delete(_key(provedor, instancia, 'falhas'), _key(provedor, instancia, 'sonda'))
+                logger.info(f'Circuito {provedor}:{instancia} fechado')
+            return
+
+        falhas = estado.incr_expire(_key(provedor, instancia, 'falhas'), JANELA_FALHAS)
+        if falhas >= _falhas_para_abrir():
+            estado.set(_key(provedor, instancia, 'aberto'), int(time.time()), ex=_segundos_aberto())
+            estado.delete(_key(provedor, instancia, 'sonda'))
+            if falhas == _falhas_para_abrir():
+                logger.error(
+                    f'Circuito {provedor}:{instancia} aberto após {falhas} falhas seguidas: '
+                    f'{resultado.get("error", "")[:200]}'
+                )
+    except Exception as e:
+        logger.warning(f'Circuito {provedor}:{instancia}: erro ao registrar ({e})')
+
+
+def situacao(provedor, instancia):
+    """Estado para exibição: {'estado': 'fechado'|'aberto'|'meio-aberto', 'falhas', 'reabre_em'}."""
+    if not instancia:
+        return None
+    try:
+        estado = _estado()
+        falhas = int(estado.get(_key(provedor, instancia, 'falhas')) or 0)
+        if estado.get(_key(provedor, instancia, 'aberto')):
+            return {
+                'estado': 'aberto', 'falhas': falhas,
+                'reabre_em': max(estado.ttl(_key(provedor, instancia, 'aberto')), 0),
+            }
+        if falhas >= _falhas_para_abrir():
+            return {'estado': 'meio-aberto', 'falhas': falhas, 'reabre_em': 0}
+        return {'estado': 'fechado', 'falhas': falhas, 'reabre_em': 0}
+    except Exception as e:
+        logger.warning(f'Circuito {provedor}:{instancia}: erro ao ler estado ({e})')
+        return None
+
+
+def resetar(provedor, instancia):
+    _estado().delete(*(_key(provedor, instancia, s) for s in ('falhas', 'aberto', 'sonda')))
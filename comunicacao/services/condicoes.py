@@ -0,0 +1,217 @@
+"""
+Compilador das condições extras das réguas (RegraComunicacao.condicoes).
+
+O JSON vira um Q do Django para o queryset de origem dos contatos, e o
+filtro roda no banco junto com as exclusões de blacklist/fila/cooldown.
+
+Mesma semântica da avaliação em Python (avaliar):
+
+- min_cart_value só vale quando há carrinho (tipo 'cart')
+- condições de cliente valem para o customer do contato; em carrinhos
+  (sem customer) são ignoradas
+- campos nulos contam como 0
+
+Leads só conhecem o cliente relacionado depois de check_if_customer
+(busca por telefone em Python), então as condições de cliente de leads,
+e chaves com valor não numérico, ficam na avaliação em Python.
+
+A forma compilada fica em cache por (régua, tipo), invalidada quando
+regra.updated_at muda.
+"""
+import threading
+
+from django.db.models import Q
+
+from comunicacao.services.capping import chunks
+
+# chave → (campo do Customer, operador)
+CONDICOES_CLIENTE = {
+    'min_orders': ('completed_orders', 'gte'),
+    'max_orders': ('completed_orders', 'lte'),
+    'min_score': ('score', 'gte'),
+    'min_days_inactive': ('days_since_last_purchase', 'gte'),
+    'min_total_spent': ('total_spent', 'gte'),
+}
+
+CONDICOES_CARRINHO = {
+    'min_cart_value': ('cart_total', 'gte'),
+}
+
+# Contatos de um mesmo tipo a partir dos quais o filtro vai para o banco
+# (para um contato só, avaliar em memória sai mais barato que uma consulta)
+MIN_CONTATOS_SQL = 2
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _numero(valor):
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool)
+
+
+def _q_condicao(campo, operador, valor):
+    """Q equivalente a '(campo or 0) <operador> valor'."""
+    if operador == 'gte':
+        if valor <= 0:
+            return Q()
+        return Q(**{f'{campo}__gte': valor})
+    # lte: nulo conta como 0
+    if valor < 0:
+        return Q(pk__in=[])
+    return Q(**{f'{campo}__lte': valor}) | Q(**{f'{campo}__isnull': True})
+
+
+class CondicaoCompilada:
+    """
+    q: filtro para o queryset do tipo.
+    chaves_python: chaves que precisam de avaliar() depois de carregar o objeto.
+    """
+
+    def __init__(self, condicoes, q, chaves_python):
+        self.condicoes = condicoes
+        self.q = q
+        self.chaves_python = chaves_python
+
+    @property
+    def filtra_no_banco(self):
+        return bool(self.q)
+
+    def avaliar_python(self, lead=None, cart=None, customer=None):
+        if not self.chaves_python:
+            return True
+        return avaliar(self.condicoes, lead=lead, cart=cart, customer=customer, chaves=self.chaves_python)
+
+
+def _compilar(condicoes, tipo):
+    q = Q()
+    chaves_python = set()
+
+    for chave, valor in (condicoes or {}).items():
+        if chave in CONDICOES_CARRINHO:
+            if tipo != 'cart':
+                continue
+            campo, operador = CONDICOES_CARRINHO[chave]
+        elif chave in CONDICOES_CLIENTE:
+            if tipo == 'cart':
+                continue
+            if tipo != 'customer':
+                chaves_python.add(chave)
+                continue
+            campo, operador = CONDICOES_CLIENTE[chave]
+        else:
+            # Chave desconhecida: ignorada, como na avaliação em Python
+            continue
+
+        if not _numero(valor):
+            chaves_python.add(chave)
+            continue
+        q &= _q_condicao(campo, operador, valor)
+
+    return CondicaoCompilada(condicoes, q, frozenset(chaves_python))
+
+
+def compilar(regra, tipo):
+    """
+    Forma compilada das condições da régua para o tipo de contato
+    ('customer', 'cart' ou 'lead'), em cache pela versão da régua.
+    """
+    chave = (regra.id, tipo)
+    versao = regra.updated_at
+    with _cache_lock:
+        em_cache = _cache.get(chave)
+    if em_cache and em_cache[0] == versao and regra.id is not None:
+        return em_cache[1]
+
+    compilada = _compilar(regra.condicoes, tipo)
+    if regra.id is not None:
+        with _cache_lock:
+            _cache[chave] = (versao, compilada)
+    return compilada
+
+
+def limpar_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def avaliar(condicoes, lead=None, cart=None, customer=None, chaves=None):
+    """
+    Avalia as condições em Python sobre objetos já carregados.
+    chaves: restringe a avaliação a um subconjunto (None = todas).
+    """
+    if not condicoes:
+        return True
+
+    def usar(chave):
+        return chave in condicoes and (chaves is None or chave in chaves)
+
+    # Condições de carrinho
+    if usar('min_cart_value') and cart:
+        if float(cart.cart_total) < condicoes['min_cart_value']:
+            return False
+
+    # Condições de cliente
+    c = customer or (lead.related_customer if lead else None)
+    if c:
+        if usar('min_orders') and (c.completed_orders or 0) < condicoes['min_orders']:
+            return False
+        if usar('max_orders') and (c.completed_orders or 0) > condicoes['max_orders']:
+            return False
+        if usar('min_score') and (c.score or 0) < condicoes['min_score']:
+            return False
+        if usar('min_days_inactive') and (c.days_since_last_purchase or 0) < condicoes['min_days_inactive']:
+            return False
+        if usar('min_total_spent') and float(c.total_spent or 0) < condicoes['min_total_spent']:
+            return False
+
+    return True
+
+
+def _tipo_contato(contato):
+    """'customer' ou 'cart' quando o contato tem só esse objeto (salvo), senão None."""
+    presentes = [k for k in ('lead', 'cart', 'customer') if contato.get(k) is not None]
+    if len(presentes) == 1 and presentes[0] != 'lead' and contato[presentes[0]].pk:
+        return presentes[0]
+    return None
+
+
+def filtrar_contatos(regra, contatos):
+    """
+    Avalia as condições da régua para vários contatos (dicts com
+    lead/cart/customer). Grupos de customers ou carrinhos são filtrados
+    com uma consulta por tipo; o resto é avaliado em Python.
+    Retorna lista de bool na ordem dos contatos.
+    """
+    if not regra.condicoes:
+        return [True] * len(contatos)
+
+    from customers.models import Cart, Customer
+    modelos = {'customer': Customer, 'cart': Cart}
+
+    grupos = {}
+    for i, contato in enumerate(contatos):
+        tipo = _tipo_contato(contato)
+        if tipo:
+            grupos.setdefault(tipo, []).append(i)
+
+    aprovados = {}
+    for tipo, indices in grupos.items():
+        compilada = compilar(regra, tipo)
+        if len(indices) < MIN_CONTATOS_SQL or not compilada.filtra_no_banco:
+            continue
+        no_banco = set()
+        for pks in chunks([contatos[i][tipo].pk for i in indices]):
+            no_banco.update(
+                modelos[tipo].objects.filter(pk__in=pks).filter(compilada.q).values_list('pk', flat=True)
+            )
+        for i in indices:
+            obj = contatos[i][tipo]
+            aprovados[i] = obj.pk in no_banco and compilada.avaliar_python(**{tipo: obj})
+
+    return [
+        aprovados[i] if i in aprovados else avaliar(
+            regra.condicoes,
+            lead=contato.get('lead'), cart=contato.get('cart'), customer=contato.get('customer'),
+        )
+        for i, contato in enumerate(contatos)
+    ]
@@ -0,0 +1,258 @@
+"""
+Contadores de frequency capping no Redis.
+
+Evita COUNT sobre mensagens_whatsapp / fila_envio (tabelas que só crescem):
+
+- cap:{empresa_id}:tel:{telefone}        ZSET de envios (score = timestamp),
+                                          janela deslizante de 7 dias
+- cap:regra:{regra_id}:dia:{AAAAMMDD}     ZSET de envios da régua no dia (UTC)
+- cap:regra:{regra_id}:cooldown:{tel}     chave com TTL = cooldown_horas
+- cap:pronto:{empresa_id}                 marca que os contadores foram
+                                          reconstruídos a partir do banco
+                                          (TTL = janela semanal)
+
+Enquanto a empresa não tiver a marca (Redis novo/limpo), o capping continua
+usando o banco. A marca expira como os contadores (se o Redis despejar
+chaves, não sobra uma marca sem contadores) e a task diária
+comunicacao.renovar_contadores_capping reconstrói as empresas cuja marca
+sumiu ou está vencendo. Para popular na hora:
+python manage.py reconstruir_contadores
+
+Sem REDIS_URL (dev) os contadores ficam desligados.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from comunicacao.services.redis_conn import get_redis
+
+logger = logging.getLogger(__name__)
+
+JANELA_SEMANA = 7 * 24 * 3600
+# Margem de TTL além da janela (chaves somem sozinhas quando o telefone para de receber)
+MARGEM_TTL = 24 * 3600
+
+
+def _get_redis():
+    """Cliente Redis. None se desligado ou sem REDIS_URL."""
+    if not getattr(settings, 'CAPPING_CONTADORES_REDIS', True):
+        return None
+    return get_redis()
+
+
+# ---------------------------------------------------------------------------
+# Chaves
+# ---------------------------------------------------------------------------
+
+def _key_telefone(empresa_id, telefone):
+    return f'cap:{empresa_id}:tel:{telefone}'
+
+
+def _key_regra_dia(regra_id, quando):
+    return f'cap:regra:{regra_id}:dia:{quando.strftime("%Y%m%d")}'
+
+
+def _key_cooldown(regra_id, telefone):
+    return f'cap:regra:{regra_id}:cooldown:{telefone}'
+
+
+def _key_pronto(empresa_id):
+    return f'cap:pronto:{empresa_id}'
+
+
+def precisa_reconstruir(empresa_id):
+    """True se a marca da empresa não existe ou vence em menos de MARGEM_TTL."""
+    r = _get_redis()
+    if r is None:
+        return False
+    try:
+        return r.ttl(_key_pronto(empresa_id)) < MARGEM_TTL
+    except Exception as e:
+        logger.warning(f'Contadores capping: erro ao ler marca da empresa {empresa_id} ({e})')
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Escrita
+# ---------------------------------------------------------------------------
+
+def registrar_envio(empresa_id, telefone, membro, regra=None, quando=None):
+    """
+    Registra um envio com sucesso (MULTI/EXEC: tudo ou nada).
+
+    membro: identificador único do envio (ex: 'msg:123'), para que a
+    reconstrução a partir do banco não duplique.
+    regra: RegraComunicacao quando o envio veio de uma régua
+    (atualiza contador diário e cooldown).
+    """
+    r = _get_redis()
+    if r is None or not telefone:
+        return False
+
+    quando = quando or timezone.now()
+    score = quando.timestamp()
+    try:
+        pipe = r.pipeline(transaction=True)
+        key = _key_telefone(empresa_id, telefone)
+        pipe.zadd(key, {membro: score})
+        pipe.zremrangebyscore(key, '-inf', score - JANELA_SEMANA)
+        pipe.expire(key, JANELA_SEMANA + MARGEM_TTL)
+        if regra is not None:
+            key_dia = _key_regra_dia(regra.id, quando)
+            pipe.zadd(key_dia, {membro: score})
+            pipe.expire(key_dia, 2 * 24 * 3600)
+            if regra.cooldown_horas > 0:
+                pipe.set(_key_cooldown(regra.id, telefone), int(score), ex=regra.cooldown_horas * 3600)
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.warning(f'Contadores capping: erro ao registrar envio {membro} ({e})')
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Leitura
+# ---------------------------------------------------------------------------
+
+def carregar(regra, telefones):
+    """
+    Lê os contadores de uma régua para vários telefones (um round-trip).
+
+    Retorna dict com msgs_semana {tel: n}, cooldown_ate {tel: datetime}
+    e envios_hoje (int), ou None se os contadores não estão disponíveis
+    para a empresa (quem chama deve cair para o banco).
+    """
+    r = _get_redis()
+    if r is None:
+        return None
+
+    agora = timezone.now()
+    score = agora.timestamp()
+    try:
+        if not r.exists(_key_pronto(regra.empresa_id)):
+            return None
+
+        pipe = r.pipeline(transaction=False)
+        for tel in telefones:
+            pipe.zcount(_key_telefone(regra.empresa_id, tel), score - JANELA_SEMANA, '+inf')
+        if regra.cooldown_horas > 0:
+            for tel in telefones:
+                pipe.pttl(_key_cooldown(regra.id, tel))
+        pipe.zcard(_key_regra_dia(regra.id, agora))
+        valores = pipe.execute()
+    except Exception as e:
+        logger.warning(f'Contadores capping: erro ao ler régua {regra.id} ({e})')
+        return None
+
+    n = len(telefones)
+    msgs_semana = {tel: total for tel, total in zip(telefones, valores[:n]) if total}
+    cooldown_ate = {}
+    if regra.cooldown_horas > 0:
+        for tel, pttl in zip(telefones, valores[n:2 * n]):
+            if pttl and pttl > 0:
+                cooldown_ate[tel] = agora + timedelta(milliseconds=pttl)
+
+    return {
+        'msgs_semana': msgs_semana,
+        'cooldown_ate': cooldown_ate,
+        'envios_hoje': valores[-1],
+    }
+
+
+# ---------------------------------------------------------------------------
+# Reconstrução a partir do banco
+# ---------------------------------------------------------------------------
+
+def reconstruir(empresa):
+    """
+    Recalcula os contadores da empresa a partir de mensagens_whatsapp e
+    fila_envio e grava a marca cap:pronto. Retorna dict com totais.
+
+    Envios que acontecerem durante a reconstrução podem ficar de fora
+    (janela de segundos); rodar fora do horário de disparo.
+    """
+    from comunicacao.models import FilaEnvio, RegraComunicacao
+    from customers.models import MensagemWhatsApp
+
+    r = _get_redis()
+    if r is None:
+        return {'success': False, 'error': 'Redis não configurado'}
+
+    agora = timezone.now()
+    inicio_semana = agora - timedelta(seconds=JANELA_SEMANA)
+    hoje_inicio = agora.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # 1. Janela semanal por telefone
+    por_telefone = {}
+    msgs = MensagemWhatsApp.objects.filter(
+        empresa=empresa,
+        status__in=['enviado', 'entregue', 'lido'],
+        created_at__gte=inicio_semana,
+    ).exclude(tipo='resposta_cliente').values_list('id', 'destinatario_telefone', 'created_at')
+    for msg_id, tel, criado in msgs.iterator(chunk_size=2000):
+        por_telefone.setdefault(tel, {})[f'msg:{msg_id}'] = criado.timestamp()
+
+    # 2. Envios de hoje por régua + 3. cooldowns ativos
+    regras = list(RegraComunicacao.objects.filter(empresa=empresa))
+    por_regra_dia = {}
+    cooldowns = {}
+    for regra in regras:
+        enviados_hoje = FilaEnvio.objects.filter(
+            regra=regra, status='enviado', processado_em__gte=hoje_inicio,
+        ).values_list('id', 'mensagem_id', 'processado_em')
+        por_regra_dia[regra.id] = {
+            (f'msg:{msg_id}' if msg_id else f'fila:{fila_id}'): quando.timestamp()
+            for fila_id, msg_id, quando in enviados_hoje
+        }
+
+        if regra.cooldown_horas > 0:
+            limite = agora - timedelta(hours=regra.cooldown_horas)
+            for tel, ultimo in FilaEnvio.objects.filter(
+                regra=regra, status='enviado', processado_em__gt=limite,
+            ).values('telefone').annotate(ultimo=Max('processado_em')).values_list('telefone', 'ultimo'):
+                restante = (ultimo + timedelta(hours=regra.cooldown_horas) - agora).total_seconds()
+                if restante > 0:
+                    cooldowns[_key_cooldown(regra.id, tel)] = (int(ultimo.timestamp()), int(restante) + 1)
+
+    try:
+        antigas = list(r.scan_iter(match=f'cap:{empresa.id}:tel:*', count=1000))
+        antigas += [
+            key for regra in regras
+            for key in r.scan_iter(match=f'cap:regra:{regra.id}:*', count=1000)
+        ]
+
+        pipe = r.pipeline(transaction=True)
+        if antigas:
+            pipe.delete(*antigas)
+        for tel, membros in por_telefone.items():
+            key = _key_telefone(empresa.id, tel)
+            pipe.zadd(key, membros)
+            pipe.expire(key, JANELA_SEMANA + MARGEM_TTL)
+        for regra_id, membros in por_regra_dia.items():
+            if membros:
+                key = _key_regra_dia(regra_id, agora)
+                pipe.zadd(key, membros)
+                pipe.expire(key, 2 * 24 * 3600)
+        for key, (valor, ttl) in cooldowns.items():
+            pipe.set(key, valor, ex=ttl)
+        pipe.set(_key_pronto(empresa.id), int(time.time()), ex=JANELA_SEMANA)
+        pipe.execute()
+    except Exception as e:
+        logger.error(f'[{empresa.slug}] Erro ao reconstruir contadores de capping: {e}')
+        return {'success': False, 'error': str(e)}
+
+    logger.info(
+        f'[{empresa.slug}] Contadores de capping reconstruídos: '
+        f'{len(por_telefone)} telefones, {len(cooldowns)} cooldowns'
+    )
+    return {
+        'success': True,
+        'telefones': len(por_telefone),
+        'envios_hoje': sum(len(m) for m in por_regra_dia.values()),
+        'cooldowns': len(cooldowns),
+    }
+
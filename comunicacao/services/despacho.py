@@ -0,0 +1,89 @@
+"""
+Despacho da fila no horário de vencimento (em vez de esperar o beat).
+
+- Item vencido agora: dispara processar_fila_envio logo após o commit
+  (um disparo por janela de DESPACHO_DEDUP segundos).
+- Item futuro: o horário entra no sorted set fila:vencimentos
+  (score = agendar_para). despachar_vencidos(), chamado a cada poucos
+  segundos pelo beat, só consulta o Redis; o banco só é tocado quando
+  algo venceu.
+
+O beat processar-fila-envio continua como varredura de segurança
+(Redis limpo, item reagendado fora daqui etc.). Sem Redis, só ela existe.
+"""
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from comunicacao.services.redis_conn import get_redis
+
+logger = logging.getLogger(__name__)
+
+VENCIMENTOS_KEY = 'fila:vencimentos'
+DESPACHO_DEDUP = 5  # segundos
+
+
+def _processar_agora():
+    from comunicacao.tasks import processar_fila_envio
+    processar_fila_envio.delay()
+
+
+def _registrar_vencimento(r, quando):
+    score = int(quando.timestamp())
+    try:
+        r.zadd(VENCIMENTOS_KEY, {str(score): score})
+    except Exception as e:
+        logger.warning(f'Despacho: erro ao registrar vencimento ({e})')
+
+
+def _disparar():
+    """
+    Disparo imediato, no máximo um por janela de DESPACHO_DEDUP segundos.
+    Os demais viram vencimento "agora" (próximo tick do despachante), para
+    não se perderem caso o disparo anterior já tenha reservado seu lote.
+    """
+    if cache.add('fila:despacho:imediato', 1, timeout=DESPACHO_DEDUP):
+        _processar_agora()
+        return
+    r = get_redis()
+    if r is not None:
+        _registrar_vencimento(r, timezone.now())
+
+
+def agendar_despacho(quando):
+    """Garante que a fila seja processada em `quando` (após o commit atual)."""
+    if quando <= timezone.now():
+        transaction.on_commit(_disparar)
+        return
+
+    r = get_redis()
+    if r is None:
+        return  # varredura do beat cobre
+
+    transaction.on_commit(lambda: _registrar_vencimento(r, quando))
+
+
+def despachar_vencidos():
+    """
+    Remove do sorted set os horários já vencidos e, se havia algum,
+    dispara o processamento da fila. Retorna quantos horários venceram.
+    """
+    r = get_redis()
+    if r is None:
+        return 0
+
+    agora = int(timezone.now().timestamp())
+    try:
+        pipe = r.pipeline(transaction=True)
+        pipe.zcount(VENCIMENTOS_KEY, '-inf', agora)
+        pipe.zremrangebyscore(VENCIMENTOS_KEY, '-inf', agora)
+        vencidos, _ = pipe.execute()
+    except Exception as e:
+        logger.warning(f'Despacho: erro ao ler vencimentos ({e})')
+        return 0
+
+    if vencidos:
+        _processar_agora()
+    return vencidos
@@ -0,0 +1,190 @@
+"""
+Estado de engajamento por contato (ContatoEstado).
+
+Mantido por:
+- sender / meta_promocoes (envio com sucesso) → registrar_envio
+- webhook de status Meta (lido, falha) e respostas → recalcular_ignorados
+- ContatoBlacklist (signals + blacklist automática) → marcar_bloqueado
+
+O motor lê uma linha por contato (carregar). Telefones sem linha são
+montados a partir do histórico na primeira leitura.
+"""
+import logging
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from comunicacao.models import ContatoBlacklist, ContatoEstado
+from customers.models import MensagemWhatsApp
+
+logger = logging.getLogger(__name__)
+
+STATUS_ENVIADO = ['enviado', 'entregue', 'lido']
+
+# Quantas mensagens recentes olhar para a sequência de ignorados
+JANELA_IGNORADOS = 10
+
+
+def _enviadas(empresa_id, telefones):
+    return MensagemWhatsApp.objects.filter(
+        empresa_id=empresa_id,
+        destinatario_telefone__in=telefones,
+    ).exclude(tipo='resposta_cliente')
+
+
+def ignorados_do_historico(empresa_id, telefones):
+    """
+    Mensagens consecutivas não lidas (enviadas mas nunca marcadas como 'lido'),
+    olhando as últimas JANELA_IGNORADOS mensagens Meta de cada telefone.
+    Para de contar ao encontrar uma lida ou respondida.
+    """
+    linhas = (
+        _enviadas(empresa_id, telefones).filter(canal='meta')
+        .annotate(pos=Window(
+            RowNumber(),
+            partition_by=[F('destinatario_telefone')],
+            order_by=F('created_at').desc(),
+        ))
+        .filter(pos__lte=JANELA_IGNORADOS)
+        .order_by('destinatario_telefone', 'pos')
+        .values_list('destinatario_telefone', 'status', 'respondido')
+    )
+
+    resultado = {}
+    encerrados = set()
+    for tel, status, respondido in linhas:
+        if tel in encerrados:
+            continue
+        if status == 'lido' or respondido:
+            encerrados.add(tel)
+            continue
+        if status in ('enviado', 'entregue'):
+            resultado[tel] = resultado.get(tel, 0) + 1
+    return resultado
+
+
+def _montar_do_historico(empresa_id, telefones):
+    """Cria ContatoEstado dos telefones a partir do histórico (consultas agrupadas)."""
+    inicio = timezone.now() - ContatoEstado.JANELA
+
+    bloqueados = set(
+        ContatoBlacklist.objects.filter(
+            empresa_id=empresa_id, telefone__in=telefones,
+        ).values_list('telefone', flat=True)
+    )
+
+    # Envios da janela: limitados pelo max_msgs_semana_telefone das réguas
+    envios_semana = {}
+    for tel, criado in (
+        _enviadas(empresa_id, telefones).filter(
+            status__in=STATUS_ENVIADO,
+            created_at__gte=inicio,
+        ).order_by('created_at').values_list('destinatario_telefone', 'created_at')
+    ):
+        envios_semana.setdefault(tel, []).append(criado.timestamp())
+
+    agregados = {
+        linha[0]: linha[1:]
+        for linha in _enviadas(empresa_id, telefones).filter(
+            status__in=STATUS_ENVIADO,
+        ).values('destinatario_telefone').annotate(
+            ultimo=Max('created_at'),
+            total=Count('id'),
+            leitura=Max('lido_em'),
+            resposta=Max('respondido_em'),
+        ).values_list('destinatario_telefone', 'ultimo', 'total', 'leitura', 'resposta')
+    }
+
+    ignorados = ignorados_do_historico(empresa_id, telefones)
+
+    estados = []
+    for tel in telefones:
+        ultimo, total, leitura, resposta = agregados.get(tel, (None, 0, None, None))
+        estados.append(ContatoEstado(
+            empresa_id=empresa_id,
+            telefone=tel,
+            ultimo_envio_em=ultimo,
+            total_enviados=total,
+            envios_semana=envios_semana.get(tel, []),
+            ignorados_consecutivos=ignorados.get(tel, 0),
+            ultima_leitura_em=leitura,
+            ultima_resposta_em=resposta,
+            bloqueado=tel in bloqueados,
+        ))
+
+    # Outro worker pode ter criado a mesma linha ao mesmo tempo
+    ContatoEstado.objects.bulk_create(estados, ignore_conflicts=True)
+    return {e.telefone: e for e in estados}
+
+
+def carregar(empresa_id, telefones):
+    """Retorna {telefone: ContatoEstado}, montando do histórico os que faltam."""
+    telefones = list(dict.fromkeys(t for t in telefones if t))
+    if not telefones:
+        return {}
+
+    estados = {
+        e.telefone: e
+        for e in ContatoEstado.objects.filter(empresa_id=empresa_id, telefone__in=telefones)
+    }
+    faltando = [t for t in telefones if t not in estados]
+    if faltando:
+        estados.update(_montar_do_historico(empresa_id, faltando))
+    return estados
+
+
+def registrar_envio(empresa_id, telefone, canal='meta', quando=None):
+    """
+    Atualiza o estado após um envio com sucesso.
+    Chamar depois de gravar a MensagemWhatsApp (se a linha ainda não existe,
+    ela é montada do histórico, que já inclui este envio).
+    """
+    if not telefone:
+        return
+    quando = quando or timezone.now()
+
+    with transaction.atomic():
+        estado = ContatoEstado.objects.select_for_update().filter(
+            empresa_id=empresa_id, telefone=telefone,
+        ).first()
+        if estado is None:
+            _montar_do_historico(empresa_id, [telefone])
+            return
+
+        estado.somar_envio(quando)
+        if not estado.ultimo_envio_em or quando > estado.ultimo_envio_em:
+            estado.ultimo_envio_em = quando
+        estado.total_enviados += 1
+        if canal == 'meta':
+            estado.ignorados_consecutivos += 1
+        estado.save(update_fields=[
+            'envios_semana', 'ultimo_envio_em', 'total_enviados',
+            'ignorados_consecutivos', 'atualizado_em',
+        ])
+
+
+def recalcular_ignorados(empresa_id, telefone, lido_em=None, respondido_em=None):
+    """
+    Recalcula a sequência de ignorados de um telefone (mensagem lida,
+    respondida ou que falhou depois de enviada) e registra leitura/resposta.
+    """
+    if not telefone:
+        return
+    campos = {
+        'ignorados_consecutivos': ignorados_do_historico(empresa_id, [telefone]).get(telefone, 0),
+        'atualizado_em': timezone.now(),
+    }
+    if lido_em:
+        campos['ultima_leitura_em'] = lido_em
+    if respondido_em:
+        campos['ultima_resposta_em'] = respondido_em
+    ContatoEstado.objects.filter(empresa_id=empresa_id, telefone=telefone).update(**campos)
+
+
+def marcar_bloqueado(empresa_id, telefones, bloqueado=True):
+    """Espelha a blacklist no estado dos contatos."""
+    ContatoEstado.objects.filter(
+        empresa_id=empresa_id, telefone__in=list(telefones),
+    ).update(bloqueado=bloqueado, atualizado_em=timezone.now())
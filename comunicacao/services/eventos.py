@@ -0,0 +1,185 @@
+"""
+Processamento de eventos da API genérica (EventoRecebido → réguas).
+
+- gatilhos_do_evento(): tipo/status do evento → gatilhos de régua
+- resolver_customers(): clientes dos eventos por e-mail/telefone, em
+  consultas agrupadas por empresa
+- processar_pendentes(): consumidor do endpoint em lote
+  (tasks.processar_eventos); agrupa os eventos por (empresa, gatilho) e
+  avalia cada grupo com avaliar_regras_para_gatilho_lote; o resultado
+  de cada evento ({'rules_triggered': n}) fica em EventoRecebido.resultado
+  para reenvios idempotentes
+"""
+import logging
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils import timezone
+
+from comunicacao.models import EventoRecebido
+from comunicacao.services.capping import chunks
+
+logger = logging.getLogger(__name__)
+
+# Mapeamento tipo de evento → gatilho(s) de régua
+EVENTO_TO_GATILHO = {
+    'cart.abandoned': ['cart_abandoned'],
+    'order.created': ['order_created'],
+    'order.status_changed': [],  # resolvido dinamicamente
+    'lead.created': ['lead_new'],
+    'customer.created': ['customer_first_purchase'],
+}
+
+STATUS_TO_GATILHO = {
+    'processing': 'order_processing',
+    'embalado': 'order_shipped',
+    'em-transito': 'order_in_transit',
+    'completed': 'order_delivered',
+    'cancelled': 'order_cancelled',
+}
+
+# Dígitos finais do telefone usados para achar o cliente
+SUFIXO_TELEFONE = 8
+
+
+def gatilhos_do_evento(tipo, data):
+    """Gatilhos de régua disparados por um evento."""
+    gatilhos = list(EVENTO_TO_GATILHO.get(tipo, []))
+
+    # Para order.status_changed, resolver gatilho pelo novo status
+    if tipo == 'order.status_changed':
+        gatilho = STATUS_TO_GATILHO.get(data.get('status', ''))
+        if gatilho:
+            gatilhos.append(gatilho)
+
+    return gatilhos
+
+
+def contato_do_evento(data, customer=None):
+    """Dict de contato para avaliar_regras_para_gatilho(_lote)."""
+    return {
+        'lead': None,
+        'cart': None,
+        'customer': customer,
+        'telefone': data.get('phone', data.get('whatsapp', '')),
+        'nome': data.get('name', data.get('nome', 'Cliente')),
+    }
+
+
+def _sufixo(telefone):
+    from customers.services.wapi import formatar_telefone
+    tel = formatar_telefone(telefone)
+    return tel[-SUFIXO_TELEFONE:] if tel else ''
+
+
+def resolver_customers(empresa, dados):
+    """
+    Cliente de cada payload (e-mail primeiro, depois telefone), com a mesma
+    precedência de Customer.objects...first(). dados: lista de dicts.
+    Retorna lista alinhada com dados (Customer ou None).
+    """
+    from customers.models import Customer
+
+    emails = {d['email'] for d in dados if d.get('email')}
+    sufixos = {_sufixo(d['phone']) for d in dados if d.get('phone')} - {''}
+
+    por_email = {}
+    for bloco in chunks(list(emails)):
+        for customer in Customer.objects.filter(empresa=empresa, email__in=bloco):
+            por_email.setdefault(customer.email, customer)
+
+    por_sufixo = {}
+    for bloco in chunks(list(sufixos), 200):
+        filtro = Q()
+        for sufixo in bloco:
+            filtro |= Q(phone__endswith=sufixo)
+        for customer in Customer.objects.filter(filtro, empresa=empresa):
+            phone = customer.phone or ''
+            for sufixo in bloco:
+                if phone.endswith(sufixo):
+                    por_sufixo.setdefault(sufixo, customer)
+
+    resultado = []
+    for d in dados:
+        customer = por_email.get(d.get('email')) if d.get('email') else None
+        if not customer and d.get('phone'):
+            customer = por_sufixo.get(_sufixo(d['phone']))
+        resultado.append(customer)
+    return resultado
+
+
+def _telefone_do_contato(contato):
+    from customers.services.wapi import formatar_telefone
+    telefone = contato['telefone']
+    if not telefone and contato['customer']:
+        telefone = contato['customer'].phone or ''
+    return formatar_telefone(telefone) if telefone else ''
+
+
+def processar_pendentes(evento_ids):
+    """
+    Avalia as réguas dos eventos ainda não processados entre evento_ids.
+    Uma chamada de avaliar_regras_para_gatilho_lote por (empresa, gatilho).
+    Retorna {'eventos': n, 'enfileirados': m, 'erros': k}.
+    """
+    from comunicacao.services.motor import avaliar_regras_para_gatilho_lote
+
+    eventos = list(
+        EventoRecebido.objects.filter(id__in=evento_ids, processado=False)
+        .select_related('empresa').order_by('id')
+    )
+    if not eventos:
+        return {'eventos': 0, 'enfileirados': 0, 'erros': 0}
+
+    por_empresa = OrderedDict()
+    for evento in eventos:
+        por_empresa.setdefault(evento.empresa_id, []).append(evento)
+
+    enfileirados = 0
+    erros = 0
+    disparos = {evento.id: 0 for evento in eventos}
+    for lote in por_empresa.values():
+        empresa = lote[0].empresa
+        customers = resolver_customers(empresa, [e.payload for e in lote])
+
+        grupos = OrderedDict()
+        for evento, customer in zip(lote, customers):
+            evento.customer = customer
+            for gatilho in gatilhos_do_evento(evento.tipo, evento.payload):
+                grupos.setdefault(gatilho, []).append(evento)
+
+        for gatilho, eventos_gatilho in grupos.items():
+            contatos = [contato_do_evento(e.payload, e.customer) for e in eventos_gatilho]
+            try:
+                resultados = avaliar_regras_para_gatilho_lote(empresa, gatilho, contatos)
+            except Exception as e:
+                erros += len(eventos_gatilho)
+                logger.error(f'[{empresa.slug}] Erro ao avaliar eventos ({gatilho}): {e}')
+                for evento in eventos_gatilho:
+                    evento.erro = f'{gatilho}: {e}'[:1000]
+                continue
+
+            # Itens enfileirados por telefone → eventos daquele telefone
+            por_telefone = {}
+            for item, _ in resultados:
+                if item:
+                    por_telefone[item.telefone] = por_telefone.get(item.telefone, 0) + 1
+            enfileirados += sum(por_telefone.values())
+            for evento, contato in zip(eventos_gatilho, contatos):
+                disparos[evento.id] += por_telefone.get(_telefone_do_contato(contato), 0)
+
+        logger.info(
+            f'[{empresa.slug}] Eventos em lote: {len(lote)} processados, '
+            + ', '.join(f'{g}: {len(evs)}' for g, evs in grupos.items())
+        )
+
+    agora = timezone.now()
+    for evento in eventos:
+        evento.processado = True
+        evento.processado_em = agora
+        evento.resultado = {'rules_triggered': disparos[evento.id]}
+    EventoRecebido.objects.bulk_update(
+        eventos, ['customer', 'processado', 'processado_em', 'erro', 'resultado'], batch_size=500,
+    )
+
+    return {'eventos': len(eventos), 'enfileirados': enfileirados, 'erros': erros}
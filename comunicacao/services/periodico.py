@@ -0,0 +1,205 @@
+"""
+Avaliação periódica de réguas em conjunto (set-based).
+
+Para cada régua de gatilho temporal (inatividade, lead sem conversão,
+carrinho abandonado), os contatos elegíveis saem de UMA consulta com as
+exclusões em SQL:
+
+- telefone na blacklist                 NOT EXISTS contato_blacklist
+- já na fila desta régua                NOT EXISTS fila_envio (pendente)
+- em cooldown desta régua               NOT EXISTS fila_envio (enviado recente)
+- max_envios_total atingido             subquery COUNT
+- etapa anterior ainda não enviada      EXISTS fila_envio da etapa anterior
+
+As condições extras da régua (JSON) entram no mesmo filtro, compiladas
+em Q (services/condicoes.py); só chaves sem equivalente em SQL são
+avaliadas em Python.
+
+O resto do capping (semana, ignorados, limite diário) usa o CappingLote,
+em páginas de LOTE contatos, e os itens entram com bulk_create.
+Sem limite por ciclo.
+"""
+import logging
+from datetime import timedelta
+
+from django.db.models import (
+    Case, CharField, Count, Exists, F, IntegerField, OuterRef, Subquery, Value, When,
+)
+from django.db.models.functions import Coalesce, Concat, Replace
+from django.utils import timezone
+
+from comunicacao.models import ContatoBlacklist, FilaEnvio
+from comunicacao.services import cache_regras
+from comunicacao.services.condicoes import compilar
+from customers.services.wapi import formatar_telefone
+
+logger = logging.getLogger(__name__)
+
+# Contatos por página (capping + bulk_create)
+LOTE = 1000
+
+GATILHOS_INATIVIDADE = {
+    'customer_inactive_30': 30,
+    'customer_inactive_60': 60,
+    'customer_inactive_90': 90,
+}
+
+
+def anotar_telefone(qs, campo):
+    """
+    Anota `tel` com o telefone normalizado em SQL, no mesmo formato de
+    formatar_telefone (só dígitos, 55 na frente de números com DDD).
+    """
+    digitos = F(campo)
+    for caractere in (' ', '-', '(', ')', '+', '.'):
+        digitos = Replace(digitos, Value(caractere), Value(''))
+    return qs.annotate(
+        tel_digitos=digitos,
+    ).annotate(
+        tel=Case(
+            When(
+                tel_digitos__regex=r'^[0-9]{10,11}$',
+                then=Concat(Value('55'), 'tel_digitos', output_field=CharField()),
+            ),
+            default=F('tel_digitos'),
+            output_field=CharField(),
+        ),
+    ).exclude(tel__isnull=True).exclude(tel='')
+
+
+def fontes(empresa, gatilho):
+    """
+    Retorna (tipo, queryset, campo_telefone) dos contatos do gatilho, ou None.
+    tipo: 'customer', 'lead' ou 'cart' (argumento do contato no motor).
+    """
+    from customers.models import Customer, Lead, Cart
+
+    if gatilho in GATILHOS_INATIVIDADE:
+        qs = Customer.objects.filter(
+            empresa=empresa,
+            completed_orders__gte=1,
+            days_since_last_purchase__gte=GATILHOS_INATIVIDADE[gatilho],
+        )
+        return 'customer', qs, 'phone'
+
+    if gatilho == 'lead_new':
+        # Leads sem conversão (form preenchido ontem)
+        ontem = timezone.now() - timedelta(days=1)
+        qs = Lead.objects.filter(
+            empresa=empresa,
+            created_at__date=ontem.date(),
+            whatsapp_sent=False,
+        )
+        return 'lead', qs, 'whatsapp'
+
+    if gatilho == 'cart_abandoned':
+        qs = Cart.objects.filter(
+            empresa=empresa,
+            status='abandoned',
+            recovery_whatsapp_sent=False,
+        ).select_related('customer')
+        return 'cart', qs, 'customer__phone'
+
+    return None
+
+
+def elegiveis(qs, campo_telefone, regra, etapa_anterior=None):
+    """Aplica as exclusões de blacklist/fila/cooldown/total/etapa em SQL."""
+    qs = anotar_telefone(qs, campo_telefone)
+
+    envios_regra = FilaEnvio.objects.filter(regra=regra, telefone=OuterRef('tel'))
+
+    qs = qs.filter(
+        ~Exists(ContatoBlacklist.objects.filter(
+            empresa_id=regra.empresa_id, telefone=OuterRef('tel'),
+        )),
+        ~Exists(envios_regra.filter(status='pendente')),
+    )
+
+    if regra.cooldown_horas > 0:
+        limite = timezone.now() - timedelta(hours=regra.cooldown_horas)
+        qs = qs.filter(~Exists(envios_regra.filter(status='enviado', processado_em__gt=limite)))
+
+    if regra.max_envios_total > 0:
+        total = envios_regra.filter(status='enviado').values('telefone').annotate(
+            n=Count('id'),
+        ).values('n')
+        qs = qs.annotate(
+            envios_total=Coalesce(Subquery(total, output_field=IntegerField()), 0),
+        ).filter(envios_total__lt=regra.max_envios_total)
+
+    if etapa_anterior:
+        qs = qs.filter(Exists(FilaEnvio.objects.filter(
+            regra=etapa_anterior, telefone=OuterRef('tel'), status='enviado',
+        )))
+
+    return qs
+
+
+def avaliar_regra(empresa, regra, tipo, qs):
+    """
+    Enfileira todos os contatos elegíveis para a régua, página a página.
+    Retorna (elegiveis, enfileirados).
+    """
+    from comunicacao.services.motor import _enfileirar_lote, _resolver_contato
+
+    compilada = compilar(regra, tipo)
+    qs = qs.filter(compilada.q)
+
+    total_elegiveis = 0
+    total_enfileirados = 0
+    ultimo_pk = 0
+
+    while True:
+        pagina = list(qs.filter(pk__gt=ultimo_pk).order_by('pk')[:LOTE])
+        if not pagina:
+            break
+        ultimo_pk = pagina[-1].pk
+        total_elegiveis += len(pagina)
+
+        contatos = []
+        for obj in pagina:
+            contato = {'lead': None, 'cart': None, 'customer': None, tipo: obj}
+            if compilada.chaves_python:
+                if tipo == 'lead':
+                    obj.check_if_customer()
+                if not compilada.avaliar_python(**{tipo: obj}):
+                    continue
+            telefone, nome = _resolver_contato(**contato)
+            contato['nome'] = nome
+            contato['telefone_fmt'] = formatar_telefone(telefone)
+            if contato['telefone_fmt']:
+                contatos.append(contato)
+
+        if contatos:
+            resultados = _enfileirar_lote(empresa, regra, contatos)
+            total_enfileirados += sum(1 for item, m in resultados if item)
+
+        if len(pagina) < LOTE:
+            break
+
+    return total_elegiveis, total_enfileirados
+
+
+def avaliar_empresa(empresa):
+    """
+    Avalia todas as réguas temporais ativas da empresa.
+    Retorna {gatilho: {'elegiveis': n, 'enfileirados': m}}.
+    """
+    relatorio = {}
+    for gatilho, regras in sorted(cache_regras.regras_da_empresa(empresa.id).items()):
+        fonte = fontes(empresa, gatilho)
+        if not fonte:
+            continue
+        tipo, qs, campo_telefone = fonte
+
+        for regra in regras:
+            etapa_anterior = regras.etapa_anterior(regra)
+            n_elegiveis, n_enfileirados = avaliar_regra(
+                empresa, regra, tipo, elegiveis(qs, campo_telefone, regra, etapa_anterior),
+            )
+            stats = relatorio.setdefault(gatilho, {'elegiveis': 0, 'enfileirados': 0})
+            stats['elegiveis'] += n_elegiveis
+            stats['enfileirados'] += n_enfileirados
+
+    return relatorio
@@ -0,0 +1,241 @@
+"""
+Rate limit de envio (token bucket) por empresa e por número Meta.
+
+Os buckets ficam no Redis (hash rl:{tipo}:{id}, atualizado por script
+Lua com o relógio do Redis), então a taxa configurada vale para todos os
+workers juntos e a taxa adaptada sobrevive de um ciclo para o outro.
+Sem REDIS_URL (dev), ou em erro de Redis, cada processo usa buckets
+locais (N workers enviariam a N vezes a taxa).
+
+Backoff adaptativo: ao receber 429 / erro de limite da Meta, a taxa do
+bucket cai pela metade e o bucket pausa (pausa dobra a cada penalidade
+seguida). Cada envio com sucesso devolve 10% da taxa até a original.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from comunicacao.services.redis_conn import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Códigos de erro da Meta Cloud API que indicam limite de taxa
+# 4: throttling da aplicação, 80007: limite da WABA,
+# 130429: limite de throughput do número, 131056: limite por par remetente/destinatário
+ERROS_LIMITE_META = {4, 80007, 130429, 131056}
+
+PAUSA_BASE = 2.0
+PAUSA_MAX = 60.0
+
+# Bucket sem uso por mais que isso some do Redis (volta cheio, taxa original)
+TTL_BUCKET = 60 * 60
+
+# KEYS[1] = bucket; ARGV = taxa_base, capacidade, ttl[, pausa_base, pausa_max]
+# Os números voltam como string (inteiros do Lua truncariam a espera).
+_LUA_AGORA = """
+redis.replicate_commands()
+local t = redis.call('TIME')
+local agora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local taxa_base = tonumber(ARGV[1])
+local capacidade = tonumber(ARGV[2])
+local d = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'taxa', 'pausado_ate', 'penalidades')
+local taxa = math.min(tonumber(d[3]) or taxa_base, taxa_base)
+"""
+
+LUA_TENTAR = _LUA_AGORA + """
+local pausado_ate = tonumber(d[4]) or 0
+if agora < pausado_ate then
+    return tostring(pausado_ate - agora)
+end
+local tokens = tonumber(d[1]) or capacidade
+local ts = tonumber(d[2]) or agora
+tokens = math.min(capacidade, tokens + math.max(0, agora - ts) * taxa)
+local espera = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    espera = (1 - tokens) / taxa
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', agora, 'taxa', taxa)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return tostring(espera)
+"""
+
+LUA_PENALIZAR = _LUA_AGORA + """
+local penalidades = (tonumber(d[5]) or 0) + 1
+local pausa = math.min(tonumber(ARGV[4]) * 2 ^ (penalidades - 1), tonumber(ARGV[5]))
+taxa = math.max(taxa / 2, taxa_base / 16)
+redis.call('HSET', KEYS[1], 'tokens', 0, 'ts', agora, 'taxa', taxa,
+    'pausado_ate', agora + pausa, 'penalidades', penalidades)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return tostring(pausa)
+"""
+
+LUA_SUCESSO = _LUA_AGORA + """
+if (tonumber(d[5]) or 0) > 0 then
+    redis.call('HSET', KEYS[1], 'penalidades', 0)
+end
+if taxa < taxa_base then
+    redis.call('HSET', KEYS[1], 'taxa', math.min(taxa_base, taxa + taxa_base * 0.1))
+end
+return '0'
+"""
+
+
+def eh_limite_de_taxa(resultado):
+    """True se o resultado de envio indica rate limit (HTTP 429 ou código Meta)."""
+    if resultado.get('success'):
+        return False
+    return (
+        resultado.get('status_code') == 429
+        or resultado.get('error_code') in ERROS_LIMITE_META
+    )
+
+
+class TokenBucket:
+    """Token bucket thread-safe com taxa adaptativa."""
+
+    def __init__(self, taxa, capacidade=None):
+        self.taxa_base = float(taxa)
+        self.taxa = float(taxa)
+        self.capacidade = float(capacidade or max(taxa, 1))
+        self.tokens = self.capacidade
+        self.atualizado_em = time.monotonic()
+        self.pausado_ate = 0.0
+        self.penalidades = 0
+        self._lock = threading.Lock()
+
+    def _repor(self, agora):
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado_em) * self.taxa)
+        self.atualizado_em = agora
+
+    def tentar(self):
+        """Consome um token se houver. Retorna 0 ou os segundos até o próximo."""
+        with self._lock:
+            agora = time.monotonic()
+            if agora < self.pausado_ate:
+                return self.pausado_ate - agora
+            self._repor(agora)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.taxa
+
+    def penalizar(self):
+        """Rate limit recebido: reduz a taxa e pausa. Retorna a pausa (segundos)."""
+        with self._lock:
+            self.penalidades += 1
+            pausa = min(PAUSA_BASE * 2 ** (self.penalidades - 1), PAUSA_MAX)
+            self.taxa = max(self.taxa / 2, self.taxa_base / 16)
+            self.tokens = 0
+            self.pausado_ate = time.monotonic() + pausa
+            return pausa
+
+    def sucesso(self):
+        with self._lock:
+            self.penalidades = 0
+            if self.taxa < self.taxa_base:
+                self.taxa = min(self.taxa_base, self.taxa + self.taxa_base * 0.1)
+
+
+class BucketRedis:
+    """
+    Token bucket compartilhado entre workers (mesma interface do
+    TokenBucket). Em erro de Redis, usa o bucket local da chave.
+    """
+
+    _scripts = {}
+
+    def __init__(self, r, chave, local):
+        self.r = r
+        self.key = f'rl:{chave[0]}:{chave[1]}'
+        self.local = local
+
+    def _script(self, nome, lua):
+        cliente, script = self._scripts.get(nome, (None, None))
+        if cliente is not self.r:
+            script = self.r.register_script(lua)
+            self._scripts[nome] = (self.r, script)
+        return script
+
+    def _rodar(self, nome, lua, *extra):
+        args = [self.local.taxa_base, self.local.capacidade, TTL_BUCKET, *extra]
+        return float(self._script(nome, lua)(keys=[self.key], args=args))
+
+    def tentar(self):
+        try:
+            return self._rodar('tentar', LUA_TENTAR)
+        except Exception as e:
+            logger.warning(f'Rate limit {self.key}: erro no Redis, usando bucket local ({e})')
+            return self.local.tentar()
+
+    def penalizar(self):
+        try:
+            return self._rodar('penalizar', LUA_PENALIZAR, PAUSA_BASE, PAUSA_MAX)
+        except Exception as e:
+            logger.warning(f'Rate limit {self.key}: erro no Redis, usando bucket local ({e})')
+            return self.local.penalizar()
+
+    def sucesso(self):
+        try:
+            self._rodar('sucesso', LUA_SUCESSO)
+        except Exception as e:
+            logger.warning(f'Rate limit {self.key}: erro no Redis, usando bucket local ({e})')
+            self.local.sucesso()
+
+
+class LimitadorEnvio:
+    """
+    Conjunto de buckets por chave ('empresa', id) / ('numero', phone_number_id):
+    no Redis quando configurado, senão locais ao processo.
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _local(self, chave):
+        with self._lock:
+            bucket = self._buckets.get(chave)
+            if bucket is None:
+                tipo = chave[0]
+                if tipo == 'numero':
+                    taxa = getattr(settings, 'ENVIO_TAXA_NUMERO', 20)
+                else:
+                    taxa = getattr(settings, 'ENVIO_TAXA_EMPRESA', 10)
+                bucket = self._buckets[chave] = TokenBucket(taxa)
+            return bucket
+
+    def _bucket(self, chave):
+        local = self._local(chave)
+        r = get_redis()
+        return BucketRedis(r, chave, local) if r is not None else local
+
+    def aguardar(self, chaves, timeout=None):
+        """
+        Bloqueia até obter um token de cada chave.
+        Retorna False se estourar o timeout (segundos).
+        """
+        limite = time.monotonic() + timeout if timeout else None
+        for chave in chaves:
+            bucket = self._bucket(chave)
+            while True:
+                espera = bucket.tentar()
+                if not espera:
+                    break
+                if limite and time.monotonic() + espera > limite:
+                    return False
+                time.sleep(min(espera, 1.0))
+        return True
+
+    def penalizar(self, chaves):
+        return max((self._bucket(chave).penalizar() for chave in chaves), default=0)
+
+    def sucesso(self, chaves):
+        for chave in chaves:
+            self._bucket(chave).sucesso()
+
+
+limitador = LimitadorEnvio()
@@ -0,0 +1,19 @@
+"""
+Conexão Redis direta (estruturas que o cache do Django não expõe:
+sorted sets, pipelines). None quando não há REDIS_URL (dev).
+"""
+from django.conf import settings
+
+_redis = None
+
+
+def get_redis():
+    """Cliente Redis compartilhado (lazy). None sem REDIS_URL."""
+    global _redis
+    url = getattr(settings, 'REDIS_URL', None)
+    if not url:
+        return None
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(url, socket_timeout=2)
+    return _redis
@@ -1,10 +1,27 @@
 """
 Sender: processa a FilaEnvio e envia mensagens via Meta ou W-API.
+
+Os envios HTTP rodam em paralelo (ENVIO_CONCORRENCIA threads), com rate
+limit por empresa e por número Meta (services.ratelimit). Banco e capping
+ficam na thread principal.
 """
 import logging
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
 from comunicacao.models import FilaEnvio, RegraComunicacao
+from comunicacao.services import contadores, estado
+from comunicacao.services.circuito import permitir as circuito_permitir, registrar as circuito_registrar
+from comunicacao.services.despacho import agendar_despacho
+from comunicacao.services.ratelimit import eh_limite_de_taxa, limitador
 from customers.models import MensagemWhatsApp
 from bling.meta_whatsapp import MetaWhatsAppClient
 from customers.services.wapi import (
@@ -18,58 +35,414 @@ def processar_fila(limit=100):
     """
     Processa itens pendentes da fila cujo horário de envio já passou.
     Chamado pelo Celery Beat a cada poucos minutos.
+
+    Os itens são reservados (lease) antes do envio, então vários workers
+    podem rodar ao mesmo tempo sem enviar o mesmo item duas vezes.
+    Itens do mesmo telefone vão em rodadas separadas, para que o capping
+    do segundo enxergue o primeiro envio. O lease é renovado a cada
+    rodada e durante a espera dos envios (com backoff de rate limit o
+    lote pode durar mais que ENVIO_LEASE_SEGUNDOS); item cujo lease foi
+    perdido não é enviado nem concluído por este worker.
     """
-    agora = timezone.now()
+    inicio = time.monotonic()
 
-    itens = FilaEnvio.objects.filter(
-        status='pendente',
-        agendar_para__lte=agora,
+    dono = _dono_lease()
+    ids = reivindicar(limit, dono)
+    itens = list(FilaEnvio.objects.filter(
+        id__in=ids, lease_dono=dono,
     ).select_related(
         'empresa', 'regra', 'regra__instancia_wapi',
         'lead', 'cart', 'cart__customer', 'customer',
-    ).order_by('agendar_para')[:limit]
+    ).order_by('agendar_para'))
+
+    # Capping do lote inteiro: uma carga por régua em vez de ~6 queries por item
+    lotes = _carregar_capping(itens)
+    # Parâmetros de template: último pedido de todos os clientes numa consulta
+    _carregar_params(itens)
+
+    stats = {
+        'reivindicados': len(itens), 'enviados': 0, 'falhas': 0, 'reagendados': 0,
+        'lease_perdido': 0,
+    }
+
+    if itens:
+        concorrencia = getattr(settings, 'ENVIO_CONCORRENCIA', 8)
+        with ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix='envio') as pool:
+            for rodada in _rodadas(itens):
+                _processar_rodada(rodada, lotes, pool, stats, dono=dono)
+
+    for lote in lotes.values():
+        lote.salvar_bloqueios()
+
+    duracao = time.monotonic() - inicio
+    stats['por_segundo'] = round(stats['enviados'] / duracao, 2) if duracao else 0.0
+
+    if stats['enviados'] or stats['falhas'] or stats['reagendados']:
+        logger.info(
+            f"Fila processada: {stats['enviados']} enviados, {stats['falhas']} falhas, "
+            f"{stats['reagendados']} reagendados em {duracao:.1f}s "
+            f"({stats['por_segundo']} msg/s)"
+        )
+
+    return stats
 
-    enviados = 0
-    falhas = 0
 
+def _dono_lease():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def reivindicar(limit, dono):
+    """
+    Reserva até `limit` itens vencidos para este worker e retorna os ids.
+
+    SELECT ... FOR UPDATE SKIP LOCKED: workers concorrentes pegam linhas
+    diferentes sem esperar uns pelos outros. Os itens passam para
+    'enviando' com lease de ENVIO_LEASE_SEGUNDOS.
+    """
+    agora = timezone.now()
+    lease = _lease_segundos()
+    with transaction.atomic():
+        ids = list(
+            FilaEnvio.objects.select_for_update(skip_locked=True).filter(
+                status='pendente',
+                agendar_para__lte=agora,
+            ).order_by('agendar_para').values_list('id', flat=True)[:limit]
+        )
+        if ids:
+            FilaEnvio.objects.filter(id__in=ids).update(
+                status='enviando',
+                lease_dono=dono,
+                lease_ate=agora + timedelta(seconds=lease),
+            )
+    return ids
+
+
+def _lease_segundos():
+    return getattr(settings, 'ENVIO_LEASE_SEGUNDOS', 600)
+
+
+def renovar_lease(dono):
+    """
+    Estende o lease dos itens que este worker ainda tem em 'enviando' e
+    retorna os ids que continuam com ele (os que venceram e foram
+    liberados/reivindicados por outro worker ficam de fora).
+    """
+    reservados = FilaEnvio.objects.filter(status='enviando', lease_dono=dono)
+    reservados.update(lease_ate=timezone.now() + timedelta(seconds=_lease_segundos()))
+    return set(reservados.values_list('id', flat=True))
+
+
+def liberar_leases_expirados():
+    """
+    Devolve para 'pendente' itens cujo worker morreu no meio do envio
+    (status 'enviando' com lease vencido). Retorna quantos foram liberados.
+
+    Se o worker morreu depois da chamada HTTP e antes de gravar o
+    resultado, o item é reenviado (entrega pelo menos uma vez).
+    """
+    liberados = FilaEnvio.objects.filter(
+        status='enviando',
+        lease_ate__lt=timezone.now(),
+    ).update(status='pendente', lease_dono='', lease_ate=None)
+    if liberados:
+        logger.warning(f"Fila: {liberados} itens com lease vencido voltaram para pendente")
+        agendar_despacho(timezone.now())
+    return liberados
+
+
+def _carregar_capping(itens):
+    """Monta um CappingLote por régua com os telefones dos itens."""
+    from comunicacao.services.capping import CappingLote
+
+    por_regra = {}
+    for item in itens:
+        por_regra.setdefault(item.regra_id, (item.regra, []))[1].append(item.telefone)
+    return {
+        regra_id: CappingLote(regra, telefones)
+        for regra_id, (regra, telefones) in por_regra.items()
+    }
+
+
+def _ultimos_pedidos(customer_ids):
+    """{customer_id: (order_number, total)} do pedido mais recente (uma consulta)."""
+    from django.db.models import OuterRef, Subquery
+    from customers.models import Customer, Order
+
+    if not customer_ids:
+        return {}
+    ultimo = Order.objects.filter(customer=OuterRef('pk')).order_by('-created_at').values('pk')[:1]
+    ultimos_ids = Customer.objects.filter(id__in=customer_ids).annotate(
+        ultimo_pedido=Subquery(ultimo),
+    ).values('ultimo_pedido')
+    return {
+        cid: (numero, total)
+        for cid, numero, total in Order.objects.filter(pk__in=ultimos_ids).values_list(
+            'customer_id', 'order_number', 'total',
+        )
+    }
+
+
+def _carregar_params(itens):
+    """
+    Monta os parâmetros de template de todos os itens do lote de uma vez
+    (guardados no item, usados no envio e no histórico).
+    """
+    ultimos = _ultimos_pedidos(list({
+        item.customer_id for item in itens if item.customer_id and not item.cart_id
+    }))
+    cupons = {}
+    for item in itens:
+        if item.regra_id not in cupons:
+            cupons[item.regra_id] = _valores_cupom(item.regra, item.empresa)
+        item._template_params = _build_params(
+            item.regra, item,
+            ultimo_pedido=ultimos.get(item.customer_id),
+            cupom=cupons[item.regra_id],
+        )
+
+
+def _rodadas(itens):
+    """Rodada N = N-ésimo item de cada (empresa, telefone), na ordem da fila."""
+    por_contato = {}
     for item in itens:
+        por_contato.setdefault((item.empresa_id, item.telefone), []).append(item)
+    rodadas = []
+    for grupo in por_contato.values():
+        for n, item in enumerate(grupo):
+            if n == len(rodadas):
+                rodadas.append([])
+            rodadas[n].append(item)
+    return rodadas
+
+
+def _processar_rodada(rodada, lotes, pool, stats, dono=None):
+    """
+    Prepara os itens (thread principal), envia em paralelo e conclui.
+    Com dono, renova o lease antes da rodada (descartando itens que já
+    não são deste worker) e a cada terço do lease enquanto espera.
+    """
+    if dono:
+        vivos = renovar_lease(dono)
+        perdidos = [item for item in rodada if item.id not in vivos]
+        if perdidos:
+            logger.warning(f"Fila: {len(perdidos)} itens com lease perdido antes do envio")
+            stats['lease_perdido'] += len(perdidos)
+            rodada = [item for item in rodada if item.id in vivos]
+    intervalo = _lease_segundos() / 3
+    renovado_em = time.monotonic()
+
+    futuros = {}
+    for item in rodada:
         try:
-            ok = _enviar_item(item)
-            if ok:
-                enviados += 1
-            else:
-                falhas += 1
+            preparado = _preparar_item(item, lotes)
+            if preparado is None:
+                stats['falhas'] += 1
+                continue
+            canal, chamada = preparado
+            if not callable(chamada):
+                # Erro de configuração: nada a enviar
+                ok = _concluir_item(item, canal, chamada, lotes)
+                stats[_chave_stats(ok)] += 1
+                continue
+            chaves = _chaves_limite(item.empresa, canal)
+            futuros[pool.submit(
+                _executar, chamada, chaves, _circuito_do_item(item, canal),
+            )] = (item, canal, chaves)
         except Exception as e:
-            logger.exception(f"Erro ao processar fila item {item.id}: {e}")
-            item.status = 'falha'
-            item.erro = str(e)[:500]
-            item.processado_em = timezone.now()
-            item.save(update_fields=['status', 'erro', 'processado_em'])
-            falhas += 1
+            stats['falhas' if _marcar_falha(item, e) else 'lease_perdido'] += 1
+
+    pendentes = set(futuros)
+    while pendentes:
+        feitos, pendentes = wait(pendentes, timeout=intervalo, return_when=FIRST_COMPLETED)
+        if dono and time.monotonic() - renovado_em >= intervalo:
+            renovar_lease(dono)
+            renovado_em = time.monotonic()
+        for futuro in feitos:
+            _concluir_futuro(futuro, futuros[futuro], lotes, stats)
+
+
+def _concluir_futuro(futuro, contexto, lotes, stats):
+    item, canal, chaves = contexto
+    try:
+        resultado = futuro.result()
+        if resultado.get('circuito_aberto'):
+            reagendado = _reagendar(item, resultado['pausa'], resultado, motivo='circuito_aberto')
+            stats['reagendados' if reagendado else 'lease_perdido'] += 1
+            return
+        if eh_limite_de_taxa(resultado):
+            pausa = limitador.penalizar(chaves)
+            reagendado = _reagendar(item, pausa, resultado)
+            stats['reagendados' if reagendado else 'lease_perdido'] += 1
+            return
+        if resultado.get('success'):
+            limitador.sucesso(chaves)
+        ok = _concluir_item(item, canal, resultado, lotes)
+        stats[_chave_stats(ok)] += 1
+    except Exception as e:
+        stats['falhas' if _marcar_falha(item, e) else 'lease_perdido'] += 1
+
+
+def _chave_stats(ok):
+    if ok is None:
+        return 'lease_perdido'
+    return 'enviados' if ok else 'falhas'
+
+
+def _chaves_limite(empresa, canal):
+    chaves = [('empresa', empresa.id)]
+    if canal == 'meta' and empresa.meta_phone_number_id:
+        chaves.append(('numero', empresa.meta_phone_number_id))
+    return chaves
+
+
+def _circuito_do_item(item, canal):
+    """(provedor, instância) do circuit breaker para o envio do item."""
+    if canal == 'meta':
+        return ('meta', item.empresa.meta_phone_number_id)
+    instancia = item.regra.instancia_wapi
+    if instancia and instancia.ativo:
+        return ('wapi', instancia.wapi_instance)
+    return ('wapi', item.empresa.wapi_instance or settings.WAPI_INSTANCE)
 
-    if enviados or falhas:
-        logger.info(f"Fila processada: {enviados} enviados, {falhas} falhas")
 
-    return {'enviados': enviados, 'falhas': falhas}
+def _executar(chamada, chaves, circuito=None):
+    """
+    Roda na thread do pool: consulta o circuit breaker, espera o rate
+    limit e faz a chamada HTTP. Com o circuito aberto, não chama o
+    provedor e devolve {'circuito_aberto': True, 'pausa': segundos}.
+    """
+    if circuito:
+        espera = circuito_permitir(*circuito)
+        if espera:
+            return {
+                'success': False,
+                'circuito_aberto': True,
+                'pausa': espera,
+                'error': f'Circuito {circuito[0]}:{circuito[1]} aberto',
+            }
+    limitador.aguardar(chaves)
+    resultado = chamada()
+    if circuito:
+        circuito_registrar(*circuito, resultado)
+    return resultado
+
+
+def _gravar_se_dono(item, **campos):
+    """
+    Grava os campos só se o item continua como este worker o deixou
+    (mesmo status e lease_dono): se o lease venceu e o item foi liberado
+    ou reivindicado por outro worker, não grava e retorna False.
+    """
+    gravados = FilaEnvio.objects.filter(
+        pk=item.pk, status=item.status, lease_dono=item.lease_dono,
+    ).update(**campos)
+    if not gravados:
+        logger.warning(
+            f"[{item.empresa.slug}] Envio {item.id}: lease perdido, resultado não gravado"
+        )
+        return False
+    for campo, valor in campos.items():
+        setattr(item, campo, valor)
+    return True
+
+
+def _liberar_reserva(item):
+    """Devolve a vaga de max_envios_dia reservada para o item em _preparar_item."""
+    lote = getattr(item, '_reserva_capping', None)
+    if lote:
+        lote.liberar_reserva()
+        item._reserva_capping = None
+
+
+def _marcar_falha(item, erro):
+    """Marca o item como falha. Retorna False se o lease foi perdido."""
+    _liberar_reserva(item)
+    logger.exception(f"Erro ao processar fila item {item.id}: {erro}")
+    return _gravar_se_dono(
+        item,
+        status='falha',
+        erro=str(erro)[:500],
+        processado_em=timezone.now(),
+        lease_ate=None,
+    )
 
 
-def _enviar_item(item):
-    """Envia um item da fila. Retorna True se sucesso."""
+def _reagendar(item, pausa, resultado, motivo='rate_limit'):
+    """
+    Rate limit ou circuito aberto: item volta para a fila após a pausa.
+    Retorna False se o lease foi perdido.
+    """
+    _liberar_reserva(item)
+    logger.warning(
+        f"[{item.empresa.slug}] {motivo} no envio {item.id}, "
+        f"reagendado em {pausa:.0f}s: {resultado.get('error', '')[:200]}"
+    )
+    agendar_para = timezone.now() + timedelta(seconds=pausa)
+    if not _gravar_se_dono(
+        item,
+        status='pendente',
+        erro=f"{motivo}: {resultado.get('error', '')}"[:500],
+        agendar_para=agendar_para,
+        lease_dono='',
+        lease_ate=None,
+    ):
+        return False
+    agendar_despacho(agendar_para)
+    return True
+
+
+def _enviar_item(item, lotes=None):
+    """
+    Envia um item da fila (sem pool). Retorna True se sucesso.
+    lotes: {regra_id: CappingLote} pré-carregado por processar_fila.
+    """
+    preparado = _preparar_item(item, lotes)
+    if preparado is None:
+        return False
+    canal, chamada = preparado
+    if callable(chamada):
+        chamada = _executar(chamada, _chaves_limite(item.empresa, canal), _circuito_do_item(item, canal))
+        if chamada.get('circuito_aberto'):
+            _reagendar(item, chamada['pausa'], chamada, motivo='circuito_aberto')
+            return False
+    return _concluir_item(item, canal, chamada, lotes)
+
+
+def _preparar_item(item, lotes=None):
+    """
+    Verifica capping e monta a chamada HTTP do item.
+    Retorna None se bloqueado, ou (canal, chamada) onde chamada é um
+    callable sem acesso ao banco ou um dict de erro.
+    """
     regra = item.regra
     empresa = item.empresa
 
     # Re-verificar blacklist/capping (pode ter mudado desde enfileiramento)
-    from comunicacao.services.motor import pode_enviar
-    ok, motivo = pode_enviar(regra, item.telefone)
+    lote = lotes.get(item.regra_id) if lotes else None
+    if lote:
+        ok, motivo = lote.pode_enviar(item.telefone)
+    else:
+        from comunicacao.services.motor import pode_enviar
+        ok, motivo = pode_enviar(regra, item.telefone)
     if not ok:
-        item.status = 'bloqueado'
-        item.erro = motivo
-        item.processado_em = timezone.now()
-        item.save(update_fields=['status', 'erro', 'processado_em'])
-        return False
-
-    item.status = 'enviando'
-    item.save(update_fields=['status'])
+        _gravar_se_dono(
+            item,
+            status='bloqueado',
+            erro=motivo,
+            processado_em=timezone.now(),
+            lease_ate=None,
+        )
+        return None
+    if lote:
+        # Os itens da rodada são enviados em paralelo: a vaga do max_dia
+        # fica reservada até o resultado (_concluir_item / _reagendar / _marcar_falha)
+        lote.reservar_envio()
+        item._reserva_capping = lote
+
+    if item.status != 'enviando':
+        # Envio avulso (fora de processar_fila)
+        item.status = 'enviando'
+        item.save(update_fields=['status'])
 
     # Resolver canal
     canal = regra.canal
@@ -77,34 +450,58 @@ def _enviar_item(item):
         canal = 'meta' if empresa.meta_phone_number_id and empresa.meta_access_token else 'wapi'
 
     if canal == 'meta':
-        resultado = _enviar_via_meta(item, regra, empresa)
-    else:
-        resultado = _enviar_via_wapi(item, regra, empresa)
+        return canal, _preparar_meta(item, regra, empresa)
+    return canal, _preparar_wapi(item, regra, empresa)
+
 
+def _concluir_item(item, canal, resultado, lotes=None):
+    """
+    Registra o resultado do envio (histórico, status, contadores).
+    Retorna None, sem registrar nada, se o lease foi perdido.
+    """
+    _liberar_reserva(item)
+    regra = item.regra
+    empresa = item.empresa
     sucesso = resultado.get('success', False)
 
-    # Registrar mensagem no histórico
-    msg = _registrar_mensagem(item, regra, empresa, canal, resultado)
-    item.mensagem = msg
+    campos = {
+        'status': 'enviado' if sucesso else 'falha',
+        'processado_em': timezone.now(),
+        'lease_ate': None,
+    }
+    if not sucesso:
+        campos['erro'] = resultado.get('error', '')[:500]
+
+    with transaction.atomic():
+        # Registrar mensagem no histórico (desfeito se o item não é mais deste worker)
+        msg = _registrar_mensagem(item, regra, empresa, canal, resultado)
+        if not _gravar_se_dono(item, mensagem=msg, **campos):
+            transaction.set_rollback(True)
+            return None
 
     if sucesso:
-        item.status = 'enviado'
         # Atualizar estatísticas da régra
         RegraComunicacao.objects.filter(id=regra.id).update(
             total_enviados=models.F('total_enviados') + 1,
         )
-    else:
-        item.status = 'falha'
-        item.erro = resultado.get('error', '')[:500]
-
-    item.processado_em = timezone.now()
-    item.save(update_fields=['status', 'erro', 'processado_em', 'mensagem'])
+        contadores.registrar_envio(
+            empresa.id, item.telefone,
+            f'msg:{msg.id}' if msg else f'fila:{item.id}',
+            regra=regra,
+        )
+        estado.registrar_envio(empresa.id, item.telefone, canal=canal)
+        # Próximos itens do lote precisam enxergar este envio
+        for outro in (lotes or {}).values():
+            if outro.empresa_id == item.empresa_id:
+                outro.registrar_envio(
+                    item.telefone, mesma_regra=outro.regra.id == regra.id, canal=canal,
+                )
 
     return sucesso
 
 
-def _enviar_via_meta(item, regra, empresa):
-    """Envia via Meta Cloud API."""
+def _preparar_meta(item, regra, empresa):
+    """Monta o envio via Meta Cloud API."""
     client = MetaWhatsAppClient(
         phone_number_id=empresa.meta_phone_number_id,
         access_token=empresa.meta_access_token,
@@ -117,7 +514,7 @@ def _enviar_via_meta(item, regra, empresa):
         return {'success': False, 'error': 'Template Meta não definido na régua'}
 
     # Montar parâmetros
-    params = _build_params(regra, item)
+    params = _params_do_item(item)
 
     # Botão URL dinâmica
     button_url_params = None
@@ -126,14 +523,14 @@ def _enviar_via_meta(item, regra, empresa):
         if val:
             button_url_params = [str(val)]
 
-    return client.enviar_template(
+    return lambda: client.enviar_template(
         item.telefone, template, params,
         button_url_params=button_url_params,
     )
 
 
-def _enviar_via_wapi(item, regra, empresa):
-    """Envia via W-API."""
+def _preparar_wapi(item, regra, empresa):
+    """Monta o envio via W-API."""
     # Usar instância da régra ou fallback
     if regra.instancia_wapi and regra.instancia_wapi.ativo:
         client = WAPIClient(
@@ -164,19 +561,37 @@ def _enviar_via_wapi(item, regra, empresa):
         validade=cupom_params.get('validade', ''),
     )
 
-    return client.enviar_mensagem(item.telefone, texto)
+    return lambda: client.enviar_mensagem(item.telefone, texto)
+
+
+def _valores_cupom(regra, empresa):
+    """Cupom da régra com fallback da empresa (uma vez por régra no lote)."""
+    cupom = regra.get_cupom_params() if regra.usar_cupom else {}
+    return {
+        'cupom': cupom.get('cupom') or empresa.meta_cupom_codigo or '',
+        'desconto': cupom.get('desconto') or empresa.meta_cupom_desconto or '',
+        'validade': cupom.get('validade') or empresa.meta_cupom_validade or '',
+    }
+
+
+_BUSCAR = object()
 
 
-def _build_params(regra, item):
-    """Monta lista de parâmetros para template Meta baseado no mapeamento."""
+def _build_params(regra, item, ultimo_pedido=_BUSCAR, cupom=None):
+    """
+    Monta lista de parâmetros para template Meta baseado no mapeamento.
+    ultimo_pedido: (order_number, total) pré-carregado, None se o cliente
+    não tem pedidos; sem o argumento, busca no banco.
+    """
     param_map = regra.template_params_map or ['nome']
-    cupom = regra.get_cupom_params()
+    if cupom is None:
+        cupom = _valores_cupom(regra, item.empresa)
 
     valores = {
         'nome': item.nome,
-        'cupom': cupom.get('cupom', regra.empresa.meta_cupom_codigo or ''),
-        'desconto': cupom.get('desconto', regra.empresa.meta_cupom_desconto or ''),
-        'validade': cupom.get('validade', regra.empresa.meta_cupom_validade or ''),
+        'cupom': cupom['cupom'],
+        'desconto': cupom['desconto'],
+        'validade': cupom['validade'],
         'numero': '',
         'valor': '',
     }
@@ -186,14 +601,24 @@ def _build_params(regra, item):
         valores['valor'] = str(item.cart.cart_total)
     elif item.customer:
         # Para pedidos, pegar do último order (se disponível)
-        ultimo_order = item.customer.orders.order_by('-created_at').first()
-        if ultimo_order:
-            valores['numero'] = ultimo_order.order_number
-            valores['valor'] = str(ultimo_order.total)
+        if ultimo_pedido is _BUSCAR:
+            ultimo = item.customer.orders.order_by('-created_at').first()
+            ultimo_pedido = (ultimo.order_number, ultimo.total) if ultimo else None
+        if ultimo_pedido:
+            valores['numero'], total = ultimo_pedido
+            valores['valor'] = str(total)
 
     return [valores.get(p, '') for p in param_map]
 
 
+def _params_do_item(item):
+    """Parâmetros do item (montados uma vez: envio e histórico usam os mesmos)."""
+    params = getattr(item, '_template_params', None)
+    if params is None:
+        params = item._template_params = _build_params(item.regra, item)
+    return params
+
+
 def _registrar_mensagem(item, regra, empresa, canal, resultado):
     """Registra mensagem no histórico centralizado."""
     success = resultado.get('success', False)
@@ -216,7 +641,7 @@ def _registrar_mensagem(item, regra, empresa, canal, resultado):
         destinatario_nome=item.nome,
         destinatario_telefone=item.telefone,
         template_name=regra.template_meta if canal == 'meta' else '',
-        template_params=_build_params(regra, item) if canal == 'meta' else [],
+        template_params=_params_do_item(item) if canal == 'meta' else [],
         mensagem_texto=regra.texto_wapi if canal == 'wapi' else '',
         error_message=resultado.get('error', '') if not success else '',
         api_response=response_data,
@@ -0,0 +1,79 @@
+"""
+Estatísticas de engajamento das réguas (total_enviados, total_entregues,
+total_lidos, total_respondidos).
+
+- recalcular(): todas as réguas numa consulta agrupada fila_envio ×
+  mensagens_whatsapp com agregação condicional, gravadas com bulk_update
+  (tasks.atualizar_stats_regras, diário: corrige qualquer desvio)
+- aplicar_transicao(): ajuste incremental a partir do webhook de status
+  da Meta, para os números ficarem quase em tempo real
+"""
+import logging
+
+from django.db.models import Count, F, Q
+
+from comunicacao.models import FilaEnvio, RegraComunicacao
+
+logger = logging.getLogger(__name__)
+
+STATUS_ENTREGUE = ['entregue', 'lido']
+
+CAMPOS = ['total_enviados', 'total_entregues', 'total_lidos', 'total_respondidos']
+
+
+def recalcular():
+    """Recalcula as estatísticas de todas as réguas com envios. Retorna nº de réguas."""
+    linhas = FilaEnvio.objects.filter(
+        status='enviado', mensagem__isnull=False,
+    ).values('regra_id').annotate(
+        enviados=Count('id'),
+        entregues=Count('id', filter=Q(mensagem__status__in=STATUS_ENTREGUE)),
+        lidos=Count('id', filter=Q(mensagem__status='lido')),
+        respondidos=Count('id', filter=Q(mensagem__respondido=True)),
+    ).order_by()
+
+    regras = []
+    for linha in linhas:
+        regras.append(RegraComunicacao(
+            id=linha['regra_id'],
+            total_enviados=linha['enviados'],
+            total_entregues=linha['entregues'],
+            total_lidos=linha['lidos'],
+            total_respondidos=linha['respondidos'],
+        ))
+
+    # bulk_update não dispara signals nem mexe em updated_at
+    # (o cache de réguas e as condições compiladas continuam válidos)
+    RegraComunicacao.objects.bulk_update(regras, CAMPOS, batch_size=500)
+    return len(regras)
+
+
+def _metricas(status, respondido):
+    return {
+        'total_entregues': status in STATUS_ENTREGUE,
+        'total_lidos': status == 'lido',
+        'total_respondidos': bool(respondido),
+    }
+
+
+def aplicar_transicao(mensagem, status_antes, respondido_antes=False):
+    """
+    Ajusta os contadores da régua que gerou a mensagem após mudança de
+    status/resposta (a mensagem já com os valores novos). Uma consulta;
+    nada a fazer para mensagens fora de réguas.
+    """
+    antes = _metricas(status_antes, respondido_antes)
+    depois = _metricas(mensagem.status, mensagem.respondido)
+
+    deltas = {
+        campo: F(campo) + (int(depois[campo]) - int(antes[campo]))
+        for campo in antes
+        if depois[campo] != antes[campo]
+    }
+    if not deltas:
+        return 0
+
+    return RegraComunicacao.objects.filter(
+        fila_envios__mensagem_id=mensagem.id,
+        fila_envios__status='enviado',
+    ).update(**deltas)
@@ -0,0 +1,34 @@
+"""
+Signals do app comunicacao (conectados em ComunicacaoConfig.ready()):
+
+- ContatoBlacklist → espelha no ContatoEstado (comunicacao.services.estado)
+- RegraComunicacao → invalida o cache de réguas (comunicacao.services.cache_regras)
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from comunicacao.models import ContatoBlacklist, RegraComunicacao
+from comunicacao.services import cache_regras
+from comunicacao.services.estado import marcar_bloqueado
+
+
+@receiver(post_save, sender=ContatoBlacklist)
+def _blacklist_criada(sender, instance, created, **kwargs):
+    if created:
+        marcar_bloqueado(instance.empresa_id, [instance.telefone], bloqueado=True)
+
+
+@receiver(post_delete, sender=ContatoBlacklist)
+def _blacklist_removida(sender, instance, **kwargs):
+    marcar_bloqueado(instance.empresa_id, [instance.telefone], bloqueado=False)
+
+
+@receiver(post_save, sender=RegraComunicacao)
+@receiver(post_delete, sender=RegraComunicacao)
+def _regra_alterada(sender, instance, **kwargs):
+    empresa_id = instance.empresa_id
+    cache_regras.invalidar(empresa_id)
+    # De novo após o commit: um worker pode ter recarregado a versão antiga
+    # entre o save e o commit
+    transaction.on_commit(lambda: cache_regras.invalidar(empresa_id))
@@ -2,22 +2,51 @@
 Tasks Celery do Motor de Réguas.
 
 - processar_fila_envio: a cada 2 minutos, consome a fila
+- despachar_fila_vencida: a cada poucos segundos, dispara a fila quando
+  algum item venceu (só consulta o Redis)
+- liberar_leases_expirados: a cada minuto, devolve itens de workers mortos
 - avaliar_regras_periodicas: a cada hora, avalia réguas baseadas em tempo (inatividade, etc.)
 - atualizar_engagement: diário, recalcula scores e stats
+- processar_eventos: sob demanda, avalia eventos recebidos em lote pela API
+- renovar_contadores_capping: diário, reconstrói os contadores de capping
+  no Redis cuja marca sumiu ou está vencendo
 """
 import logging
 from celery import shared_task
-from datetime import timedelta
-from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
 
 @shared_task(name='comunicacao.processar_fila_envio')
 def processar_fila_envio():
-    """Consome a fila de envio. Roda a cada 2 minutos."""
+    """
+    Consome a fila de envio. Disparado pelo despacho (services.despacho)
+    e pela varredura de segurança do beat.
+    Se o lote veio cheio, agenda outra execução para que outros workers
+    ajudem a drenar a fila (os itens são reservados com SKIP LOCKED).
+    """
+    from django.conf import settings
     from comunicacao.services.sender import processar_fila
-    return processar_fila(limit=100)
+
+    limit = getattr(settings, 'ENVIO_LOTE', 500)
+    resultado = processar_fila(limit=limit)
+    if resultado['reivindicados'] >= limit:
+        processar_fila_envio.delay()
+    return resultado
+
+
+@shared_task(name='comunicacao.despachar_fila_vencida', ignore_result=True)
+def despachar_fila_vencida():
+    """Dispara processar_fila_envio se algum horário agendado venceu."""
+    from comunicacao.services.despacho import despachar_vencidos
+    return despachar_vencidos()
+
+
+@shared_task(name='comunicacao.liberar_leases_expirados')
+def liberar_leases_expirados():
+    """Devolve para a fila itens presos em 'enviando' com lease vencido."""
+    from comunicacao.services.sender import liberar_leases_expirados as liberar
+    return {'liberados': liberar()}
 
 
 @shared_task(name='comunicacao.avaliar_regras_periodicas')
@@ -26,111 +55,98 @@ def avaliar_regras_periodicas():
     Avalia réguas baseadas em tempo (não em evento).
     Ex: clientes inativos 30/60/90 dias, leads sem conversão, etc.
     Roda a cada hora (mas régras controlam horário de envio).
+
+    Elegíveis são selecionados em SQL (services.periodico), sem limite
+    por ciclo.
     """
     from tenants.models import Empresa
-    from customers.models import Customer, Lead, Cart
-    from comunicacao.services.motor import avaliar_regras_para_gatilho
-    from comunicacao.models import RegraComunicacao
+    from comunicacao.services.periodico import avaliar_empresa
 
-    empresas = Empresa.objects.filter(ativo=True)
+    empresas = Empresa.objects.filter(ativo=True, regras_comunicacao__ativo=True).distinct()
     total_enfileirados = 0
+    por_empresa = {}
 
     for empresa in empresas:
-        # Verificar se tem alguma régra ativa
-        regras_ativas = RegraComunicacao.objects.filter(
-            empresa=empresa, ativo=True,
-        ).values_list('gatilho', flat=True).distinct()
-
-        if not regras_ativas:
+        relatorio = avaliar_empresa(empresa)
+        if not relatorio:
             continue
-
-        # --- Clientes inativos ---
-        gatilhos_inatividade = {
-            'customer_inactive_30': 30,
-            'customer_inactive_60': 60,
-            'customer_inactive_90': 90,
-        }
-
-        for gatilho, dias in gatilhos_inatividade.items():
-            if gatilho not in regras_ativas:
-                continue
-
-            clientes = Customer.objects.filter(
-                empresa=empresa,
-                completed_orders__gte=1,
-                days_since_last_purchase__gte=dias,
-                phone__isnull=False,
-            ).exclude(phone='')[:50]  # Limite por ciclo
-
-            for customer in clientes:
-                results = avaliar_regras_para_gatilho(
-                    empresa, gatilho, customer=customer,
-                )
-                total_enfileirados += sum(1 for item, m in results if item)
-
-        # --- Leads sem conversão (form preenchido ontem) ---
-        if 'lead_new' in regras_ativas:
-            ontem = timezone.now() - timedelta(days=1)
-            leads = Lead.objects.filter(
-                empresa=empresa,
-                created_at__date=ontem.date(),
-                whatsapp_sent=False,
-            ).exclude(whatsapp='').exclude(whatsapp__isnull=True)
-
-            for lead in leads:
-                lead.check_if_customer()
-                results = avaliar_regras_para_gatilho(
-                    empresa, 'lead_new', lead=lead,
-                )
-                total_enfileirados += sum(1 for item, m in results if item)
-
-        # --- Carrinhos abandonados ---
-        if 'cart_abandoned' in regras_ativas:
-            carts = Cart.objects.filter(
-                empresa=empresa,
-                status='abandoned',
-                recovery_whatsapp_sent=False,
-            ).select_related('customer').exclude(
-                customer__phone=''
-            ).exclude(customer__phone__isnull=True)[:50]
-
-            for cart in carts:
-                results = avaliar_regras_para_gatilho(
-                    empresa, 'cart_abandoned', cart=cart,
-                )
-                total_enfileirados += sum(1 for item, m in results if item)
+        por_empresa[empresa.slug] = relatorio
+        enfileirados = sum(g['enfileirados'] for g in relatorio.values())
+        total_enfileirados += enfileirados
+        logger.info(
+            f"[{empresa.slug}] Réguas periódicas: {enfileirados} enfileirados - "
+            + ', '.join(
+                f"{gatilho}: {g['enfileirados']}/{g['elegiveis']}"
+                for gatilho, g in relatorio.items()
+            )
+        )
 
     if total_enfileirados:
         logger.info(f"Réguas periódicas: {total_enfileirados} enfileirados")
 
-    return {'enfileirados': total_enfileirados}
+    return {'enfileirados': total_enfileirados, 'por_empresa': por_empresa}
+
+
+@shared_task(name='comunicacao.processar_eventos')
+def processar_eventos(evento_ids):
+    """
+    Avalia as réguas dos eventos recebidos por /api/v1/events/batch/,
+    agrupados por empresa e gatilho. Eventos já processados são ignorados.
+    """
+    from comunicacao.services.eventos import processar_pendentes
+    return processar_pendentes(evento_ids)
+
+
+@shared_task(name='comunicacao.atribuir_conversoes')
+def atribuir_conversoes():
+    """
+    Atribui pedidos novos às mensagens enviadas antes deles
+    (total_convertidos / receita_convertida das réguas).
+    Incremental: cada empresa só processa pedidos desde a última execução.
+    """
+    from tenants.models import Empresa
+    from comunicacao.services.atribuicao import atribuir_empresa
+
+    total_conversoes = 0
+    for empresa in Empresa.objects.filter(ativo=True):
+        try:
+            total_conversoes += atribuir_empresa(empresa)['conversoes']
+        except Exception as e:
+            logger.error(f"[{empresa.slug}] Erro na atribuição de conversões: {e}")
+
+    return {'conversoes': total_conversoes}
 
 
 @shared_task(name='comunicacao.atualizar_stats_regras')
 def atualizar_stats_regras():
     """
-    Atualiza estatísticas das régras (entregues, lidos, respondidos).
-    Roda diariamente.
+    Atualiza estatísticas das régras (enviados, entregues, lidos, respondidos)
+    numa consulta agrupada. Roda diariamente; durante o dia o webhook de
+    status da Meta ajusta os números de forma incremental.
     """
-    from comunicacao.models import RegraComunicacao, FilaEnvio
-    from customers.models import MensagemWhatsApp
+    from comunicacao.services.stats_regras import recalcular
 
-    regras = RegraComunicacao.objects.filter(ativo=True)
-    for regra in regras:
-        msgs_ids = FilaEnvio.objects.filter(
-            regra=regra, status='enviado', mensagem__isnull=False,
-        ).values_list('mensagem_id', flat=True)
+    total = recalcular()
+    logger.info(f"Stats atualizadas para {total} réguas")
+    return {'regras': total}
 
-        if not msgs_ids:
-            continue
 
-        msgs = MensagemWhatsApp.objects.filter(id__in=msgs_ids)
-        regra.total_enviados = msgs.count()
-        regra.total_entregues = msgs.filter(status__in=['entregue', 'lido']).count()
-        regra.total_lidos = msgs.filter(status='lido').count()
-        regra.total_respondidos = msgs.filter(respondido=True).count()
-        regra.save(update_fields=[
-            'total_enviados', 'total_entregues', 'total_lidos', 'total_respondidos',
-        ])
+@shared_task(name='comunicacao.renovar_contadores_capping')
+def renovar_contadores_capping():
+    """
+    Reconstrói os contadores de capping das empresas ativas cuja marca
+    cap:pronto sumiu ou vence em menos de um dia. Roda de madrugada
+    (fora do horário de disparo).
+    """
+    from tenants.models import Empresa
+    from comunicacao.services import contadores
+
+    reconstruidas = 0
+    for empresa in Empresa.objects.filter(ativo=True):
+        if not contadores.precisa_reconstruir(empresa.id):
+            continue
+        resultado = contadores.reconstruir(empresa)
+        if resultado['success']:
+            reconstruidas += 1
 
-    logger.info(f"Stats atualizadas para {regras.count()} réguas")
+    return {'empresas': reconstruidas}
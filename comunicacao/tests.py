@@ -1,3 +1,857 @@
+import json
+from datetime import time, timedelta
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+
+from comunicacao.models import (
+    ContatoBlacklist, ContatoEstado, ConversaoAtribuida, EventoRecebido, FilaEnvio, RegraComunicacao,
+)
+from comunicacao import tasks
+from comunicacao.services import (
+    atribuicao, cache_regras, circuito, condicoes, contadores, despacho, estado, motor, sender, stats_regras,
+)
+from comunicacao.services.capping import CappingLote, pode_enviar_lote
+from comunicacao.services.ratelimit import TTL_BUCKET, BucketRedis, LimitadorEnvio, TokenBucket, eh_limite_de_taxa
+from customers.models import Customer, MensagemWhatsApp, Order
+from tenants.models import Empresa
+
+
+class CappingLoteTests(TestCase):
+    """Testes do frequency capping em lote"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+        self.regra = RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='Carrinho', gatilho='cart_abandoned',
+            template_meta='carrinho', max_msgs_semana_telefone=2,
+            max_ignorados_consecutivos=3,
+        )
+
+    def _mensagem(self, telefone, status='enviado'):
+        return MensagemWhatsApp.objects.create(
+            empresa=self.empresa, tipo='cart', canal='meta', status=status,
+            destinatario_nome='Ana', destinatario_telefone=telefone,
+        )
+
+    def test_lote_igual_ao_individual(self):
+        ContatoBlacklist.objects.create(
+            empresa=self.empresa, telefone='5516900000001', motivo='manual',
+        )
+        self._mensagem('5516900000002', status='lido')
+        self._mensagem('5516900000002', status='lido')
+        telefones = ['5516900000001', '5516900000002', '5516900000003']
+
+        lote = pode_enviar_lote(self.regra, telefones)
+        # Estados já montados: uma linha por contato + fatos da régua
+        with self.assertNumQueries(3):
+            pode_enviar_lote(self.regra, telefones)
+
+        self.assertEqual(lote['5516900000001'], (False, 'blacklist'))
+        self.assertEqual(lote['5516900000002'], (False, 'max_semana (2)'))
+        self.assertEqual(lote['5516900000003'], (True, 'ok'))
+        for tel in telefones:
+            self.assertEqual(motor.pode_enviar(self.regra, tel), lote[tel])
+
+    def test_ignorados_vira_blacklist(self):
+        self.regra.max_msgs_semana_telefone = 10
+        self.regra.save()
+        for _ in range(3):
+            self._mensagem('5516900000004')
+
+        ok, motivo = pode_enviar_lote(self.regra, ['5516900000004'])['5516900000004']
+
+        self.assertFalse(ok)
+        self.assertEqual(motivo, 'ignorados (3x)')
+        self.assertTrue(ContatoBlacklist.objects.filter(
+            empresa=self.empresa, telefone='5516900000004', motivo='too_many_ignored',
+        ).exists())
+
+    def test_registrar_envio_afeta_proximos_itens(self):
+        lote = CappingLote(self.regra, ['5516900000005'])
+        lote.registrar_envio('5516900000005')
+        lote.registrar_envio('5516900000005', mesma_regra=False)
+        self.assertEqual(lote.pode_enviar('5516900000005'), (False, 'max_semana (2)'))
+
+    def test_enfileira_lote_sem_duplicatas(self):
+        contatos = [
+            {'telefone': '16900000006', 'nome': 'Ana'},
+            {'telefone': '5516900000006', 'nome': 'Ana'},
+            {'telefone': '16900000007', 'nome': 'Bia'},
+        ]
+        resultados = motor.avaliar_regras_para_gatilho_lote(
+            self.empresa, 'cart_abandoned', contatos,
+        )
+
+        self.assertEqual([m for _, m in resultados].count('enfileirado'), 2)
+        self.assertEqual([m for _, m in resultados].count('ja_na_fila'), 1)
+        self.assertEqual(FilaEnvio.objects.filter(regra=self.regra).count(), 2)
+
+    @mock.patch('bling.meta_whatsapp.MetaWhatsAppClient.enviar_template')
+    def test_fila_respeita_envios_do_mesmo_ciclo(self, enviar_template):
+        enviar_template.return_value = {'success': True, 'response': {}}
+        self._configurar_meta()
+        outra = RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='Carrinho 2', gatilho='cart_abandoned',
+            template_meta='carrinho', prioridade=2, max_msgs_semana_telefone=1,
+        )
+        for regra in (self.regra, outra):
+            FilaEnvio.objects.create(
+                empresa=self.empresa, regra=regra, telefone='5516900000008',
+                nome='Ana', agendar_para=timezone.now(),
+            )
+
+        resultado = sender.processar_fila()
+
+        self.assertEqual(resultado['enviados'], 1)
+        self.assertEqual(resultado['falhas'], 1)
+        self.assertEqual(FilaEnvio.objects.filter(status='bloqueado').count(), 1)
+
+    @mock.patch('bling.meta_whatsapp.MetaWhatsAppClient.enviar_template')
+    def test_max_dia_vale_dentro_da_rodada(self, enviar_template):
+        enviar_template.return_value = {'success': True, 'response': {}}
+        self._configurar_meta()
+        self.regra.max_envios_dia = 1
+        self.regra.save()
+        for n in range(3):
+            FilaEnvio.objects.create(
+                empresa=self.empresa, regra=self.regra, telefone=f'551690000002{n}',
+                nome='Ana', agendar_para=timezone.now(),
+            )
+
+        resultado = sender.processar_fila()
+
+        self.assertEqual(resultado['enviados'], 1)
+        enviar_template.assert_called_once()
+        self.assertEqual(
+            list(FilaEnvio.objects.filter(status='bloqueado').values_list('erro', flat=True)),
+            ['max_dia (1)'] * 2,
+        )
+
+    def test_reserva_ocupa_vaga_do_max_dia_ate_ser_liberada(self):
+        self.regra.max_envios_dia = 1
+        lote = CappingLote(self.regra, ['5516900000025'])
+        lote.reservar_envio()
+        self.assertEqual(lote.pode_enviar('5516900000025'), (False, 'max_dia (1)'))
+        lote.liberar_reserva()
+        self.assertEqual(lote.pode_enviar('5516900000025'), (True, 'ok'))
+
+    @mock.patch('bling.meta_whatsapp.MetaWhatsAppClient.enviar_template')
+    def test_rate_limit_reagenda(self, enviar_template):
+        enviar_template.return_value = {
+            'success': False, 'error': 'Rate limit hit', 'status_code': 400, 'error_code': 130429,
+        }
+        self._configurar_meta()
+        item = FilaEnvio.objects.create(
+            empresa=self.empresa, regra=self.regra, telefone='5516900000010',
+            nome='Ana', agendar_para=timezone.now(),
+        )
+
+        with mock.patch.object(sender.limitador, 'penalizar', return_value=4.0) as penalizar:
+            resultado = sender.processar_fila()
+
+        self.assertEqual(resultado['reagendados'], 1)
+        penalizar.assert_called_once_with([('empresa', self.empresa.id), ('numero', '123')])
+        item.refresh_from_db()
+        self.assertEqual(item.status, 'pendente')
+        self.assertGreater(item.agendar_para, timezone.now())
+        self.assertFalse(MensagemWhatsApp.objects.filter(destinatario_telefone='5516900000010').exists())
+
+    def _configurar_meta(self):
+        self.empresa.meta_phone_number_id = '123'
+        self.empresa.meta_access_token = 'token'
+        self.empresa.save()
+
+    @mock.patch('bling.meta_whatsapp.MetaWhatsAppClient.enviar_template')
+    def test_parametros_do_ultimo_pedido_montados_uma_vez(self, enviar_template):
+        enviar_template.return_value = {'success': True, 'response': {'messages': [{'id': 'wamid.1'}]}}
+        self._configurar_meta()
+        regra = RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='Pedido', gatilho='order_delivered', template_meta='entregue',
+            template_params_map=['nome', 'numero', 'valor'], cooldown_horas=0,
+        )
+        agora = timezone.now()
+        for n in range(3):
+            customer = Customer.objects.create(
+                empresa=self.empresa, email=f'p{n}@x.com', first_name='Ana', phone=f'1690000003{n}',
+            )
+            for dias, numero in ((5, f'{n}-antigo'), (1, f'{n}-novo')):
+                Order.objects.create(
+                    empresa=self.empresa, customer=customer, order_id=numero, order_number=numero,
+                    total='99.90', status='completed', created_at=agora - timedelta(days=dias),
+                )
+            FilaEnvio.objects.create(
+                empresa=self.empresa, regra=regra, customer=customer, telefone=f'551690000003{n}',
+                nome='Ana', agendar_para=agora,
+            )
+
+        itens = list(FilaEnvio.objects.filter(regra=regra).select_related('empresa', 'regra', 'customer'))
+        with self.assertNumQueries(1):
+            sender._carregar_params(itens)
+
+        self.assertEqual(sender.processar_fila()['enviados'], 3)
+        params = enviar_template.call_args_list[0].args[2]
+        self.assertEqual(params[2], '99.90')
+        self.assertTrue(params[1].endswith('-novo'))
+        msg = MensagemWhatsApp.objects.get(meta_message_id='wamid.1', destinatario_telefone=enviar_template.call_args_list[0].args[0])
+        self.assertEqual(msg.template_params, params)
+
+
+class ReservaFilaTests(TestCase):
+    """Testes da reserva (lease) de itens da fila"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+        self.regra = RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='Carrinho', gatilho='cart_abandoned',
+        )
+        self.itens = [
+            FilaEnvio.objects.create(
+                empresa=self.empresa, regra=self.regra, telefone=f'55169000001{n}',
+                nome='Ana', agendar_para=timezone.now(),
+            )
+            for n in range(3)
+        ]
+
+    def test_workers_nao_pegam_o_mesmo_item(self):
+        primeiro = sender.reivindicar(2, 'worker-a')
+        segundo = sender.reivindicar(2, 'worker-b')
+
+        self.assertEqual(len(primeiro), 2)
+        self.assertEqual(len(segundo), 1)
+        self.assertFalse(set(primeiro) & set(segundo))
+        self.assertEqual(FilaEnvio.objects.filter(status='enviando', lease_dono='worker-a').count(), 2)
+
+    def test_lease_vencido_volta_para_pendente(self):
+        sender.reivindicar(3, 'worker-a')
+        FilaEnvio.objects.filter(id=self.itens[0].id).update(
+            lease_ate=timezone.now() - timedelta(seconds=1),
+        )
+
+        self.assertEqual(sender.liberar_leases_expirados(), 1)
+        self.assertEqual(FilaEnvio.objects.get(id=self.itens[0].id).status, 'pendente')
+        self.assertEqual(FilaEnvio.objects.filter(status='enviando').count(), 2)
+
+    def test_renovar_lease_estende_so_os_itens_do_worker(self):
+        sender.reivindicar(3, 'worker-a')
+        vencendo = timezone.now() + timedelta(seconds=5)
+        FilaEnvio.objects.update(lease_ate=vencendo)
+        FilaEnvio.objects.filter(id=self.itens[0].id).update(status='pendente', lease_dono='')
+
+        vivos = sender.renovar_lease('worker-a')
+
+        self.assertEqual(vivos, {self.itens[1].id, self.itens[2].id})
+        self.assertTrue(all(
+            item.lease_ate > vencendo
+            for item in FilaEnvio.objects.filter(id__in=vivos)
+        ))
+
+    def test_lease_perdido_nao_conclui_o_envio(self):
+        sender.reivindicar(1, 'worker-a')
+        item = FilaEnvio.objects.select_related('empresa', 'regra').get(lease_dono='worker-a')
+        # Lease venceu e outro worker reivindicou o item
+        FilaEnvio.objects.filter(id=item.id).update(lease_dono='worker-b')
+
+        resultado = sender._concluir_item(item, 'meta', {'success': True, 'response': {}})
+
+        self.assertIsNone(resultado)
+        self.assertFalse(sender._reagendar(item, 10, {'error': 'limite'}))
+        item.refresh_from_db()
+        self.assertEqual((item.status, item.lease_dono), ('enviando', 'worker-b'))
+        self.assertFalse(MensagemWhatsApp.objects.exists())
+
+
+class DespachoTests(TestCase):
+    """Testes do despacho da fila por vencimento"""
+
+    def setUp(self):
+        cache.clear()
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+
+    @mock.patch('comunicacao.tasks.processar_fila_envio.delay')
+    def test_item_vencido_dispara_apos_commit(self, delay):
+        regra = RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='Pedido', gatilho='order_created', delay_horas=0,
+            horario_inicio=time(0, 0), horario_fim=time(23, 59, 59),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            motor.avaliar_regras_para_gatilho_lote(self.empresa, 'order_created', [
+                {'telefone': '5516900000020', 'nome': 'Ana'},
+                {'telefone': '5516900000021', 'nome': 'Bia'},
+            ])
+            self.assertFalse(delay.called)
+
+        self.assertEqual(FilaEnvio.objects.filter(regra=regra).count(), 2)
+        delay.assert_called_once_with()
+
+    @mock.patch('comunicacao.services.despacho.get_redis', return_value=None)
+    def test_sem_redis_nao_dispara_futuro(self, get_redis):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            despacho.agendar_despacho(timezone.now() + timedelta(hours=1))
+        self.assertEqual(callbacks, [])
+        self.assertEqual(despacho.despachar_vencidos(), 0)
+
+
+class AvaliacaoPeriodicaTests(TestCase):
+    """Testes da avaliação periódica set-based"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+        self.regra = RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='Inativo 30', gatilho='customer_inactive_30',
+            template_meta='volta',
+        )
+        Customer.objects.bulk_create([
+            Customer(
+                empresa=self.empresa, email=f'c{n}@x.com', first_name=f'Cliente {n}',
+                phone=f'(16) 98888-{n:04d}', completed_orders=1, days_since_last_purchase=40,
+            )
+            for n in range(60)
+        ])
+
+    def test_enfileira_todos_os_elegiveis_sem_limite(self):
+        ContatoBlacklist.objects.create(
+            empresa=self.empresa, telefone='5516988880001', motivo='manual',
+        )
+        FilaEnvio.objects.create(
+            empresa=self.empresa, regra=self.regra, telefone='5516988880002',
+            nome='Cliente 2', agendar_para=timezone.now(),
+        )
+
+        resultado = tasks.avaliar_regras_periodicas()
+
+        self.assertEqual(resultado['enfileirados'], 58)
+        self.assertEqual(
+            resultado['por_empresa']['loja']['customer_inactive_30'],
+            {'elegiveis': 58, 'enfileirados': 58},
+        )
+        self.assertTrue(FilaEnvio.objects.filter(telefone='5516988880059').exists())
+        self.assertEqual(FilaEnvio.objects.filter(telefone='5516988880002').count(), 1)
+
+
+class CondicoesCompiladasTests(TestCase):
+    """Testes do compilador de condições (JSON → Q)"""
+
+    def setUp(self):
+        condicoes.limpar_cache()
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+        self.regra = RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='VIP', gatilho='customer_inactive_30',
+            template_meta='volta',
+            condicoes={'min_orders': 2, 'max_orders': 5, 'min_total_spent': 100, 'min_cart_value': 50},
+        )
+        self.clientes = Customer.objects.bulk_create([
+            Customer(
+                empresa=self.empresa, email=f'c{n}@x.com', first_name=f'Cliente {n}',
+                phone=f'(16) 97777-{n:04d}', completed_orders=pedidos, total_spent=gasto,
+            )
+            for n, (pedidos, gasto) in enumerate([(1, 500), (2, 100), (3, 50), (6, 900), (4, 300)])
+        ])
+
+    def test_filtro_no_banco_igual_a_avaliacao_em_python(self):
+        compilada = condicoes.compilar(self.regra, 'customer')
+        self.assertFalse(compilada.chaves_python)
+
+        no_banco = set(Customer.objects.filter(empresa=self.empresa).filter(compilada.q))
+        em_python = {c for c in Customer.objects.filter(empresa=self.empresa)
+                     if motor._avaliar_condicoes(self.regra, customer=c)}
+        self.assertEqual(no_banco, em_python)
+        self.assertEqual({c.email for c in no_banco}, {'c1@x.com', 'c4@x.com'})
+
+    def test_cache_por_versao_da_regra(self):
+        compilada = condicoes.compilar(self.regra, 'customer')
+        self.assertIs(condicoes.compilar(self.regra, 'customer'), compilada)
+
+        self.regra.condicoes = {'min_score': 10}
+        self.regra.save()
+        self.assertIsNot(condicoes.compilar(self.regra, 'customer'), compilada)
+
+    def test_lead_e_valor_nao_numerico_ficam_em_python(self):
+        self.assertEqual(
+            condicoes.compilar(self.regra, 'lead').chaves_python,
+            {'min_orders', 'max_orders', 'min_total_spent'},
+        )
+        self.regra.condicoes = {'min_orders': '2'}
+        self.assertEqual(condicoes._compilar(self.regra.condicoes, 'customer').chaves_python, {'min_orders'})
+
+    def test_filtrar_contatos_em_uma_consulta(self):
+        contatos = [{'customer': c} for c in self.clientes]
+        with self.assertNumQueries(1):
+            resultado = condicoes.filtrar_contatos(self.regra, contatos)
+        self.assertEqual(resultado, [False, True, False, False, True])
+
+
+class CacheRegrasTests(TestCase):
+    """Testes do cache de réguas por (empresa, gatilho)"""
+
+    def setUp(self):
+        cache_regras.limpar()
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+        self.etapa1 = RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='Carrinho 1', gatilho='cart_abandoned', template_meta='c1',
+        )
+        self.etapa2 = RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='Carrinho 2', gatilho='cart_abandoned', template_meta='c2', etapa=2,
+        )
+
+    def test_reutiliza_regras_e_cadeia_de_etapas(self):
+        regras = cache_regras.regras_do_gatilho(self.empresa.id, 'cart_abandoned')
+        self.assertEqual([r.id for r in regras], [self.etapa1.id, self.etapa2.id])
+        self.assertEqual(regras.etapa_anterior(self.etapa2).id, self.etapa1.id)
+
+        with self.assertNumQueries(0):
+            self.assertIs(cache_regras.regras_do_gatilho(self.empresa.id, 'cart_abandoned'), regras)
+            self.assertEqual(len(cache_regras.regras_do_gatilho(self.empresa.id, 'lead_new')), 0)
+
+    def test_save_e_delete_invalidam(self):
+        cache_regras.regras_do_gatilho(self.empresa.id, 'cart_abandoned')
+
+        self.etapa2.ativo = False
+        self.etapa2.save()
+        self.assertEqual(len(cache_regras.regras_do_gatilho(self.empresa.id, 'cart_abandoned')), 1)
+
+        self.etapa1.delete()
+        self.assertEqual(len(cache_regras.regras_do_gatilho(self.empresa.id, 'cart_abandoned')), 0)
+
+
+class StatsRegrasTests(TestCase):
+    """Testes das estatísticas de engajamento das réguas"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+        self.regras = [
+            RegraComunicacao.objects.create(
+                empresa=self.empresa, nome=f'Régua {n}', gatilho='cart_abandoned', template_meta='c',
+            )
+            for n in range(2)
+        ]
+        self.msgs = []
+        for regra, status, respondido in [
+            (self.regras[0], 'enviado', False),
+            (self.regras[0], 'entregue', False),
+            (self.regras[0], 'lido', True),
+            (self.regras[1], 'lido', False),
+        ]:
+            msg = MensagemWhatsApp.objects.create(
+                empresa=self.empresa, tipo='cart', canal='meta', status=status, respondido=respondido,
+                destinatario_nome='Ana', destinatario_telefone='5516999990000',
+            )
+            FilaEnvio.objects.create(
+                empresa=self.empresa, regra=regra, telefone='5516999990000', nome='Ana',
+                agendar_para=timezone.now(), status='enviado', mensagem=msg,
+            )
+            self.msgs.append(msg)
+
+    def _totais(self, regra):
+        regra.refresh_from_db()
+        return [getattr(regra, campo) for campo in stats_regras.CAMPOS]
+
+    def test_recalcula_todas_as_regras_em_uma_consulta(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(tasks.atualizar_stats_regras(), {'regras': 2})
+        self.assertEqual(self._totais(self.regras[0]), [3, 2, 1, 1])
+        self.assertEqual(self._totais(self.regras[1]), [1, 1, 1, 0])
+
+    def test_transicoes_incrementais_batem_com_o_recalculo(self):
+        stats_regras.recalcular()
+
+        msg = self.msgs[0]
+        msg.status = 'lido'
+        stats_regras.aplicar_transicao(msg, 'enviado')
+        msg.respondido = True
+        stats_regras.aplicar_transicao(msg, 'lido', respondido_antes=False)
+        msg.status = 'falha'
+        stats_regras.aplicar_transicao(msg, 'lido', respondido_antes=True)
+        msg.save()
+
+        incremental = self._totais(self.regras[0])
+        stats_regras.recalcular()
+        self.assertEqual(incremental, self._totais(self.regras[0]))
+
+
+class AtribuicaoTests(TestCase):
+    """Testes da atribuição de conversões às réguas"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+        self.customer = Customer.objects.create(
+            empresa=self.empresa, email='ana@x.com', first_name='Ana', phone='(16) 99999-0000',
+        )
+        self.agora = timezone.now()
+        self.regras = [
+            RegraComunicacao.objects.create(
+                empresa=self.empresa, nome=f'Régua {n}', gatilho='customer_inactive_30', template_meta='c',
+            )
+            for n in range(2)
+        ]
+        # Régua 0 há 3 dias, régua 1 há 1 dia (último toque)
+        for regra, dias in zip(self.regras, (3, 1)):
+            msg = MensagemWhatsApp.objects.create(
+                empresa=self.empresa, tipo='cliente_inativo', canal='meta',
+                destinatario_nome='Ana', destinatario_telefone='5516999990000',
+            )
+            MensagemWhatsApp.objects.filter(id=msg.id).update(created_at=self.agora - timedelta(days=dias))
+            FilaEnvio.objects.create(
+                empresa=self.empresa, regra=regra, telefone='5516999990000', nome='Ana',
+                agendar_para=self.agora, status='enviado', mensagem=msg,
+            )
+
+    def _pedido(self, numero, total, status='wc-completed', dias=0):
+        return Order.objects.create(
+            empresa=self.empresa, customer=self.customer, order_id=str(numero), order_number=str(numero),
+            total=total, status=status, created_at=self.agora - timedelta(days=dias),
+        )
+
+    def test_ultimo_toque_incremental(self):
+        self._pedido(1, 150)
+        self._pedido(2, 80, status='wc-cancelled')
+        self._pedido(3, 60, dias=30)  # antes das mensagens
+
+        resultado = atribuicao.atribuir_empresa(self.empresa)
+        self.assertEqual((resultado['pedidos'], resultado['conversoes']), (3, 1))
+
+        self.regras[1].refresh_from_db()
+        self.assertEqual(self.regras[1].total_convertidos, 1)
+        self.assertEqual(self.regras[1].receita_convertida, 150)
+        self.assertEqual(ConversaoAtribuida.objects.get().regra, self.regras[1])
+
+        # Segunda execução só vê o pedido novo
+        self._pedido(4, 50)
+        resultado = atribuicao.atribuir_empresa(self.empresa)
+        self.assertEqual((resultado['pedidos'], resultado['conversoes']), (1, 1))
+        self.regras[1].refresh_from_db()
+        self.assertEqual(self.regras[1].total_convertidos, 2)
+        self.assertEqual(self.regras[1].receita_convertida, 200)
+
+    def test_primeiro_toque(self):
+        self._pedido(1, 100)
+        with self.settings(ATRIBUICAO_MODELO='primeiro_toque'):
+            atribuicao.atribuir_empresa(self.empresa)
+        self.assertEqual(ConversaoAtribuida.objects.get().regra, self.regras[0])
+
+
+class EventosLoteTests(TestCase):
+    """Testes do endpoint de eventos em lote"""
+
+    def setUp(self):
+        cache.clear()
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja', woo_webhook_secret='s3cr3t')
+        self.customer = Customer.objects.create(
+            empresa=self.empresa, email='ana@x.com', first_name='Ana', phone='(16) 99999-0000',
+        )
+        RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='Carrinho', gatilho='cart_abandoned', template_meta='carrinho',
+        )
+
+    def _post(self, corpo, content_type='application/json'):
+        return self.client.post(
+            '/api/v1/events/batch/', corpo, content_type=content_type,
+            HTTP_X_API_KEY='loja:s3cr3t',
+        )
+
+    @mock.patch.object(tasks.processar_eventos, 'delay', side_effect=tasks.processar_eventos)
+    def test_array_grava_e_avalia_em_background(self, delay):
+        eventos = [
+            {'type': 'cart.abandoned', 'data': {'email': 'ana@x.com', 'phone': '16999990000'}},
+            {'type': 'cart.abandoned', 'data': {'phone': '16988887777', 'name': 'Bia'}},
+            {'type': 'nao.existe', 'data': {}},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._post(json.dumps(eventos))
+
+        self.assertEqual(response.status_code, 202)
+        itens = response.json()['events']
+        self.assertEqual([i['index'] for i in itens], [0, 1, 2])
+        self.assertEqual(itens[2]['error'], 'invalid type')
+
+        ids = [itens[0]['event_id'], itens[1]['event_id']]
+        delay.assert_called_once_with(ids)
+        self.assertEqual(EventoRecebido.objects.filter(id__in=ids, processado=True).count(), 2)
+        self.assertEqual(EventoRecebido.objects.get(id=ids[0]).customer, self.customer)
+        self.assertEqual(
+            set(FilaEnvio.objects.values_list('telefone', flat=True)),
+            {'5516999990000', '5516988887777'},
+        )
+
+        # Reprocessar não enfileira de novo
+        self.assertEqual(tasks.processar_eventos(ids)['eventos'], 0)
+
+    def test_ndjson(self):
+        corpo = '\n'.join([
+            json.dumps({'type': 'lead.created', 'data': {'whatsapp': '16911112222'}}),
+            '',
+            json.dumps({'type': 'order.created', 'data': {'email': 'ana@x.com'}}),
+        ])
+        response = self._post(corpo, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['accepted'], 2)
+
+    def test_idempotencia_evento_unico(self):
+        corpo = json.dumps({'type': 'cart.abandoned', 'data': {'phone': '16999990000'}})
+        primeira = self.client.post(
+            '/api/v1/events/', corpo, content_type='application/json',
+            HTTP_X_API_KEY='loja:s3cr3t', HTTP_IDEMPOTENCY_KEY='abc-1',
+        ).json()
+        self.assertEqual(primeira['rules_triggered'], 1)
+
+        with mock.patch('comunicacao.api.avaliar_regras_para_gatilho') as avaliar:
+            segunda = self.client.post(
+                '/api/v1/events/', corpo, content_type='application/json',
+                HTTP_X_API_KEY='loja:s3cr3t', HTTP_IDEMPOTENCY_KEY='abc-1',
+            ).json()
+        avaliar.assert_not_called()
+        self.assertEqual(
+            (segunda['event_id'], segunda['rules_triggered'], segunda['duplicate']),
+            (primeira['event_id'], 1, True),
+        )
+        self.assertEqual(EventoRecebido.objects.count(), 1)
+
+    def test_falha_no_processamento_permite_reenvio(self):
+        corpo = json.dumps({'type': 'cart.abandoned', 'data': {'phone': '16999990000'}})
+
+        def post():
+            return self.client.post(
+                '/api/v1/events/', corpo, content_type='application/json',
+                HTTP_X_API_KEY='loja:s3cr3t', HTTP_IDEMPOTENCY_KEY='abc-2',
+            )
+
+        with mock.patch('comunicacao.api.avaliar_regras_para_gatilho', side_effect=RuntimeError('falhou')):
+            with self.assertRaises(RuntimeError):
+                post()
+        self.assertFalse(EventoRecebido.objects.exists())
+
+        resposta = post()
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['rules_triggered'], 1)
+        self.assertTrue(EventoRecebido.objects.get(id_externo='abc-2').processado)
+
+    @mock.patch.object(tasks.processar_eventos, 'delay', side_effect=tasks.processar_eventos)
+    def test_idempotencia_no_lote(self, delay):
+        eventos = [
+            {'type': 'cart.abandoned', 'event_id': 'c-1', 'data': {'phone': '16999990000'}},
+            {'type': 'cart.abandoned', 'event_id': 'c-1', 'data': {'phone': '16999990000'}},
+            {'type': 'cart.abandoned', 'event_id': 'c-2', 'data': {'phone': '16988887777'}},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            itens = self._post(json.dumps(eventos)).json()['events']
+        self.assertEqual(itens[1], {'index': 1, 'event_id': itens[0]['event_id'], 'duplicate': True})
+
+        # Reenvio do lote: nada novo gravado nem enfileirado
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            resposta = self._post(json.dumps(eventos)).json()
+        self.assertEqual((resposta['accepted'], resposta['duplicates']), (0, 3))
+        self.assertEqual(callbacks, [])
+        delay.assert_called_once()
+        self.assertEqual(EventoRecebido.objects.count(), 2)
+
+        # O evento único com a mesma chave devolve o resultado do lote
+        resposta = self.client.post(
+            '/api/v1/events/', json.dumps(eventos[2]), content_type='application/json',
+            HTTP_X_API_KEY='loja:s3cr3t',
+        ).json()
+        self.assertEqual((resposta['event_id'], resposta['rules_triggered']), (itens[2]['event_id'], 1))
+
+    def test_autenticacao_e_corpo_invalido(self):
+        response = self.client.post('/api/v1/events/batch/', '[]', content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self._post('{"type": "x"}').status_code, 400)
+        self.assertEqual(self._post('[]').status_code, 400)
+
+
+class CircuitoTests(TestCase):
+    """Testes do circuit breaker dos provedores de envio"""
+
+    def setUp(self):
+        circuito.resetar('meta', '123')
+        self.empresa = Empresa.objects.create(
+            nome='Loja', slug='loja', meta_phone_number_id='123', meta_access_token='token',
+        )
+        self.regra = RegraComunicacao.objects.create(
+            empresa=self.empresa, nome='Carrinho', gatilho='cart_abandoned', template_meta='c',
+            canal='meta', cooldown_horas=0,
+        )
+
+    def tearDown(self):
+        circuito.resetar('meta', '123')
+
+    @mock.patch('bling.meta_whatsapp.MetaWhatsAppClient.enviar_template')
+    def test_abre_apos_falhas_e_reagenda_sem_chamar(self, enviar_template):
+        enviar_template.return_value = {'success': False, 'error': 'Read timed out'}
+        for n in range(4):
+            FilaEnvio.objects.create(
+                empresa=self.empresa, regra=self.regra, telefone=f'551690000004{n}',
+                nome='Ana', agendar_para=timezone.now(),
+            )
+
+        with self.settings(CIRCUITO_FALHAS=2, ENVIO_CONCORRENCIA=1):
+            resultado = sender.processar_fila()
+
+        self.assertEqual(enviar_template.call_count, 2)
+        self.assertEqual((resultado['falhas'], resultado['reagendados']), (2, 2))
+        self.assertEqual(FilaEnvio.objects.filter(status='pendente', erro__startswith='circuito_aberto').count(), 2)
+        self.assertEqual(circuito.situacao('meta', '123')['estado'], 'aberto')
+
+    def test_meio_aberto_libera_uma_sonda_e_fecha(self):
+        with self.settings(CIRCUITO_FALHAS=1, CIRCUITO_ABERTO_SEGUNDOS=1):
+            circuito.registrar('meta', '123', {'success': False, 'status_code': 503})
+            self.assertGreater(circuito.permitir('meta', '123'), 0)
+
+            circuito.resetar('meta', '123')
+            circuito.registrar('meta', '123', {'success': False, 'status_code': 503})
+            circuito._estado().delete(circuito._key('meta', '123', 'aberto'))  # tempo aberto passou
+            self.assertEqual(circuito.permitir('meta', '123'), 0)  # sonda
+            self.assertGreater(circuito.permitir('meta', '123'), 0)  # só uma por vez
+
+            circuito.registrar('meta', '123', {'success': False, 'status_code': 400})
+            self.assertEqual(circuito.situacao('meta', '123')['estado'], 'fechado')
+            self.assertEqual(circuito.permitir('meta', '123'), 0)
+
+
+class TokenBucketTests(TestCase):
+    """Testes do rate limit adaptativo do sender"""
+
+    def test_penalidade_reduz_taxa_e_sucesso_recupera(self):
+        bucket = TokenBucket(taxa=10)
+        self.assertEqual(bucket.tentar(), 0)
+
+        pausa = bucket.penalizar()
+        self.assertEqual(pausa, 2.0)
+        self.assertEqual(bucket.taxa, 5)
+        self.assertGreater(bucket.tentar(), 0)
+        self.assertEqual(bucket.penalizar(), 4.0)
+
+        for _ in range(20):
+            bucket.sucesso()
+        self.assertEqual(bucket.taxa, 10)
+
+    @mock.patch('comunicacao.services.ratelimit.get_redis')
+    def test_buckets_compartilhados_no_redis(self, get_redis):
+        script = get_redis.return_value.register_script.return_value
+        script.return_value = b'0.5'
+        limitador = LimitadorEnvio()
+
+        bucket = limitador._bucket(('empresa', 7))
+
+        self.assertIsInstance(bucket, BucketRedis)
+        self.assertEqual(bucket.tentar(), 0.5)
+        script.assert_called_with(keys=['rl:empresa:7'], args=[10.0, 10.0, TTL_BUCKET])
+
+    @mock.patch('comunicacao.services.ratelimit.get_redis')
+    def test_erro_no_redis_usa_bucket_local(self, get_redis):
+        get_redis.return_value.register_script.return_value.side_effect = ConnectionError('down')
+        limitador = LimitadorEnvio()
+
+        self.assertEqual(limitador._bucket(('empresa', 7)).tentar(), 0)
+        self.assertEqual(limitador.penalizar([('empresa', 7)]), 2.0)
+        self.assertEqual(limitador._local(('empresa', 7)).taxa, 5)
+
+    def test_detecta_limite_de_taxa(self):
+        self.assertTrue(eh_limite_de_taxa({'success': False, 'status_code': 429}))
+        self.assertTrue(eh_limite_de_taxa({'success': False, 'error_code': 130429}))
+        self.assertFalse(eh_limite_de_taxa({'success': False, 'status_code': 400, 'error_code': 132001}))
+
+
+class ContadoresCappingTests(TestCase):
+    """Testes da marca de contadores prontos no Redis"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+
+    @mock.patch('comunicacao.services.contadores._get_redis')
+    def test_marca_expira_com_a_janela(self, get_redis):
+        get_redis.return_value.scan_iter.return_value = iter([])
+
+        self.assertTrue(contadores.reconstruir(self.empresa)['success'])
+
+        pipe = get_redis.return_value.pipeline.return_value
+        pipe.set.assert_called_once_with(
+            f'cap:pronto:{self.empresa.id}', mock.ANY, ex=contadores.JANELA_SEMANA,
+        )
+
+    @mock.patch('comunicacao.services.contadores.reconstruir', return_value={'success': True})
+    @mock.patch('comunicacao.services.contadores._get_redis')
+    def test_renova_so_marcas_ausentes_ou_vencendo(self, get_redis, reconstruir):
+        outra = Empresa.objects.create(nome='Outra', slug='outra')
+        ttls = {
+            f'cap:pronto:{self.empresa.id}': contadores.JANELA_SEMANA,
+            f'cap:pronto:{outra.id}': -2,
+        }
+        get_redis.return_value.ttl.side_effect = ttls.get
+
+        self.assertEqual(tasks.renovar_contadores_capping(), {'empresas': 1})
+        reconstruir.assert_called_once_with(outra)
+
+
+class ContatoEstadoTests(TestCase):
+    """Testes do estado de engajamento por contato"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+        self.telefone = '5516900000009'
+
+    def _mensagem(self, status='enviado'):
+        return MensagemWhatsApp.objects.create(
+            empresa=self.empresa, tipo='cart', canal='meta', status=status,
+            destinatario_nome='Ana', destinatario_telefone=self.telefone,
+        )
+
+    def test_monta_do_historico_e_soma_envios(self):
+        self._mensagem(status='lido')
+        self._mensagem()
+
+        est = estado.carregar(self.empresa.id, [self.telefone])[self.telefone]
+        self.assertEqual(est.total_enviados, 2)
+        self.assertEqual(est.msgs_semana(), 2)
+        self.assertEqual(est.ignorados_consecutivos, 1)
+
+        self._mensagem()
+        estado.registrar_envio(self.empresa.id, self.telefone, canal='meta')
+
+        est = ContatoEstado.objects.get(empresa=self.empresa, telefone=self.telefone)
+        self.assertEqual(est.total_enviados, 3)
+        self.assertEqual(est.msgs_semana(), 3)
+        self.assertEqual(est.ignorados_consecutivos, 2)
+
+    def test_janela_semanal_deslizante_como_no_redis(self):
+        agora = timezone.now()
+        antiga = self._mensagem()
+        MensagemWhatsApp.objects.filter(id=antiga.id).update(
+            created_at=agora - timedelta(days=7, minutes=5),
+        )
+        recente = self._mensagem()
+        MensagemWhatsApp.objects.filter(id=recente.id).update(
+            created_at=agora - timedelta(days=6, hours=23),
+        )
+
+        est = estado.carregar(self.empresa.id, [self.telefone])[self.telefone]
+        self.assertEqual(est.msgs_semana(agora), 1)
+        # Sai da janela 7×24h depois do envio, não na virada do dia
+        self.assertEqual(est.msgs_semana(agora + timedelta(hours=1, minutes=1)), 0)
+
+        est.somar_envio(agora)
+        self.assertEqual(len(est.envios_semana), 2)
+        self.assertEqual(est.msgs_semana(agora), 2)
+
+    def test_leitura_zera_ignorados(self):
+        msg = self._mensagem()
+        estado.carregar(self.empresa.id, [self.telefone])
+
+        msg.status = 'lido'
+        msg.save()
+        estado.recalcular_ignorados(self.empresa.id, self.telefone, lido_em=timezone.now())
+
+        est = ContatoEstado.objects.get(empresa=self.empresa, telefone=self.telefone)
+        self.assertEqual(est.ignorados_consecutivos, 0)
+        self.assertIsNotNone(est.ultima_leitura_em)
+
+    def test_blacklist_espelhada(self):
+        estado.carregar(self.empresa.id, [self.telefone])
+        bloqueio = ContatoBlacklist.objects.create(
+            empresa=self.empresa, telefone=self.telefone, motivo='manual',
+        )
+        self.assertTrue(ContatoEstado.objects.get(telefone=self.telefone).bloqueado)
 
-# Create your tests here.
+        bloqueio.delete()
+        self.assertFalse(ContatoEstado.objects.get(telefone=self.telefone).bloqueado)
@@ -0,0 +1,160 @@
+"""
+Transporte HTTP compartilhado pelos clientes externos
+(Meta Cloud API, W-API, Bling).
+
+- Uma requests.Session por (host, credencial), com pool keep-alive:
+  envios seguidos reutilizam a conexão TLS em vez de abrir uma por mensagem
+- Retry do urllib3 com backoff: erros de conexão (pedido não chegou ao
+  servidor) em qualquer método; erros de leitura e 502/503/504 só em
+  métodos idempotentes (POST de mensagem nunca é repetido após enviado)
+- Histograma de latência por serviço (latencias()), em memória do processo
+
+Settings: HTTP_POOL_TAMANHO, HTTP_RETRIES, HTTP_RETRY_BACKOFF, HTTP_SESSOES_MAX.
+"""
+import bisect
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_PADRAO = 30
+# Chamadas acima disso geram warning no log (segundos)
+LENTA = 5.0
+
+# Limites superiores dos buckets do histograma (segundos)
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+METODOS_IDEMPOTENTES = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+_sessoes = OrderedDict()
+_sessoes_lock = threading.Lock()
+
+
+def _retry():
+    return Retry(
+        total=getattr(settings, 'HTTP_RETRIES', 2),
+        connect=getattr(settings, 'HTTP_RETRIES', 2),
+        read=getattr(settings, 'HTTP_RETRIES', 2),
+        status=getattr(settings, 'HTTP_RETRIES', 2),
+        backoff_factor=getattr(settings, 'HTTP_RETRY_BACKOFF', 0.3),
+        status_forcelist=(502, 503, 504),
+        allowed_methods=METODOS_IDEMPOTENTES,
+        # Devolve a última resposta (status) em vez de levantar MaxRetryError
+        raise_on_status=False,
+    )
+
+
+def _nova_sessao():
+    tamanho = getattr(settings, 'HTTP_POOL_TAMANHO', 10)
+    sessao = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho, max_retries=_retry())
+    sessao.mount('https://', adapter)
+    sessao.mount('http://', adapter)
+    return sessao
+
+
+def get_sessao(url, credencial=''):
+    """
+    Session compartilhada para o host da URL e a credencial
+    (token/instância). As mais antigas são fechadas acima de HTTP_SESSOES_MAX.
+    """
+    host = urlsplit(url).netloc
+    chave = (host, hashlib.sha1(str(credencial).encode()).hexdigest()[:16] if credencial else '')
+    with _sessoes_lock:
+        sessao = _sessoes.get(chave)
+        if sessao is not None:
+            _sessoes.move_to_end(chave)
+            return sessao
+        sessao = _sessoes[chave] = _nova_sessao()
+        limite = getattr(settings, 'HTTP_SESSOES_MAX', 256)
+        while len(_sessoes) > limite:
+            _, antiga = _sessoes.popitem(last=False)
+            antiga.close()
+        return sessao
+
+
+def fechar_sessoes():
+    with _sessoes_lock:
+        for sessao in _sessoes.values():
+            sessao.close()
+        _sessoes.clear()
+
+
+class Histograma:
+    """Contagem de latências por bucket (thread-safe)."""
+
+    def __init__(self):
+        self.contagens = [0] * len(BUCKETS)
+        self.total = 0
+        self.soma = 0.0
+        self.erros = 0
+        self._lock = threading.Lock()
+
+    def observar(self, segundos, erro=False):
+        with self._lock:
+            self.contagens[bisect.bisect_left(BUCKETS, segundos)] += 1
+            self.total += 1
+            self.soma += segundos
+            if erro:
+                self.erros += 1
+
+    def resumo(self):
+        with self._lock:
+            return {
+                'total': self.total,
+                'erros': self.erros,
+                'media': round(self.soma / self.total, 4) if self.total else 0.0,
+                'buckets': {
+                    ('+Inf' if limite == float('inf') else str(limite)): n
+                    for limite, n in zip(BUCKETS, self.contagens)
+                },
+            }
+
+
+_histogramas = {}
+_histogramas_lock = threading.Lock()
+
+
+def _histograma(servico):
+    with _histogramas_lock:
+        hist = _histogramas.get(servico)
+        if hist is None:
+            hist = _histogramas[servico] = Histograma()
+        return hist
+
+
+def latencias():
+    """{servico: resumo do histograma} deste processo."""
+    with _histogramas_lock:
+        servicos = list(_histogramas.items())
+    return {servico: hist.resumo() for servico, hist in servicos}
+
+
+def request(servico, method, url, credencial='', **kwargs):
+    """
+    requests.request pela Session compartilhada, medindo a latência.
+    servico: rótulo do histograma ('meta', 'wapi', 'bling').
+    Exceções de requests são propagadas como antes.
+    """
+    kwargs.setdefault('timeout', TIMEOUT_PADRAO)
+    sessao = get_sessao(url, credencial)
+    inicio = time.monotonic()
+    erro = True
+    try:
+        response = sessao.request(method, url, **kwargs)
+        erro = response.status_code >= 500
+        return response
+    finally:
+        duracao = time.monotonic() - inicio
+        _histograma(servico).observar(duracao, erro=erro)
+        if duracao > LENTA:
+            logger.warning(f'HTTP {servico} {method} {urlsplit(url).path} lento: {duracao:.1f}s')
@@ -153,14 +153,31 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'bling.refresh_tokens',
         'schedule': 30 * 60,  # a cada 30 minutos
     },
+    'gerar-snapshots-diarios': {
+        'task': 'customers.gerar_snapshots_diarios',
+        'schedule': crontab(hour=0, minute=30),  # todo dia as 00h30 (dia anterior)
+    },
     'enviar-promocoes-diarias': {
         'task': 'customers.enviar_promocoes_diarias',
         'schedule': crontab(hour=10, minute=0),  # todo dia as 10h
     },
     # Motor de Réguas
     'processar-fila-envio': {
+        # Varredura de segurança; o despacho por vencimento cobre o caso normal
         'task': 'comunicacao.processar_fila_envio',
-        'schedule': 2 * 60,  # a cada 2 minutos
+        'schedule': config(
+            'FILA_VARREDURA_SEGUNDOS',
+            default=10 * 60 if config('REDIS_URL', default=None) else 2 * 60,
+            cast=int,
+        ),
+    },
+    'despachar-fila-vencida': {
+        'task': 'comunicacao.despachar_fila_vencida',
+        'schedule': 5,  # a cada 5 segundos (só Redis)
+    },
+    'liberar-leases-fila-envio': {
+        'task': 'comunicacao.liberar_leases_expirados',
+        'schedule': 60,  # a cada minuto
     },
     'avaliar-regras-periodicas': {
         'task': 'comunicacao.avaliar_regras_periodicas',
@@ -170,6 +187,14 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'comunicacao.atualizar_stats_regras',
         'schedule': crontab(hour=23, minute=0),  # todo dia as 23h
     },
+    'atribuir-conversoes': {
+        'task': 'comunicacao.atribuir_conversoes',
+        'schedule': crontab(minute=30),  # a cada hora (meia hora)
+    },
+    'renovar-contadores-capping': {
+        'task': 'comunicacao.renovar_contadores_capping',
+        'schedule': crontab(hour=4, minute=0),  # todo dia as 4h
+    },
 }
 
 # Cache - Usar Redis se REDIS_URL estiver disponível
@@ -189,6 +214,59 @@ else:
         }
     }
 
+# Encaminhamento de respostas para atendente humano (customers.services.encaminhamento)
+# 0 = uma mensagem por resposta; > 0 = digest com as respostas da janela (segundos)
+HANDOFF_DIGEST_SEGUNDOS = config('HANDOFF_DIGEST_SEGUNDOS', default=0, cast=int)
+
+# Registro de tenants em cache (tenants.cache)
+TENANT_CACHE_TTL = config('TENANT_CACHE_TTL', default=3600, cast=int)  # camada Redis
+TENANT_CACHE_LOCAL_TTL = config('TENANT_CACHE_LOCAL_TTL', default=30, cast=int)  # LRU em memoria
+TENANT_CACHE_LOCAL_SIZE = config('TENANT_CACHE_LOCAL_SIZE', default=256, cast=int)
+TENANT_CACHE_VERSION_CHECK = 2  # segundos entre checagens de versao no Redis
+
+# Estatisticas dos dashboards em cache por empresa (customers.services.estatisticas)
+DASHBOARD_CACHE_SEGUNDOS = config('DASHBOARD_CACHE_SEGUNDOS', default=60, cast=int)
+
+# Exportacoes em streaming (customers.services.exportacao): linhas por leitura do banco
+EXPORTACAO_CHUNK = config('EXPORTACAO_CHUNK', default=2000, cast=int)
+
+# Contadores de capping no Redis (comunicacao.services.contadores).
+# Popular com: python manage.py reconstruir_contadores (depois, a task
+# diaria renovar_contadores_capping reconstroi antes da marca expirar)
+CAPPING_CONTADORES_REDIS = config('CAPPING_CONTADORES_REDIS', default=True, cast=bool)
+
+# Sender da fila de envio (comunicacao.services.sender / ratelimit)
+ENVIO_LOTE = config('ENVIO_LOTE', default=500, cast=int)  # itens por execução
+ENVIO_LEASE_SEGUNDOS = config('ENVIO_LEASE_SEGUNDOS', default=600, cast=int)  # reserva por worker
+ENVIO_CONCORRENCIA = config('ENVIO_CONCORRENCIA', default=8, cast=int)  # threads HTTP
+ENVIO_TAXA_EMPRESA = config('ENVIO_TAXA_EMPRESA', default=10, cast=float)  # msgs/s por empresa
+ENVIO_TAXA_NUMERO = config('ENVIO_TAXA_NUMERO', default=20, cast=float)  # msgs/s por número Meta
+
+# Circuit breaker por provedor/instância (comunicacao.services.circuito)
+CIRCUITO_FALHAS = config('CIRCUITO_FALHAS', default=5, cast=int)  # falhas seguidas para abrir
+CIRCUITO_ABERTO_SEGUNDOS = config('CIRCUITO_ABERTO_SEGUNDOS', default=60, cast=int)  # até a sonda
+
+# Transporte HTTP dos clientes Meta / W-API / Bling (customer_intelligence.http)
+HTTP_POOL_TAMANHO = config('HTTP_POOL_TAMANHO', default=ENVIO_CONCORRENCIA, cast=int)  # conexões por host/credencial
+HTTP_RETRIES = config('HTTP_RETRIES', default=2, cast=int)
+HTTP_RETRY_BACKOFF = config('HTTP_RETRY_BACKOFF', default=0.3, cast=float)
+HTTP_SESSOES_MAX = config('HTTP_SESSOES_MAX', default=256, cast=int)
+
+# Atribuição de conversões (comunicacao.services.atribuicao)
+ATRIBUICAO_JANELA_HORAS = config('ATRIBUICAO_JANELA_HORAS', default=7 * 24, cast=int)
+ATRIBUICAO_MODELO = config('ATRIBUICAO_MODELO', default='ultimo_toque')  # ou 'primeiro_toque'
+
+# API de eventos em lote (comunicacao.api.receber_eventos_lote)
+EVENTOS_LOTE_MAX = config('EVENTOS_LOTE_MAX', default=1000, cast=int)
+
+# Bling → WhatsApp (bling.tasks): intervalo aleatório entre envios por empresa (segundos)
+BLING_ENVIO_INTERVALO_MIN = config('BLING_ENVIO_INTERVALO_MIN', default=45, cast=int)
+BLING_ENVIO_INTERVALO_MAX = config('BLING_ENVIO_INTERVALO_MAX', default=120, cast=int)
+BLING_TAXA_REQUISICOES = config('BLING_TAXA_REQUISICOES', default=3, cast=float)  # req/s por client_id (limite da API)
+BLING_SYNC_CONCORRENCIA = config('BLING_SYNC_CONCORRENCIA', default=4, cast=int)  # threads de busca de páginas
+BLING_RECONCILIACAO_HORAS = config('BLING_RECONCILIACAO_HORAS', default=24, cast=int)  # sync completo (sem marca d'água)
+BLING_TOKEN_CACHE_SEGUNDOS = config('BLING_TOKEN_CACHE_SEGUNDOS', default=300, cast=int)  # access token em memória
+
 
 # REST Framework
 REST_FRAMEWORK = {
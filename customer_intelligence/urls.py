@@ -12,7 +12,7 @@ from customers.views import CustomerViewSet
 from customers.webhooks import woo_order_created, woo_order_updated
 from customers.webhooks_meta import meta_webhook
 from customers.api_chrome_extension import chrome_extension_lead, chrome_extension_check
-from comunicacao.api import receber_evento
+from comunicacao.api import receber_evento, receber_eventos_lote
 
 # Configurar nome do Admin
 admin.site.site_header = 'Carrinho e Leads'
@@ -49,6 +49,7 @@ urlpatterns = [
     path('api/v1/leads/chrome-extension/<slug:empresa_slug>/check/', chrome_extension_check, name='chrome_ext_check'),
     # API genérica de eventos (multi-plataforma)
     path('api/v1/events/', receber_evento, name='api_events'),
+    path('api/v1/events/batch/', receber_eventos_lote, name='api_events_batch'),
 ]
 
 # Servir arquivos de media em desenvolvimento
@@ -12,7 +12,6 @@ from .models import Customer, Cart, Order, CustomerAnalysis, Lead, MensagemWhats
 from tenants.admin import TenantAdminMixin
 import json
 from datetime import datetime
-import csv
 
 
 class CustomerResource(resources.ModelResource):
@@ -102,38 +101,25 @@ class CustomerAdmin(TenantAdminMixin, ExportMixin, admin.ModelAdmin):
     
     def export_whatsapp_list(self, request, queryset):
         """Exporta lista para WhatsApp"""
+        from customers.services.exportacao import csv_streaming, linhas_whatsapp
+
         customers = queryset.filter(phone__isnull=False).exclude(phone='')
-        
-        import csv
-        from django.http import HttpResponse
-        
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="whatsapp_list.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Nome', 'WhatsApp', 'Email', 'Status', 'Score'])
-        
-        for customer in customers:
-            if customer.whatsapp_number:
-                writer.writerow([
-                    customer.full_name,
-                    customer.whatsapp_number,
-                    customer.email,
-                    customer.get_status_display(),
-                    customer.score
-                ])
-        
-        return response
+        return csv_streaming(
+            ['Nome', 'WhatsApp', 'Email', 'Status', 'Score'],
+            linhas_whatsapp(customers, ultima_compra=False),
+            'whatsapp_list.csv',
+        )
     
     export_whatsapp_list.short_description = "Exportar lista WhatsApp"
 
 
 @admin.register(CustomerAnalysis)
-class CustomerAnalysisAdmin(admin.ModelAdmin):
-    list_display = ['date', 'total_customers', 'new_customers', 
-                   'abandoned_carts', 'total_revenue_display']
-    
-    list_filter = ['date']
+class CustomerAnalysisAdmin(TenantAdminMixin, admin.ModelAdmin):
+    list_display = ['date', 'empresa', 'total_customers', 'new_customers',
+                   'new_orders', 'abandoned_carts', 'total_revenue_display',
+                   'conversion_rate']
+
+    list_filter = ['empresa', 'date']
     
     def total_revenue_display(self, obj):
         return f'R$ {obj.total_revenue:,.2f}'
@@ -784,115 +770,34 @@ class LeadAdmin(TenantAdminMixin, admin.ModelAdmin):
 
         return HttpResponse('Formato inválido', status=400)
 
-    def _export_csv(self, queryset):
-        """Exportar para CSV"""
-        from django.http import HttpResponse
-
-        response = HttpResponse(content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = f'attachment; filename="leads_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-
-        # Adicionar BOM para Excel reconhecer UTF-8
-        response.write('\ufeff')
-
-        writer = csv.writer(response)
-        writer.writerow(['Nome', 'WhatsApp', 'Número Sapato', 'Status', 'É Cliente', 'WhatsApp Enviado', 'Data Criação'])
+    def _nome_exportacao(self, extensao):
+        return f'leads_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extensao}'
 
-        for lead in queryset:
-            writer.writerow([
-                lead.nome,
-                lead.whatsapp,
-                lead.numero_sapato,
-                lead.get_status_display(),
-                'Sim' if lead.is_customer else 'Não',
-                'Sim' if lead.whatsapp_sent else 'Não',
-                lead.created_at.strftime('%d/%m/%Y %H:%M') if lead.created_at else ''
-            ])
+    def _export_csv(self, queryset):
+        """Exportar para CSV (streaming)"""
+        from customers.services.exportacao import CABECALHO_LEAD, csv_streaming, linhas_leads
 
-        return response
+        return csv_streaming(
+            CABECALHO_LEAD, linhas_leads(queryset), self._nome_exportacao('csv'),
+            bom=True, content_type='text/csv; charset=utf-8',
+        )
 
     def _export_txt(self, queryset):
-        """Exportar para TXT"""
-        from django.http import HttpResponse
+        """Exportar para TXT (streaming)"""
+        from customers.services.exportacao import txt_leads
 
-        response = HttpResponse(content_type='text/plain; charset=utf-8')
-        response['Content-Disposition'] = f'attachment; filename="leads_{datetime.now().strftime("%Y%m%d_%H%M%S")}.txt"'
-
-        # Adicionar BOM para reconhecer UTF-8
-        response.write('\ufeff')
-
-        lines = []
-        lines.append('=' * 80)
-        lines.append(f'EXPORTAÇÃO DE LEADS - {datetime.now().strftime("%d/%m/%Y %H:%M")}')
-        lines.append('=' * 80)
-        lines.append('')
-
-        for lead in queryset:
-            lines.append(f'Nome: {lead.nome}')
-            lines.append(f'WhatsApp: {lead.whatsapp}')
-            lines.append(f'Número do Sapato: {lead.numero_sapato}')
-            lines.append(f'Status: {lead.get_status_display()}')
-            lines.append(f'É Cliente: {"Sim" if lead.is_customer else "Não"}')
-            lines.append(f'WhatsApp Enviado: {"Sim" if lead.whatsapp_sent else "Não"}')
-            lines.append(f'Data de Criação: {lead.created_at.strftime("%d/%m/%Y %H:%M") if lead.created_at else ""}')
-            lines.append('-' * 80)
-            lines.append('')
-
-        response.write('\n'.join(lines))
-        return response
+        return txt_leads(queryset, self._nome_exportacao('txt'))
 
     def _export_xlsx(self, queryset):
-        """Exportar para XLSX"""
+        """Exportar para XLSX (openpyxl write-only)"""
         from django.http import HttpResponse
         try:
-            import openpyxl
-            from openpyxl.styles import Font, PatternFill, Alignment
+            import openpyxl  # noqa: F401
         except ImportError:
             return HttpResponse('Biblioteca openpyxl não instalada. Execute: pip install openpyxl', status=500)
+        from customers.services.exportacao import xlsx_leads
 
-        # Criar workbook
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = 'Leads'
-
-        # Estilo do cabeçalho
-        header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
-        header_font = Font(bold=True, color='FFFFFF')
-
-        # Cabeçalhos
-        headers = ['Nome', 'WhatsApp', 'Número Sapato', 'Status', 'É Cliente', 'WhatsApp Enviado', 'Data Criação']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal='center')
-
-        # Dados
-        for row_idx, lead in enumerate(queryset, 2):
-            ws.cell(row=row_idx, column=1, value=lead.nome)
-            ws.cell(row=row_idx, column=2, value=lead.whatsapp)
-            ws.cell(row=row_idx, column=3, value=lead.numero_sapato)
-            ws.cell(row=row_idx, column=4, value=lead.get_status_display())
-            ws.cell(row=row_idx, column=5, value='Sim' if lead.is_customer else 'Não')
-            ws.cell(row=row_idx, column=6, value='Sim' if lead.whatsapp_sent else 'Não')
-            ws.cell(row=row_idx, column=7, value=lead.created_at.strftime('%d/%m/%Y %H:%M') if lead.created_at else '')
-
-        # Ajustar largura das colunas
-        ws.column_dimensions['A'].width = 30
-        ws.column_dimensions['B'].width = 20
-        ws.column_dimensions['C'].width = 15
-        ws.column_dimensions['D'].width = 15
-        ws.column_dimensions['E'].width = 12
-        ws.column_dimensions['F'].width = 18
-        ws.column_dimensions['G'].width = 20
-
-        # Salvar
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename="leads_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx"'
-        wb.save(response)
-
-        return response
+        return xlsx_leads(queryset, self._nome_exportacao('xlsx'))
 
     def _export_google_sheets(self, queryset):
         """Exportar para Google Sheets - retorna CSV para importar"""
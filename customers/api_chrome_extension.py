@@ -9,7 +9,7 @@ from django.http import JsonResponse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from tenants.models import Empresa
+from tenants.cache import get_empresa_por_slug
 from customers.models import Lead, Customer
 
 logger = logging.getLogger(__name__)
@@ -56,9 +56,8 @@ def chrome_extension_lead(request, empresa_slug):
     import json
 
     # Buscar empresa
-    try:
-        empresa = Empresa.objects.get(slug=empresa_slug, ativo=True)
-    except Empresa.DoesNotExist:
+    empresa = get_empresa_por_slug(empresa_slug)
+    if not empresa:
         return JsonResponse({'error': 'Empresa não encontrada'}, status=404)
 
     # Validar API key
@@ -144,9 +143,8 @@ def chrome_extension_check(request, empresa_slug):
     GET /api/v1/leads/chrome-extension/<slug>/check/?telefone=11999999999
     Verifica se telefone já existe na base.
     """
-    try:
-        empresa = Empresa.objects.get(slug=empresa_slug, ativo=True)
-    except Empresa.DoesNotExist:
+    empresa = get_empresa_por_slug(empresa_slug)
+    if not empresa:
         return JsonResponse({'error': 'Empresa não encontrada'}, status=404)
 
     if not _validar_api_key(request, empresa):
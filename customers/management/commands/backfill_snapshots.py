@@ -0,0 +1,57 @@
+"""
+Management command para gerar snapshots diários (CustomerAnalysis) de
+dias passados.
+
+Uso:
+    python manage.py backfill_snapshots --dias=90
+    python manage.py backfill_snapshots --inicio=2026-01-01 --fim=2026-03-31
+    python manage.py backfill_snapshots --dias=30 --empresa=tarragona
+"""
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from customers.services.snapshots import gerar_periodo
+from tenants.models import Empresa
+
+
+class Command(BaseCommand):
+    help = 'Gera snapshots diários por empresa para um período passado'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias', type=int, default=30,
+            help='Quantidade de dias até ontem (padrão: 30; ignorado com --inicio)'
+        )
+        parser.add_argument(
+            '--inicio', type=date.fromisoformat,
+            help='Primeiro dia (AAAA-MM-DD)'
+        )
+        parser.add_argument(
+            '--fim', type=date.fromisoformat,
+            help='Último dia (AAAA-MM-DD, padrão: ontem)'
+        )
+        parser.add_argument(
+            '--empresa', type=str,
+            help='Slug da empresa (se omitido, processa todas ativas)'
+        )
+
+    def handle(self, *args, **options):
+        fim = options['fim'] or timezone.localdate() - timedelta(days=1)
+        inicio = options['inicio'] or fim - timedelta(days=options['dias'] - 1)
+        if inicio > fim:
+            self.stderr.write(f'Período inválido: {inicio} > {fim}')
+            return
+
+        empresas = Empresa.objects.filter(ativo=True)
+        if options['empresa']:
+            empresas = Empresa.objects.filter(slug=options['empresa'])
+            if not empresas.exists():
+                self.stderr.write(f"Empresa '{options['empresa']}' não encontrada")
+                return
+
+        gravados = gerar_periodo(inicio, fim, empresas)
+        self.stdout.write(self.style.SUCCESS(
+            f'{gravados} snapshots gravados de {inicio} a {fim}'
+        ))
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.16 on 2026-10-19 06:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0012_alter_mensagemwhatsapp_tipo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensagemwhatsapp',
+            name='resposta_a',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='respostas', to='customers.mensagemwhatsapp'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.16 on 2026-10-19 06:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenants', '0013_empresa_meta_template_lead_nao_cliente_cupom'),
+        ('customers', '0013_mensagemwhatsapp_resposta_a'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='customers_with_phone',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='empresa',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='analises', to='tenants.empresa'),
+        ),
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='max_cart_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='max_customer_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='max_lead_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='max_order_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='new_carts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='new_leads',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='new_orders',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='total_leads',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='customeranalysis',
+            name='total_orders',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='customeranalysis',
+            name='date',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AddConstraint(
+            model_name='customeranalysis',
+            constraint=models.UniqueConstraint(fields=('empresa', 'date'), name='unique_analysis_date_per_empresa'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:00
+
+from django.db import migrations
+
+
+def marcar_respostas_antigas(apps, schema_editor):
+    """
+    Respostas recebidas antes do encaminhamento em task eram encaminhadas
+    pelo próprio webhook sem marcar encaminhado_humano; marcá-las para que
+    o digest não as reenvie ao atendente
+    """
+    MensagemWhatsApp = apps.get_model('customers', 'MensagemWhatsApp')
+    MensagemWhatsApp.objects.filter(
+        tipo='resposta_cliente', encaminhado_humano=False,
+    ).update(encaminhado_humano=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customers', '0014_customeranalysis_por_empresa'),
+    ]
+
+    operations = [
+        migrations.RunPython(marcar_respostas_antigas, migrations.RunPython.noop),
+    ]
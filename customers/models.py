@@ -3,6 +3,21 @@ from django.utils import timezone
 from django.db.models import JSONField
 import re
 
+_NAO_DIGITO = re.compile(r'\D')
+
+
+def numero_whatsapp(phone):
+    """Número formatado para WhatsApp (só dígitos, com 55), ou None se inválido"""
+    if not phone:
+        return None
+
+    phone = _NAO_DIGITO.sub('', phone)
+    if len(phone) < 10:
+        return None
+    if not phone.startswith('55'):
+        phone = f'55{phone}'
+    return phone
+
 
 class Customer(models.Model):
     """Cliente único com análise inteligente - MULTI-TENANT"""
@@ -105,21 +120,7 @@ class Customer(models.Model):
     @property
     def whatsapp_number(self):
         """Número formatado para WhatsApp"""
-        if not self.phone:
-            return None
-        
-        # Limpar número
-        phone = re.sub(r'\D', '', self.phone)
-        
-        # Validar tamanho
-        if len(phone) < 10:
-            return None
-        
-        # Adicionar código do país se necessário
-        if not phone.startswith('55'):
-            phone = f'55{phone}'
-        
-        return phone
+        return numero_whatsapp(self.phone)
     
     def calculate_status(self):
         """Calcula o status do cliente baseado no comportamento"""
@@ -286,13 +287,25 @@ class Order(models.Model):
 
 
 class CustomerAnalysis(models.Model):
-    """Análise diária dos clientes"""
-    
-    date = models.DateField(unique=True)
+    """
+    Snapshot diário por empresa (customers/services/snapshots.py).
+    Totais e status são acumulados até o fim do dia; new_*, receita,
+    ticket médio e conversão são do próprio dia.
+    """
+
+    empresa = models.ForeignKey(
+        'tenants.Empresa',
+        on_delete=models.CASCADE,
+        related_name='analises',
+        null=True,
+        blank=True
+    )
+    date = models.DateField(db_index=True)
     
     # Totais
     total_customers = models.IntegerField(default=0)
     new_customers = models.IntegerField(default=0)
+    customers_with_phone = models.IntegerField(default=0)
     
     # Por status
     never_bought = models.IntegerField(default=0)
@@ -304,8 +317,15 @@ class CustomerAnalysis(models.Model):
     
     # Carrinhos
     total_carts = models.IntegerField(default=0)
+    new_carts = models.IntegerField(default=0)
     abandoned_carts = models.IntegerField(default=0)
     recovered_carts = models.IntegerField(default=0)
+
+    # Pedidos e leads
+    total_orders = models.IntegerField(default=0)
+    new_orders = models.IntegerField(default=0)
+    total_leads = models.IntegerField(default=0)
+    new_leads = models.IntegerField(default=0)
     
     # Valores
     total_revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
@@ -314,12 +334,24 @@ class CustomerAnalysis(models.Model):
     # Médias
     avg_order_value = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     conversion_rate = models.FloatField(default=0)
+
+    # Maior pk incluído no snapshot (delta ao vivo = linhas depois dele)
+    max_customer_id = models.BigIntegerField(default=0)
+    max_cart_id = models.BigIntegerField(default=0)
+    max_order_id = models.BigIntegerField(default=0)
+    max_lead_id = models.BigIntegerField(default=0)
     
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         db_table = 'customer_analysis'
         ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['empresa', 'date'],
+                name='unique_analysis_date_per_empresa'
+            )
+        ]
 
 
 # Adicionar após a classe CustomerAnalysis
@@ -522,6 +554,12 @@ class MensagemWhatsApp(models.Model):
     encaminhado_humano = models.BooleanField(default=False)
     encaminhado_humano_em = models.DateTimeField(null=True, blank=True)
 
+    # Para tipo=resposta_cliente: mensagem original que o cliente respondeu
+    resposta_a = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.SET_NULL,
+        related_name='respostas',
+    )
+
     # Relacionamentos opcionais
     lead = models.ForeignKey(
         Lead, null=True, blank=True, on_delete=models.SET_NULL,
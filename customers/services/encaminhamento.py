@@ -0,0 +1,200 @@
+"""
+Encaminhamento de respostas de clientes para o atendente humano (W-API).
+
+O webhook Meta só registra a resposta e agenda o encaminhamento;
+o envio acontece em task Celery, fora do request.
+
+Modo digest (HANDOFF_DIGEST_SEGUNDOS > 0): respostas que chegam dentro
+da janela para o mesmo número de atendente viram UMA mensagem só.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from customers.models import MensagemWhatsApp
+
+logger = logging.getLogger(__name__)
+
+# Respostas mais antigas que isso não são mais encaminhadas (evita digest gigante
+# depois de uma queda longa do W-API)
+MAX_IDADE_PENDENTE = timedelta(hours=24)
+
+# Máximo de respostas por mensagem digest
+MAX_RESPOSTAS_DIGEST = 20
+
+
+def _janela_digest():
+    return getattr(settings, 'HANDOFF_DIGEST_SEGUNDOS', 0)
+
+
+def _key_agendado(empresa_id, whatsapp_humano):
+    return f'handoff:agendado:{empresa_id}:{whatsapp_humano}'
+
+
+def agendar_encaminhamento(empresa, resposta):
+    """
+    Agenda o encaminhamento de uma resposta (MensagemWhatsApp tipo=resposta_cliente).
+    Chamado pelo webhook Meta; não faz chamadas HTTP.
+    """
+    from customers.tasks import encaminhar_resposta_humano, enviar_digest_humano
+
+    whatsapp_humano = getattr(empresa, 'meta_whatsapp_humano', '')
+    if not whatsapp_humano:
+        logger.info(f'[{empresa.slug}] Sem WhatsApp humano configurado, resposta nao encaminhada')
+        return
+
+    janela = _janela_digest()
+    if janela <= 0:
+        transaction.on_commit(lambda: encaminhar_resposta_humano.delay(resposta.id))
+        return
+
+    # Primeira resposta da janela agenda o digest; as demais só entram na fila (banco)
+    if cache.add(_key_agendado(empresa.id, whatsapp_humano), 1, timeout=janela * 2):
+        transaction.on_commit(lambda: enviar_digest_humano.apply_async(
+            args=[empresa.id], countdown=janela,
+        ))
+
+
+def _pendentes(empresa, limite=MAX_RESPOSTAS_DIGEST):
+    return list(
+        MensagemWhatsApp.objects.filter(
+            empresa=empresa,
+            tipo='resposta_cliente',
+            encaminhado_humano=False,
+            created_at__gte=timezone.now() - MAX_IDADE_PENDENTE,
+        ).select_related('resposta_a').order_by('created_at')[:limite]
+    )
+
+
+def _descricao_original(resposta):
+    original = resposta.resposta_a
+    if not original:
+        return ''
+    descricao = original.get_tipo_display()
+    if original.template_name:
+        descricao += f" ({original.template_name})"
+    return descricao
+
+
+def montar_mensagem(respostas):
+    """Monta o texto para o atendente (uma resposta ou digest)."""
+    if len(respostas) == 1:
+        r = respostas[0]
+        mensagem = (
+            f"*Nova resposta de cliente!*\n\n"
+            f"*Cliente:* {r.destinatario_nome}\n"
+            f"*Telefone:* {r.destinatario_telefone}\n"
+            f"*Respondeu a:* {_descricao_original(r)}"
+        )
+        mensagem += f"\n\n*Mensagem:*\n{r.mensagem_texto}\n\n"
+        mensagem += f"Responda diretamente: https://wa.me/{r.destinatario_telefone}"
+        return mensagem
+
+    partes = [f"*{len(respostas)} novas respostas de clientes!*"]
+    for r in respostas:
+        bloco = (
+            f"*Cliente:* {r.destinatario_nome} ({r.destinatario_telefone})\n"
+            f"*Respondeu a:* {_descricao_original(r)}\n"
+            f"*Mensagem:* {r.mensagem_texto}\n"
+            f"https://wa.me/{r.destinatario_telefone}"
+        )
+        partes.append(bloco)
+    return '\n\n'.join(partes)
+
+
+def encaminhar(empresa, respostas):
+    """
+    Envia as respostas ao atendente e marca resposta + mensagem original
+    como encaminhadas. Retorna dict no padrão {'success': ..., 'error': ...};
+    em falha, 'retry' diz se vale tentar de novo (False para configuração
+    ausente).
+
+    As respostas são "reservadas" (encaminhado_humano=True) antes do envio,
+    travadas com SELECT FOR UPDATE SKIP LOCKED, para que duas tasks
+    concorrentes não mandem a mesma resposta. Em caso de falha a reserva
+    é desfeita.
+    """
+    from customers.services.wapi import _get_wapi_client
+
+    whatsapp_humano = getattr(empresa, 'meta_whatsapp_humano', '')
+    if not whatsapp_humano:
+        return {'success': False, 'retry': False, 'error': 'WhatsApp humano não configurado'}
+
+    client = _get_wapi_client(empresa, 'lead')
+    if not client.esta_configurado():
+        logger.warning(f'[{empresa.slug}] W-API nao configurado para encaminhar resposta')
+        return {'success': False, 'retry': False, 'error': 'W-API não configurado'}
+
+    agora = timezone.now()
+    ids = [r.id for r in respostas]
+    with transaction.atomic():
+        nossas = set(
+            MensagemWhatsApp.objects.select_for_update(skip_locked=True).filter(
+                id__in=ids, encaminhado_humano=False,
+            ).values_list('id', flat=True)
+        )
+        if nossas:
+            MensagemWhatsApp.objects.filter(id__in=nossas).update(
+                encaminhado_humano=True, encaminhado_humano_em=agora,
+            )
+    if not nossas:
+        return {'success': True, 'response': {}, 'ignorados': len(ids)}
+    # Outra task pode ter pegado parte delas: ficar só com as nossas
+    respostas = [r for r in respostas if r.id in nossas]
+
+    resultado = client.enviar_mensagem(whatsapp_humano, montar_mensagem(respostas))
+
+    if not resultado.get('success'):
+        MensagemWhatsApp.objects.filter(id__in=nossas).update(
+            encaminhado_humano=False, encaminhado_humano_em=None,
+        )
+        resultado['retry'] = True
+        logger.error(
+            f'[{empresa.slug}] Erro ao encaminhar para humano: '
+            f'{resultado.get("error")}'
+        )
+        return resultado
+
+    originais = [r.resposta_a_id for r in respostas if r.resposta_a_id]
+    if originais:
+        MensagemWhatsApp.objects.filter(id__in=originais).update(
+            encaminhado_humano=True, encaminhado_humano_em=agora,
+        )
+
+    logger.info(
+        f'[{empresa.slug}] {len(respostas)} resposta(s) '
+        f'encaminhada(s) para humano {whatsapp_humano}'
+    )
+    return resultado
+
+
+def encaminhar_pendentes(empresa):
+    """
+    Envia as respostas pendentes da empresa em digests de até
+    MAX_RESPOSTAS_DIGEST, até esvaziar a fila ou um envio falhar.
+    """
+    whatsapp_humano = getattr(empresa, 'meta_whatsapp_humano', '')
+    # Liberar o agendamento antes de ler: respostas que chegarem agora
+    # agendam um novo digest em vez de se perderem
+    cache.delete(_key_agendado(empresa.id, whatsapp_humano))
+
+    resultado = {'success': True, 'response': {}}
+    encaminhadas = 0
+    while True:
+        respostas = _pendentes(empresa)
+        if not respostas:
+            break
+        resultado = encaminhar(empresa, respostas)
+        if not resultado.get('success'):
+            # As já enviadas ficam marcadas; o retry da task manda o resto
+            break
+        encaminhadas += len(respostas)
+        if len(respostas) < MAX_RESPOSTAS_DIGEST:
+            break
+
+    resultado['encaminhadas'] = encaminhadas
+    return resultado
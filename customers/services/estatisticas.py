@@ -0,0 +1,127 @@
+"""
+Estatísticas dos dashboards (importer, leads, API de clientes,
+configurações da empresa).
+
+- Uma consulta por tabela, com agregação condicional (Count/Sum com
+  filter) em vez de um count() por número exibido
+- em_cache(): resultado por empresa no cache Django, por
+  DASHBOARD_CACHE_SEGUNDOS (os dashboards fazem polling)
+- invalidar(): chamada ao fim das importações e nos webhooks WooCommerce;
+  derruba as entradas da empresa e as da visão global (superuser)
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'dashboard:stats'
+
+# Entradas em cache por empresa (nomes usados pelas views)
+PAINEIS = ('importacao', 'leads', 'clientes', 'configuracoes')
+
+COM_TELEFONE = ~Q(phone='') & Q(phone__isnull=False)
+
+
+def _ttl():
+    return getattr(settings, 'DASHBOARD_CACHE_SEGUNDOS', 60)
+
+
+def _chave(escopo, painel):
+    return f'{CACHE_PREFIX}:{escopo}:{painel}'
+
+
+def _escopo(empresa):
+    return empresa.id if empresa else 'todas'
+
+
+def em_cache(empresa, painel, calcular):
+    """
+    Estatísticas do painel para a empresa (None = visão global), do cache
+    ou de calcular() (gravadas por DASHBOARD_CACHE_SEGUNDOS).
+    """
+    chave = _chave(_escopo(empresa), painel)
+    stats = cache.get(chave)
+    if stats is None:
+        stats = calcular()
+        cache.set(chave, stats, _ttl())
+    return stats
+
+
+def invalidar(empresa_id):
+    """Descarta as estatísticas em cache da empresa e da visão global."""
+    try:
+        cache.delete_many([
+            _chave(escopo, painel)
+            for escopo in (empresa_id, 'todas') for painel in PAINEIS
+        ])
+    except Exception as e:
+        logger.warning(f'Erro ao invalidar estatísticas da empresa {empresa_id}: {e}')
+
+
+def _ultimas_24h():
+    return Q(created_at__gte=timezone.now() - timedelta(hours=24))
+
+
+def customers(qs):
+    """
+    {'total', 'com_telefone', 'recentes', 'ultimo_criado', 'por_status',
+    'valor_abandonado'} em uma consulta. valor_abandonado soma
+    total_abandoned_value dos clientes abandoned_only.
+    """
+    from customers.models import Customer
+
+    stats = qs.order_by().aggregate(
+        total=Count('id'),
+        com_telefone=Count('id', filter=COM_TELEFONE),
+        recentes=Count('id', filter=_ultimas_24h()),
+        ultimo_criado=Max('created_at'),
+        valor_abandonado=Sum('total_abandoned_value', filter=Q(status='abandoned_only')),
+        **{
+            f'status_{status}': Count('id', filter=Q(status=status))
+            for status, _ in Customer.CUSTOMER_STATUS
+        },
+    )
+    stats['por_status'] = {
+        status: stats.pop(f'status_{status}') for status, _ in Customer.CUSTOMER_STATUS
+    }
+    stats['valor_abandonado'] = stats['valor_abandonado'] or 0
+    return stats
+
+
+def carts(qs):
+    """{'total', 'abandonados', 'recentes'} em uma consulta."""
+    return qs.order_by().aggregate(
+        total=Count('id'),
+        abandonados=Count('id', filter=Q(status='abandoned')),
+        recentes=Count('id', filter=_ultimas_24h()),
+    )
+
+
+def leads(qs):
+    """
+    {'total', 'novos', 'clientes', 'prospects', 'recentes', 'por_status'}
+    em uma consulta. por_status só traz os status com leads.
+    """
+    from customers.models import Lead
+
+    stats = qs.order_by().aggregate(
+        total=Count('id'),
+        novos=Count('id', filter=Q(status='new')),
+        clientes=Count('id', filter=Q(is_customer=True)),
+        prospects=Count('id', filter=Q(is_customer=False)),
+        recentes=Count('id', filter=_ultimas_24h()),
+        **{
+            f'status_{status}': Count('id', filter=Q(status=status))
+            for status, _ in Lead.LEAD_STATUS
+        },
+    )
+    stats['por_status'] = {
+        status: n for status, _ in Lead.LEAD_STATUS
+        if (n := stats.pop(f'status_{status}'))
+    }
+    return stats
@@ -0,0 +1,185 @@
+"""
+Exportações em streaming (lista WhatsApp de clientes, leads em
+CSV/TXT/XLSX).
+
+- Linhas lidas com values_list(...).iterator(chunk_size=EXPORTACAO_CHUNK):
+  sem instanciar models nem carregar o queryset inteiro
+- Telefones formatados por bloco (numero_whatsapp com regex compilada)
+- CSV/TXT: StreamingHttpResponse, enviado em blocos de texto
+- XLSX: openpyxl em modo write-only gravado num arquivo temporário e
+  devolvido com FileResponse
+
+A memória fica constante com o número de linhas (100k+ leads/clientes).
+"""
+import csv
+import io
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+
+from customers.models import Customer, Lead, numero_whatsapp
+
+# Linhas de CSV/TXT por bloco enviado ao cliente
+LINHAS_POR_BLOCO = 500
+
+CAMPOS_WHATSAPP = ('first_name', 'last_name', 'email', 'phone', 'status', 'score', 'last_purchase')
+
+CAMPOS_LEAD = ('nome', 'whatsapp', 'numero_sapato', 'status', 'is_customer', 'whatsapp_sent', 'created_at')
+CABECALHO_LEAD = ['Nome', 'WhatsApp', 'Número Sapato', 'Status', 'É Cliente', 'WhatsApp Enviado', 'Data Criação']
+
+
+def _chunk():
+    return getattr(settings, 'EXPORTACAO_CHUNK', 2000)
+
+
+def em_blocos(qs, campos):
+    """Tuplas de values_list(*campos) em listas de até EXPORTACAO_CHUNK."""
+    tamanho = _chunk()
+    # prefetch_related não se aplica a values_list
+    linhas = qs.prefetch_related(None).values_list(*campos).iterator(chunk_size=tamanho)
+    bloco = []
+    for linha in linhas:
+        bloco.append(linha)
+        if len(bloco) >= tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def linhas_whatsapp(qs, ultima_compra=True):
+    """
+    Linhas da lista WhatsApp (Nome, WhatsApp, Email, Status, Score[,
+    Última Compra]) dos clientes com número válido.
+    """
+    status_display = dict(Customer.CUSTOMER_STATUS)
+    for bloco in em_blocos(qs, CAMPOS_WHATSAPP):
+        numeros = [numero_whatsapp(linha[3]) for linha in bloco]
+        for (first_name, last_name, email, _, status, score, last_purchase), numero in zip(bloco, numeros):
+            if not numero:
+                continue
+            nome = f"{first_name or ''} {last_name or ''}".strip() or email.split('@')[0]
+            linha = [nome, numero, email, status_display.get(status, status), score]
+            if ultima_compra:
+                linha.append(last_purchase.strftime('%d/%m/%Y') if last_purchase else 'Nunca')
+            yield linha
+
+
+def linhas_leads(qs):
+    """Linhas dos leads na ordem de CABECALHO_LEAD."""
+    status_display = dict(Lead.LEAD_STATUS)
+    for bloco in em_blocos(qs, CAMPOS_LEAD):
+        for nome, whatsapp, numero_sapato, status, is_customer, whatsapp_sent, created_at in bloco:
+            yield [
+                nome,
+                whatsapp,
+                numero_sapato,
+                status_display.get(status, status),
+                'Sim' if is_customer else 'Não',
+                'Sim' if whatsapp_sent else 'Não',
+                created_at.strftime('%d/%m/%Y %H:%M') if created_at else '',
+            ]
+
+
+def _csv_em_blocos(cabecalho, linhas, bom):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if bom:
+        # BOM para Excel reconhecer UTF-8
+        buffer.write('\ufeff')
+    writer.writerow(cabecalho)
+    for i, linha in enumerate(linhas, 1):
+        writer.writerow(linha)
+        if i % LINHAS_POR_BLOCO == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _anexo(response, nome_arquivo):
+    response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    return response
+
+
+def csv_streaming(cabecalho, linhas, nome_arquivo, bom=False, content_type='text/csv'):
+    """StreamingHttpResponse com o CSV (cabeçalho + linhas) como anexo."""
+    return _anexo(
+        StreamingHttpResponse(_csv_em_blocos(cabecalho, linhas, bom), content_type=content_type),
+        nome_arquivo,
+    )
+
+
+def _txt_leads(linhas):
+    agora = datetime.now().strftime('%d/%m/%Y %H:%M')
+    yield '\ufeff' + '\n'.join(['=' * 80, f'EXPORTAÇÃO DE LEADS - {agora}', '=' * 80, ''])
+    bloco = []
+    for nome, whatsapp, numero_sapato, status, is_customer, whatsapp_sent, criado in linhas:
+        bloco.extend([
+            f'Nome: {nome}',
+            f'WhatsApp: {whatsapp}',
+            f'Número do Sapato: {numero_sapato}',
+            f'Status: {status}',
+            f'É Cliente: {is_customer}',
+            f'WhatsApp Enviado: {whatsapp_sent}',
+            f'Data de Criação: {criado}',
+            '-' * 80,
+            '',
+        ])
+        if len(bloco) >= LINHAS_POR_BLOCO * 9:
+            yield '\n' + '\n'.join(bloco)
+            bloco = []
+    if bloco:
+        yield '\n' + '\n'.join(bloco)
+
+
+def txt_leads(qs, nome_arquivo):
+    """StreamingHttpResponse com os leads em texto, um bloco por lead."""
+    return _anexo(
+        StreamingHttpResponse(_txt_leads(linhas_leads(qs)), content_type='text/plain; charset=utf-8'),
+        nome_arquivo,
+    )
+
+
+def xlsx_leads(qs, nome_arquivo):
+    """
+    FileResponse com os leads em XLSX. O workbook write-only grava as
+    linhas direto no arquivo temporário (apagado ao fechar a resposta).
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font, PatternFill
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Leads')
+
+    # Larguras antes da primeira linha (exigência do modo write-only)
+    for coluna, largura in zip('ABCDEFG', (30, 20, 15, 15, 12, 18, 20)):
+        ws.column_dimensions[coluna].width = largura
+
+    # Cabeçalho
+    header_fill = PatternFill(start_color='4472C4', end_color='4472C4', fill_type='solid')
+    header_font = Font(bold=True, color='FFFFFF')
+    cabecalho = []
+    for titulo in CABECALHO_LEAD:
+        cell = WriteOnlyCell(ws, value=titulo)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = Alignment(horizontal='center')
+        cabecalho.append(cell)
+    ws.append(cabecalho)
+
+    for linha in linhas_leads(qs):
+        ws.append(linha)
+
+    arquivo = tempfile.TemporaryFile()
+    wb.save(arquivo)
+    arquivo.seek(0)
+    return FileResponse(
+        arquivo,
+        as_attachment=True,
+        filename=nome_arquivo,
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
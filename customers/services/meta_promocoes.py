@@ -35,7 +35,7 @@ def _registrar_mensagem(empresa, tipo, canal, nome, telefone,
         if messages:
             meta_message_id = messages[0].get('id', '')
 
-    return MensagemWhatsApp.objects.create(
+    msg = MensagemWhatsApp.objects.create(
         empresa=empresa,
         tipo=tipo,
         canal=canal,
@@ -53,6 +53,14 @@ def _registrar_mensagem(empresa, tipo, canal, nome, telefone,
         customer=customer,
     )
 
+    if success:
+        # Conta para o limite semanal por telefone das réguas
+        from comunicacao.services import contadores, estado
+        contadores.registrar_envio(empresa.id, telefone, f'msg:{msg.id}')
+        estado.registrar_envio(empresa.id, telefone, canal=canal)
+
+    return msg
+
 
 def _cupom_params(empresa):
     """Retorna lista [cupom, desconto, validade] da empresa."""
@@ -0,0 +1,220 @@
+"""
+Snapshots diários por empresa (CustomerAnalysis).
+
+- gerar_snapshots(data): uma consulta agregada por tabela (customers,
+  carts, orders, leads) agrupada por empresa, gravada com upsert em
+  (empresa, date); roda toda noite para o dia anterior
+  (tasks.gerar_snapshots_diarios) e pode ser repetida para dias passados
+  (backfill: gerar_periodo / manage.py backfill_snapshots)
+- totais(empresa): contagens acumuladas para os dashboards = último
+  snapshot + delta ao vivo (linhas criadas depois do fim do dia do
+  snapshot, ou inseridas depois dele com data retroativa, ex.:
+  importação), sem contar a tabela inteira
+
+Totais e status são acumulados até o fim do dia; novos, receita, ticket
+médio e conversão são do próprio dia. Status de clientes/carrinhos é o
+atual no momento da geração (em backfill, não é o status histórico).
+"""
+import logging
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Pedidos que não entram na receita (com ou sem prefixo wc-)
+PEDIDOS_SEM_RECEITA = ['cancelled', 'failed', 'refunded', 'trash']
+PEDIDOS_SEM_RECEITA += [f'wc-{s}' for s in PEDIDOS_SEM_RECEITA]
+
+CAMPOS_SNAPSHOT = [
+    'total_customers', 'new_customers', 'customers_with_phone',
+    'never_bought', 'first_time', 'returning', 'abandoned_only', 'inactive', 'vip',
+    'total_carts', 'new_carts', 'abandoned_carts', 'recovered_carts',
+    'total_orders', 'new_orders', 'total_leads', 'new_leads',
+    'total_revenue', 'abandoned_value', 'avg_order_value', 'conversion_rate',
+    'max_customer_id', 'max_cart_id', 'max_order_id', 'max_lead_id',
+]
+
+TABELAS = ('customers', 'carts', 'orders', 'leads')
+
+COM_TELEFONE = ~Q(phone='') & Q(phone__isnull=False)
+
+
+def limites_do_dia(data):
+    """(início, fim) do dia no fuso do projeto."""
+    inicio = timezone.make_aware(datetime.combine(data, time.min))
+    fim = timezone.make_aware(datetime.combine(data + timedelta(days=1), time.min))
+    return inicio, fim
+
+
+def _por_empresa(qs, empresa_ids, **agregados):
+    # order_by(): a ordenação padrão do model entraria no GROUP BY
+    linhas = (
+        qs.filter(empresa_id__in=empresa_ids)
+        .order_by().values('empresa_id').annotate(**agregados)
+    )
+    return {linha.pop('empresa_id'): linha for linha in linhas}
+
+
+def _agregar(data, empresa_ids):
+    from customers.models import Cart, Customer, Lead, Order
+
+    inicio, fim = limites_do_dia(data)
+    do_dia = Q(created_at__gte=inicio)
+
+    customers = _por_empresa(
+        Customer.objects.filter(created_at__lt=fim), empresa_ids,
+        qtd=Count('id'),
+        novos=Count('id', filter=do_dia),
+        com_telefone=Count('id', filter=COM_TELEFONE),
+        max_id=Max('id'),
+        **{
+            status: Count('id', filter=Q(status=status))
+            for status, _ in Customer.CUSTOMER_STATUS
+        },
+    )
+    carts = _por_empresa(
+        Cart.objects.filter(created_at__lt=fim), empresa_ids,
+        qtd=Count('id'),
+        novos=Count('id', filter=do_dia),
+        convertidos=Count('id', filter=do_dia & Q(status__in=['recovered', 'converted'])),
+        abandonados=Count('id', filter=Q(status='abandoned')),
+        recuperados=Count('id', filter=Q(was_recovered=True)),
+        valor_abandonado=Sum('cart_total', filter=Q(status='abandoned')),
+        max_id=Max('id'),
+    )
+    com_receita = do_dia & ~Q(status__in=PEDIDOS_SEM_RECEITA)
+    orders = _por_empresa(
+        Order.objects.filter(created_at__lt=fim), empresa_ids,
+        qtd=Count('id'),
+        novos=Count('id', filter=do_dia),
+        pagos=Count('id', filter=com_receita),
+        receita=Sum('total', filter=com_receita),
+        max_id=Max('id'),
+    )
+    leads = _por_empresa(
+        Lead.objects.filter(created_at__lt=fim), empresa_ids,
+        qtd=Count('id'),
+        novos=Count('id', filter=do_dia),
+        max_id=Max('id'),
+    )
+    return customers, carts, orders, leads
+
+
+def _snapshot(empresa_id, data, c, k, o, l):
+    from customers.models import Customer, CustomerAnalysis
+
+    receita = o.get('receita') or Decimal('0')
+    pagos = o.get('pagos', 0)
+    novos_carts = k.get('novos', 0)
+    return CustomerAnalysis(
+        empresa_id=empresa_id,
+        date=data,
+        total_customers=c.get('qtd', 0),
+        new_customers=c.get('novos', 0),
+        customers_with_phone=c.get('com_telefone', 0),
+        **{status: c.get(status, 0) for status, _ in Customer.CUSTOMER_STATUS},
+        total_carts=k.get('qtd', 0),
+        new_carts=novos_carts,
+        abandoned_carts=k.get('abandonados', 0),
+        recovered_carts=k.get('recuperados', 0),
+        total_orders=o.get('qtd', 0),
+        new_orders=o.get('novos', 0),
+        total_leads=l.get('qtd', 0),
+        new_leads=l.get('novos', 0),
+        total_revenue=receita,
+        abandoned_value=k.get('valor_abandonado') or Decimal('0'),
+        avg_order_value=(receita / pagos).quantize(Decimal('0.01')) if pagos else Decimal('0'),
+        conversion_rate=round(k.get('convertidos', 0) / novos_carts * 100, 2) if novos_carts else 0,
+        max_customer_id=c.get('max_id') or 0,
+        max_cart_id=k.get('max_id') or 0,
+        max_order_id=o.get('max_id') or 0,
+        max_lead_id=l.get('max_id') or 0,
+    )
+
+
+def gerar_snapshots(data, empresas=None):
+    """
+    Grava o snapshot de data para as empresas (padrão: todas ativas),
+    substituindo o existente. Retorna o número de snapshots gravados.
+    """
+    from customers.models import CustomerAnalysis
+    from tenants.models import Empresa
+
+    if empresas is None:
+        empresas = Empresa.objects.filter(ativo=True)
+    empresa_ids = [e.id for e in empresas]
+    if not empresa_ids:
+        return 0
+
+    customers, carts, orders, leads = _agregar(data, empresa_ids)
+    snapshots = [
+        _snapshot(
+            empresa_id, data,
+            customers.get(empresa_id, {}), carts.get(empresa_id, {}),
+            orders.get(empresa_id, {}), leads.get(empresa_id, {}),
+        )
+        for empresa_id in empresa_ids
+    ]
+    CustomerAnalysis.objects.bulk_create(
+        snapshots,
+        update_conflicts=True,
+        unique_fields=['empresa', 'date'],
+        update_fields=CAMPOS_SNAPSHOT,
+    )
+    return len(snapshots)
+
+
+def gerar_periodo(inicio, fim, empresas=None):
+    """Backfill: snapshots de inicio a fim (datas, inclusive)."""
+    if empresas is not None:
+        empresas = list(empresas)
+    gravados = 0
+    data = inicio
+    while data <= fim:
+        gravados += gerar_snapshots(data, empresas)
+        data += timedelta(days=1)
+    logger.info(f'Snapshots de {inicio} a {fim}: {gravados} gravados')
+    return gravados
+
+
+def totais(empresa, tabelas=TABELAS):
+    """
+    Contagens acumuladas da empresa: último snapshot + delta ao vivo.
+    Sem snapshot, o delta é a tabela inteira. Só consulta as tabelas
+    pedidas ('customers' inclui customers_with_phone).
+    Retorna {'customers', 'customers_with_phone', 'carts', 'orders', 'leads'}.
+    """
+    from customers.models import Cart, Customer, CustomerAnalysis, Lead, Order
+
+    snapshot = CustomerAnalysis.objects.filter(empresa=empresa).order_by('-date').first()
+    fim = limites_do_dia(snapshot.date)[1] if snapshot else None
+    resultado = {
+        'customers': snapshot.total_customers if snapshot else 0,
+        'customers_with_phone': snapshot.customers_with_phone if snapshot else 0,
+        'carts': snapshot.total_carts if snapshot else 0,
+        'orders': snapshot.total_orders if snapshot else 0,
+        'leads': snapshot.total_leads if snapshot else 0,
+    }
+
+    def delta(model, campo_max):
+        qs = model.objects.filter(empresa=empresa).order_by()
+        if snapshot:
+            qs = qs.filter(Q(created_at__gte=fim) | Q(pk__gt=getattr(snapshot, campo_max)))
+        return qs
+
+    if 'customers' in tabelas:
+        novos = delta(Customer, 'max_customer_id').aggregate(
+            total=Count('id'), com_telefone=Count('id', filter=COM_TELEFONE),
+        )
+        resultado['customers'] += novos['total']
+        resultado['customers_with_phone'] += novos['com_telefone']
+    if 'carts' in tabelas:
+        resultado['carts'] += delta(Cart, 'max_cart_id').count()
+    if 'orders' in tabelas:
+        resultado['orders'] += delta(Order, 'max_order_id').count()
+    if 'leads' in tabelas:
+        resultado['leads'] += delta(Lead, 'max_lead_id').count()
+    return resultado
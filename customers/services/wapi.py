@@ -6,6 +6,8 @@ import logging
 import requests
 from django.conf import settings
 
+from customer_intelligence import http
+
 logger = logging.getLogger(__name__)
 
 
@@ -31,8 +33,10 @@ class WAPIClient:
         if not self.esta_configurado():
             return {'success': False, 'error': 'W-API não configurado'}
         try:
-            response = requests.get(
+            response = http.request(
+                'wapi', 'GET',
                 f"{self.BASE_URL}/instance/status-instance",
+                credencial=self.instance,
                 params={'instanceId': self.instance},
                 headers=self._headers(),
                 timeout=30
@@ -50,8 +54,10 @@ class WAPIClient:
             return {'success': False, 'error': 'W-API não configurado'}
 
         try:
-            response = requests.post(
+            response = http.request(
+                'wapi', 'POST',
                 f"{self.BASE_URL}/message/send-text?instanceId={self.instance}",
+                credencial=self.instance,
                 json={
                     'phone': telefone,
                     'message': mensagem,
@@ -67,7 +73,7 @@ class WAPIClient:
                 return {'success': True, 'response': response.json()}
 
             logger.error(f"Erro W-API {response.status_code}: {response.text}")
-            return {'success': False, 'error': response.text}
+            return {'success': False, 'error': response.text, 'status_code': response.status_code}
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Erro ao enviar WhatsApp: {e}")
@@ -79,8 +85,10 @@ class WAPIClient:
             return {'success': False, 'error': 'W-API não configurado'}
 
         try:
-            response = requests.post(
+            response = http.request(
+                'wapi', 'POST',
                 f"{self.BASE_URL}/message/send-image?instanceId={self.instance}",
+                credencial=self.instance,
                 json={
                     'phone': telefone,
                     'image': image_url,
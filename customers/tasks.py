@@ -2,6 +2,8 @@
 Tasks Celery para envio diario de mensagens WhatsApp via Meta API.
 - Leads do dia anterior (segmentados: cliente vs nao-cliente)
 - Carrinhos abandonados do dia anterior
+- Encaminhamento de respostas de clientes para o atendente humano
+- Snapshots diarios por empresa (CustomerAnalysis)
 """
 import logging
 from celery import shared_task
@@ -165,3 +167,68 @@ def _processar_clientes_inativos(empresa):
             enviados += 1
 
     return enviados
+
+
+@shared_task(
+    name='customers.encaminhar_resposta_humano',
+    bind=True, max_retries=3, default_retry_delay=60,
+)
+def encaminhar_resposta_humano(self, resposta_id):
+    """
+    Encaminha uma resposta de cliente (MensagemWhatsApp tipo=resposta_cliente)
+    para o WhatsApp do atendente humano. Agendada pelo webhook Meta.
+    """
+    from customers.models import MensagemWhatsApp
+    from customers.services.encaminhamento import encaminhar
+
+    resposta = MensagemWhatsApp.objects.select_related(
+        'empresa', 'resposta_a',
+    ).filter(id=resposta_id, encaminhado_humano=False).first()
+    if not resposta:
+        return {'success': True, 'encaminhadas': 0}
+
+    resultado = encaminhar(resposta.empresa, [resposta])
+    if not resultado.get('success') and resultado.get('retry'):
+        raise self.retry()
+    return {'success': resultado.get('success', False), 'encaminhadas': 1}
+
+
+@shared_task(
+    name='customers.enviar_digest_humano',
+    bind=True, max_retries=3, default_retry_delay=60,
+)
+def enviar_digest_humano(self, empresa_id):
+    """
+    Modo digest: junta as respostas pendentes da empresa numa única
+    mensagem para o atendente. Agendada com countdown = janela do digest.
+    """
+    from tenants.cache import get_empresa_por_id
+    from customers.services.encaminhamento import encaminhar_pendentes
+
+    empresa = get_empresa_por_id(empresa_id)
+    if not empresa:
+        return {'success': False, 'encaminhadas': 0}
+
+    resultado = encaminhar_pendentes(empresa)
+    if not resultado.get('success') and resultado.get('retry'):
+        raise self.retry()
+    return {
+        'success': resultado.get('success', False),
+        'encaminhadas': resultado.get('encaminhadas', 0),
+    }
+
+
+@shared_task(name='customers.gerar_snapshots_diarios')
+def gerar_snapshots_diarios(data=None):
+    """
+    Task diaria: snapshot (CustomerAnalysis) de cada empresa ativa para o
+    dia anterior, ou para data (ISO, ex: '2026-03-01').
+    Roda via Celery Beat logo apos a meia-noite.
+    """
+    from datetime import date
+    from customers.services.snapshots import gerar_snapshots
+
+    dia = date.fromisoformat(data) if data else timezone.localdate() - timedelta(days=1)
+    gravados = gerar_snapshots(dia)
+    logger.info(f"Snapshots de {dia}: {gravados} empresas")
+    return {'data': dia.isoformat(), 'empresas': gravados}
@@ -1,3 +1,365 @@
-from django.test import TestCase
+import io
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from customer_intelligence import http
+from customers.models import Cart, Customer, CustomerAnalysis, Lead, MensagemWhatsApp, Order
+from customers.services import encaminhamento, estatisticas, exportacao, snapshots
+from customers.services.wapi import WAPIClient
+from tenants.models import Empresa
+
+
+class EncaminhamentoHumanoTests(TestCase):
+    """Testes do encaminhamento de respostas para o atendente humano"""
+
+    def setUp(self):
+        cache.clear()
+        self.empresa = Empresa.objects.create(
+            nome='Loja', slug='loja', meta_whatsapp_humano='5516999990000',
+            wapi_token='tok', wapi_instance='inst',
+        )
+        self.original = MensagemWhatsApp.objects.create(
+            empresa=self.empresa, tipo='cart', canal='meta',
+            destinatario_nome='Ana', destinatario_telefone='5516988887777',
+            template_name='carrinho_abandonado',
+        )
+
+    def _resposta(self, texto, telefone='5516988887777'):
+        return MensagemWhatsApp.objects.create(
+            empresa=self.empresa, tipo='resposta_cliente', canal='meta',
+            destinatario_nome='Ana', destinatario_telefone=telefone,
+            mensagem_texto=texto, resposta_a=self.original,
+        )
+
+    @mock.patch('customers.services.wapi.WAPIClient.enviar_mensagem')
+    def test_digest_envia_uma_mensagem(self, enviar):
+        enviar.return_value = {'success': True, 'response': {}}
+        self._resposta('Oi')
+        self._resposta('Ainda tem?', telefone='5516977776666')
+
+        resultado = encaminhamento.encaminhar_pendentes(self.empresa)
+
+        self.assertTrue(resultado['success'])
+        self.assertEqual(resultado['encaminhadas'], 2)
+        enviar.assert_called_once()
+        texto = enviar.call_args[0][1]
+        self.assertIn('2 novas respostas', texto)
+        self.assertFalse(MensagemWhatsApp.objects.filter(
+            tipo='resposta_cliente', encaminhado_humano=False,
+        ).exists())
+        self.original.refresh_from_db()
+        self.assertTrue(self.original.encaminhado_humano)
+
+    @mock.patch('customers.services.wapi.WAPIClient.enviar_mensagem')
+    def test_digest_envia_todas_as_pendentes_em_blocos(self, enviar):
+        enviar.return_value = {'success': True, 'response': {}}
+        for n in range(encaminhamento.MAX_RESPOSTAS_DIGEST + 5):
+            self._resposta(f'Oi {n}')
+
+        resultado = encaminhamento.encaminhar_pendentes(self.empresa)
+
+        self.assertEqual(resultado['encaminhadas'], encaminhamento.MAX_RESPOSTAS_DIGEST + 5)
+        self.assertEqual(enviar.call_count, 2)
+        self.assertFalse(MensagemWhatsApp.objects.filter(
+            tipo='resposta_cliente', encaminhado_humano=False,
+        ).exists())
+
+    @mock.patch('customers.services.wapi.WAPIClient.enviar_mensagem')
+    def test_falha_libera_respostas(self, enviar):
+        enviar.return_value = {'success': False, 'error': 'timeout'}
+        resposta = self._resposta('Oi')
+
+        resultado = encaminhamento.encaminhar(self.empresa, [resposta])
+
+        self.assertFalse(resultado['success'])
+        resposta.refresh_from_db()
+        self.assertFalse(resposta.encaminhado_humano)
+
+    @mock.patch('customers.services.wapi.WAPIClient.enviar_mensagem')
+    def test_task_so_repete_falha_de_envio(self, enviar):
+        from customers import tasks
+
+        enviar.return_value = {'success': False, 'error': 'timeout'}
+        resposta = self._resposta('Oi')
+        with mock.patch.object(tasks.encaminhar_resposta_humano, 'retry', side_effect=RuntimeError) as retry:
+            with self.assertRaises(RuntimeError):
+                tasks.encaminhar_resposta_humano(resposta.id)
+            retry.assert_called_once()
+
+            # Sem W-API configurado: não adianta repetir
+            Empresa.objects.filter(id=self.empresa.id).update(wapi_token='', wapi_instance='')
+            resultado = tasks.encaminhar_resposta_humano(resposta.id)
+        self.assertEqual(retry.call_count, 1)
+        self.assertFalse(resultado['success'])
+
+    @override_settings(HANDOFF_DIGEST_SEGUNDOS=30)
+    @mock.patch('customers.tasks.enviar_digest_humano.apply_async')
+    def test_digest_agenda_uma_vez_por_janela(self, apply_async):
+        with self.captureOnCommitCallbacks(execute=True):
+            encaminhamento.agendar_encaminhamento(self.empresa, self._resposta('1'))
+            encaminhamento.agendar_encaminhamento(self.empresa, self._resposta('2'))
+
+        apply_async.assert_called_once_with(args=[self.empresa.id], countdown=30)
+
+
+class TransporteHttpTests(TestCase):
+    """Testes do transporte HTTP compartilhado (customer_intelligence.http)"""
+
+    def setUp(self):
+        http.fechar_sessoes()
+
+    def _resposta(self, status=200):
+        resposta = mock.Mock(status_code=status, ok=status < 400, content=b'{}')
+        resposta.json.return_value = {}
+        return resposta
+
+    def test_reutiliza_sessao_por_host_e_credencial(self):
+        cliente = WAPIClient(token='tok', instance='inst')
+        with mock.patch('requests.Session.request', return_value=self._resposta()) as request:
+            cliente.enviar_mensagem('5516999990000', 'oi')
+            cliente.enviar_mensagem('5516999990001', 'oi')
+
+        self.assertEqual(request.call_count, 2)
+        self.assertIs(http.get_sessao(WAPIClient.BASE_URL, 'inst'), http.get_sessao(WAPIClient.BASE_URL, 'inst'))
+        self.assertIsNot(http.get_sessao(WAPIClient.BASE_URL, 'inst'), http.get_sessao(WAPIClient.BASE_URL, 'outra'))
+
+    def test_retry_so_repete_metodos_idempotentes(self):
+        retry = http.get_sessao('https://api.w-api.app/v1').get_adapter('https://api.w-api.app').max_retries
+        self.assertTrue(retry.is_retry('GET', 503))
+        self.assertFalse(retry.is_retry('POST', 503))
+
+    def test_registra_latencia_por_servico(self):
+        antes = http.latencias().get('wapi', {}).get('total', 0)
+        with mock.patch('requests.Session.request', return_value=self._resposta(502)):
+            WAPIClient(token='tok', instance='inst').enviar_mensagem('5516999990000', 'oi')
+
+        resumo = http.latencias()['wapi']
+        self.assertEqual(resumo['total'], antes + 1)
+        self.assertGreaterEqual(resumo['erros'], 1)
+
+
+class SnapshotsTests(TestCase):
+    """Testes dos snapshots diários por empresa (CustomerAnalysis)"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+        self.outra = Empresa.objects.create(nome='Outra', slug='outra')
+        self.ontem = timezone.localdate() - timedelta(days=1)
+        self.inicio_ontem = snapshots.limites_do_dia(self.ontem)[0]
+
+    def _customer(self, empresa, email, quando, status='never_bought', **kwargs):
+        customer = Customer.objects.create(empresa=empresa, email=email, **kwargs)
+        Customer.objects.filter(pk=customer.pk).update(created_at=quando, status=status)
+        return customer
+
+    def _pedido(self, customer, order_id, total, quando, status='completed'):
+        return Order.objects.create(
+            empresa=customer.empresa, customer=customer, order_id=order_id, order_number=order_id,
+            total=Decimal(total), status=status, created_at=quando,
+        )
+
+    def _dados(self):
+        antigo = self.inicio_ontem - timedelta(days=3)
+        hora = self.inicio_ontem + timedelta(hours=10)
+        ana = self._customer(self.empresa, 'ana@x.com', antigo, phone='16999990000', status='returning')
+        bia = self._customer(self.empresa, 'bia@x.com', hora, status='abandoned_only')
+        self._customer(self.outra, 'cy@x.com', hora)
+
+        self._pedido(ana, '1', '100.00', antigo)
+        self._pedido(ana, '2', '150.00', hora)
+        self._pedido(ana, '3', '50.00', hora)
+        self._pedido(ana, '4', '999.00', hora, status='cancelled')
+        Cart.objects.create(
+            empresa=self.empresa, customer=bia, checkout_id='c1', session_id='s',
+            cart_total=Decimal('80.00'), cart_contents=[], status='abandoned', created_at=hora,
+        )
+        Cart.objects.create(
+            empresa=self.empresa, customer=ana, checkout_id='c2', session_id='s',
+            cart_total=Decimal('150.00'), cart_contents=[], status='converted', created_at=hora,
+        )
+        Lead.objects.create(
+            empresa=self.empresa, form_id='f1', nome='Ana', whatsapp='16999990000',
+            numero_sapato='37', created_at=hora,
+        )
+        return ana
+
+    def test_snapshot_por_empresa_em_consultas_agregadas(self):
+        self._dados()
+        # Empresas + uma consulta por tabela + upsert
+        with self.assertNumQueries(6):
+            self.assertEqual(snapshots.gerar_snapshots(self.ontem), 2)
+
+        snap = CustomerAnalysis.objects.get(empresa=self.empresa, date=self.ontem)
+        self.assertEqual((snap.total_customers, snap.new_customers, snap.customers_with_phone), (2, 1, 1))
+        self.assertEqual((snap.returning, snap.abandoned_only, snap.never_bought), (1, 1, 0))
+        self.assertEqual((snap.total_orders, snap.new_orders), (4, 3))
+        self.assertEqual(snap.total_revenue, Decimal('200.00'))
+        self.assertEqual(snap.avg_order_value, Decimal('100.00'))
+        self.assertEqual((snap.total_carts, snap.abandoned_carts, snap.abandoned_value), (2, 1, Decimal('80.00')))
+        self.assertEqual(snap.conversion_rate, 50.0)
+        self.assertEqual((snap.total_leads, snap.new_leads), (1, 1))
+        self.assertEqual(CustomerAnalysis.objects.get(empresa=self.outra).total_customers, 1)
+
+        # Repetir o dia (backfill) substitui o snapshot
+        Order.objects.filter(order_id='3').update(status='refunded')
+        snapshots.gerar_periodo(self.ontem - timedelta(days=1), self.ontem, [self.empresa])
+        snap.refresh_from_db()
+        self.assertEqual(snap.total_revenue, Decimal('150.00'))
+        self.assertEqual(
+            CustomerAnalysis.objects.filter(empresa=self.empresa).count(), 2,
+        )
+        self.assertEqual(
+            CustomerAnalysis.objects.get(empresa=self.empresa, date=self.ontem - timedelta(days=1)).total_orders, 1,
+        )
+
+    def test_totais_snapshot_mais_delta_de_hoje(self):
+        ana = self._dados()
+        snapshots.gerar_snapshots(self.ontem)
+
+        # Hoje: um cliente novo e um pedido importado com data retroativa
+        self._customer(self.empresa, 'di@x.com', timezone.now(), phone='16988880000')
+        self._pedido(ana, '5', '10.00', self.inicio_ontem - timedelta(days=10))
+
+        with self.assertNumQueries(5):
+            totais = snapshots.totais(self.empresa)
+        self.assertEqual(totais, {
+            'customers': Customer.objects.filter(empresa=self.empresa).count(),
+            'customers_with_phone': 2,
+            'carts': 2,
+            'orders': Order.objects.filter(empresa=self.empresa).count(),
+            'leads': 1,
+        })
+        # Sem snapshot, conta tudo
+        self.assertEqual(snapshots.totais(self.outra)['customers'], 1)
+        CustomerAnalysis.objects.all().delete()
+        self.assertEqual(snapshots.totais(self.empresa), totais)
+
+
+class EstatisticasDashboardTests(TestCase):
+    """Testes das estatísticas dos dashboards (uma consulta por tabela, cache por empresa)"""
+
+    def setUp(self):
+        cache.clear()
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+        for i, status in enumerate(['vip', 'vip', 'abandoned_only']):
+            customer = Customer.objects.create(
+                empresa=self.empresa, email=f'c{i}@x.com', phone='1699999000' if i else '',
+            )
+            # save() recalcula o status
+            Customer.objects.filter(pk=customer.pk).update(
+                status=status, total_abandoned_value=Decimal('30.00'),
+            )
+
+    def _lead(self, form_id, **kwargs):
+        return Lead.objects.create(
+            empresa=self.empresa, form_id=form_id, nome='Ana', whatsapp='16999990000',
+            numero_sapato='37', created_at=timezone.now(), **kwargs,
+        )
+
+    def test_customers_em_uma_consulta(self):
+        with self.assertNumQueries(1):
+            stats = estatisticas.customers(Customer.objects.filter(empresa=self.empresa))
+
+        self.assertEqual((stats['total'], stats['com_telefone'], stats['recentes']), (3, 2, 3))
+        self.assertEqual(stats['por_status']['vip'], 2)
+        self.assertEqual(stats['por_status']['never_bought'], 0)
+        self.assertEqual(stats['valor_abandonado'], Decimal('30.00'))
+
+    def test_leads_stats_em_cache_ate_invalidar(self):
+        User.objects.create_superuser('admin', 'admin@x.com', 'senha')
+        self.client.login(username='admin', password='senha')
+        self._lead('f1', is_customer=True)
+
+        resposta = self.client.get(reverse('importer:leads_stats')).json()
+        self.assertEqual((resposta['total_leads'], resposta['existing_customers']), (1, 1))
+        self.assertEqual(resposta['status_breakdown'], [{'status': 'new', 'count': 1}])
+
+        self._lead('f2', status='lost')
+        with self.assertNumQueries(0):
+            self.assertEqual(estatisticas.em_cache(None, 'leads', dict)['total_leads'], 1)
+
+        estatisticas.invalidar(self.empresa.id)
+        resposta = self.client.get(reverse('importer:leads_stats')).json()
+        self.assertEqual((resposta['total_leads'], resposta['prospects']), (2, 1))
+
+    def test_totais_da_empresa_vem_do_snapshot(self):
+        from importer.views import ImportStatusView, leads_stats_view
+
+        ontem = timezone.localdate() - timedelta(days=1)
+        self._lead('f1')
+        snapshots.gerar_snapshots(ontem)
+        # Snapshot marcado para provar que os acumulados saem dele
+        CustomerAnalysis.objects.filter(empresa=self.empresa).update(
+            total_customers=100, customers_with_phone=50, total_leads=10,
+            max_customer_id=Customer.objects.order_by('-pk').first().pk,
+        )
+        self._lead('f2', status='lost')
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_superuser('admin', 'admin@x.com', 'senha')
+        request.tenant = self.empresa
+
+        leads = json.loads(leads_stats_view(request).content)
+        # 10 do snapshot + 2 criados hoje; status ao vivo
+        self.assertEqual(leads['total_leads'], 12)
+        self.assertEqual(leads['status_breakdown'], [
+            {'status': 'new', 'count': 1}, {'status': 'lost', 'count': 1},
+        ])
+
+        importacao = json.loads(ImportStatusView.as_view()(request).content)
+        self.assertEqual((importacao['total_customers'], importacao['customers_with_phone']), (103, 52))
+        self.assertEqual(importacao['recent_imports']['customers'], 3)
+
+
+@override_settings(EXPORTACAO_CHUNK=2)
+class ExportacaoStreamingTests(TestCase):
+    """Testes das exportações em streaming (lista WhatsApp e leads)"""
+
+    def setUp(self):
+        self.empresa = Empresa.objects.create(nome='Loja', slug='loja')
+
+    def test_export_whatsapp_em_streaming(self):
+        telefones = ['(16) 99999-0000', '5516988887777', '123', '16 3333-4444']
+        for i, phone in enumerate(telefones):
+            Customer.objects.create(empresa=self.empresa, email=f'c{i}@x.com', first_name=f'C{i}', phone=phone)
+
+        resposta = self.client.get(reverse('customer-export-whatsapp'))
+        self.assertTrue(resposta.streaming)
+        linhas = b''.join(resposta.streaming_content).decode().splitlines()
+
+        self.assertEqual(linhas[0], 'Nome,WhatsApp,Email,Status,Score,Última Compra')
+        esperados = {
+            c.whatsapp_number for c in Customer.objects.all() if c.whatsapp_number
+        }
+        self.assertEqual({linha.split(',')[1] for linha in linhas[1:]}, esperados)
+        self.assertEqual(len(linhas), 4)  # '123' fica de fora
+        self.assertIn('C0,5516999990000,c0@x.com,Nunca Comprou,', linhas[1] + linhas[2] + linhas[3])
+
+    def test_leads_xlsx_write_only_e_txt(self):
+        import openpyxl
+
+        for i in range(5):
+            Lead.objects.create(
+                empresa=self.empresa, form_id=f'f{i}', nome=f'Lead {i}', whatsapp='16999990000',
+                numero_sapato='37', is_customer=i == 0, created_at=timezone.now(),
+            )
+        leads = Lead.objects.order_by('form_id')
+
+        resposta = exportacao.xlsx_leads(leads, 'leads.xlsx')
+        ws = openpyxl.load_workbook(io.BytesIO(b''.join(resposta.streaming_content))).active
+        linhas = list(ws.values)
+        self.assertEqual(list(linhas[0]), exportacao.CABECALHO_LEAD)
+        self.assertEqual(len(linhas), 6)
+        self.assertEqual(linhas[1][:5], ('Lead 0', '16999990000', '37', 'Novo', 'Sim'))
+
+        texto = b''.join(exportacao.txt_leads(leads, 'leads.txt').streaming_content).decode()
+        self.assertTrue(texto.startswith('\ufeff' + '=' * 80))
+        self.assertEqual(texto.count('Nome: Lead'), 5)
@@ -1,12 +1,11 @@
 from rest_framework import viewsets, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import Q, Count, Sum
+from django.db.models import Q
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import Customer
 from customers.serializers import CustomerSerializer
-import csv
-from django.http import HttpResponse
+from customers.services.exportacao import csv_streaming, linhas_whatsapp
 
 class CustomerViewSet(viewsets.ModelViewSet):
     queryset = Customer.objects.all()
@@ -35,51 +34,38 @@ class CustomerViewSet(viewsets.ModelViewSet):
         if min_score:
             customers = customers.filter(score__gte=int(min_score))
         
-        # Criar CSV
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="whatsapp_export.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow(['Nome', 'WhatsApp', 'Email', 'Status', 'Score', 'Última Compra'])
-        
-        for customer in customers:
-            if customer.whatsapp_number:
-                writer.writerow([
-                    customer.full_name,
-                    customer.whatsapp_number,
-                    customer.email,
-                    customer.get_status_display(),
-                    customer.score,
-                    customer.last_purchase.strftime('%d/%m/%Y') if customer.last_purchase else 'Nunca'
-                ])
-        
-        return response
+        # CSV em streaming (values_list em blocos, sem instanciar clientes)
+        return csv_streaming(
+            ['Nome', 'WhatsApp', 'Email', 'Status', 'Score', 'Última Compra'],
+            linhas_whatsapp(customers),
+            'whatsapp_export.csv',
+        )
     
     @action(detail=False, methods=['get'])
     def dashboard_stats(self, request):
         """Estatísticas para dashboard"""
-        
-        stats = {
-            'total_customers': self.get_queryset().count(),
-            'by_status': {},
-            'potential_recovery': 0,
-            'total_abandoned_value': 0,
-        }
-        
-        # Por status
-        for status, label in Customer.CUSTOMER_STATUS:
-            count = self.get_queryset().filter(status=status).count()
-            stats['by_status'][status] = {
-                'label': label,
-                'count': count,
-                'percentage': (count / stats['total_customers'] * 100) if stats['total_customers'] > 0 else 0
+        from customers.services import estatisticas
+
+        def calcular():
+            # Uma consulta com todas as contagens
+            clientes = estatisticas.customers(self.get_queryset())
+            total = clientes['total']
+            stats = {
+                'total_customers': total,
+                'by_status': {},
+                'potential_recovery': clientes['por_status']['abandoned_only'],
+                'total_abandoned_value': clientes['valor_abandonado'],
             }
-        
-        # Potencial de recuperação
-        abandoned_only = self.get_queryset().filter(status='abandoned_only')
-        stats['potential_recovery'] = abandoned_only.count()
-        stats['total_abandoned_value'] = abandoned_only.aggregate(
-            Sum('total_abandoned_value')
-        )['total_abandoned_value__sum'] or 0
-        
-        return Response(stats)
\ No newline at end of file
+
+            # Por status
+            for status, label in Customer.CUSTOMER_STATUS:
+                count = clientes['por_status'][status]
+                stats['by_status'][status] = {
+                    'label': label,
+                    'count': count,
+                    'percentage': (count / total * 100) if total > 0 else 0
+                }
+            return stats
+
+        # queryset não é filtrado por empresa: cache da visão global
+        return Response(estatisticas.em_cache(None, 'clientes', calcular))
\ No newline at end of file
@@ -21,8 +21,9 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
-from tenants.models import Empresa
+from tenants.cache import get_empresa_por_slug
 from customers.models import Customer, Order
+from customers.services.estatisticas import invalidar as invalidar_estatisticas
 from customers.services.wapi import enviar_whatsapp_pedido_novo, enviar_whatsapp_pedido_status, STATUS_MSG_MAP, formatar_telefone
 
 logger = logging.getLogger(__name__)
@@ -74,9 +75,8 @@ def _process_woo_order(request, empresa_slug):
     logger.info(f'Webhook recebido de {empresa_slug}: topic={wc_topic}, resource={wc_resource}, event={wc_event}, content_type={content_type}, body_len={body_len}')
 
     # 1. Buscar empresa
-    try:
-        empresa = Empresa.objects.get(slug=empresa_slug, ativo=True)
-    except Empresa.DoesNotExist:
+    empresa = get_empresa_por_slug(empresa_slug)
+    if not empresa:
         return JsonResponse({'error': 'empresa not found'}, status=404)
 
     # 2. Verificar assinatura (log warning se falhar, mas nao bloqueia)
@@ -196,6 +196,7 @@ def _process_woo_order(request, empresa_slug):
     customer.completed_orders = completed
     customer.last_purchase = created_dt
     customer.save()
+    invalidar_estatisticas(empresa.id)
 
     # 7. Enviar WhatsApp de boas-vindas
     whatsapp_result = {'sent': False}
@@ -247,9 +248,8 @@ def _process_woo_order_updated(request, empresa_slug):
     logger.info(f'Webhook order-updated de {empresa_slug}: topic={wc_topic}, resource={wc_resource}, content_type={content_type}, body_len={body_len}')
 
     # 1. Buscar empresa
-    try:
-        empresa = Empresa.objects.get(slug=empresa_slug, ativo=True)
-    except Empresa.DoesNotExist:
+    empresa = get_empresa_por_slug(empresa_slug)
+    if not empresa:
         return JsonResponse({'error': 'empresa not found'}, status=404)
 
     # 2. Verificar assinatura
@@ -363,6 +363,7 @@ def _process_woo_order_updated(request, empresa_slug):
     ).count()
     customer.completed_orders = completed
     customer.save()
+    invalidar_estatisticas(empresa.id)
 
     # 7. Enviar WhatsApp se status mudou e está no mapa
     whatsapp_result = {'sent': False}
@@ -16,7 +16,10 @@ from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 
 from tenants.models import Empresa
+from tenants.cache import get_empresa_por_phone_number_id
 from customers.models import MensagemWhatsApp, Customer
+from customers.services.encaminhamento import agendar_encaminhamento
+from comunicacao.services import estado, stats_regras
 
 logger = logging.getLogger(__name__)
 
@@ -82,10 +85,7 @@ def _process_webhook(request):
             phone_number_id = metadata.get('phone_number_id', '')
 
             # Identificar empresa pelo phone_number_id
-            empresa = Empresa.objects.filter(
-                ativo=True,
-                meta_phone_number_id=phone_number_id,
-            ).first()
+            empresa = get_empresa_por_phone_number_id(phone_number_id)
 
             if not empresa:
                 logger.warning(
@@ -130,6 +130,8 @@ def _process_status_update(status_data, empresa):
         int(timestamp), tz=timezone.utc
     ) if timestamp else timezone.now()
 
+    status_antes = msg.status
+
     if status == 'delivered':
         msg.status = 'entregue'
         msg.entregue_em = ts
@@ -140,6 +142,7 @@ def _process_status_update(status_data, empresa):
         msg.status = 'lido'
         msg.lido_em = ts
         msg.save(update_fields=['status', 'lido_em'])
+        estado.recalcular_ignorados(empresa.id, msg.destinatario_telefone, lido_em=ts)
         logger.info(f'Mensagem {wamid} lida')
 
     elif status == 'failed':
@@ -148,8 +151,12 @@ def _process_status_update(status_data, empresa):
         msg.status = 'falha'
         msg.error_message = error_msg
         msg.save(update_fields=['status', 'error_message'])
+        estado.recalcular_ignorados(empresa.id, msg.destinatario_telefone)
         logger.error(f'Mensagem {wamid} falhou: {error_msg}')
 
+    if msg.status != status_antes:
+        stats_regras.aplicar_transicao(msg, status_antes, respondido_antes=msg.respondido)
+
 
 def _process_incoming_message(message, contacts, empresa):
     """
@@ -211,12 +218,20 @@ def _process_incoming_message(message, contacts, empresa):
         ).order_by('-created_at').first()
 
     if msg_original:
+        respondido_antes = msg_original.respondido
         msg_original.respondido = True
         msg_original.respondido_em = ts
         msg_original.resposta_texto = texto[:2000]
         msg_original.save(update_fields=[
             'respondido', 'respondido_em', 'resposta_texto',
         ])
+        estado.recalcular_ignorados(
+            empresa.id, msg_original.destinatario_telefone, respondido_em=ts,
+        )
+        if not respondido_antes:
+            stats_regras.aplicar_transicao(
+                msg_original, msg_original.status, respondido_antes=False,
+            )
         logger.info(
             f'Resposta vinculada a mensagem {msg_original.id} '
             f'(tipo={msg_original.tipo}, template={msg_original.template_name})'
@@ -229,7 +244,7 @@ def _process_incoming_message(message, contacts, empresa):
         phone__endswith=from_number[-8:],
     ).first()
 
-    MensagemWhatsApp.objects.create(
+    resposta = MensagemWhatsApp.objects.create(
         empresa=empresa,
         tipo='resposta_cliente',
         canal='meta',
@@ -242,63 +257,9 @@ def _process_incoming_message(message, contacts, empresa):
         customer=customer,
         lead=msg_original.lead if msg_original else None,
         cart=msg_original.cart if msg_original else None,
+        resposta_a=msg_original,
     )
 
-    # Encaminhar para atendente humano via W-API
-    _encaminhar_para_humano(empresa, from_number, nome, texto, msg_original)
-
-
-def _encaminhar_para_humano(empresa, telefone_cliente, nome_cliente,
-                            texto_resposta, msg_original):
-    """
-    Quando um cliente responde uma mensagem promocional,
-    envia notificacao para o WhatsApp humano da empresa
-    com os dados do cliente e a resposta.
-    """
-    whatsapp_humano = getattr(empresa, 'meta_whatsapp_humano', '')
-    if not whatsapp_humano:
-        logger.info(f'[{empresa.slug}] Sem WhatsApp humano configurado, resposta nao encaminhada')
-        return
+    # Encaminhar para atendente humano via W-API (task Celery, fora do request)
+    agendar_encaminhamento(empresa, resposta)
 
-    # Montar mensagem para o atendente
-    tipo_original = ''
-    template_original = ''
-    if msg_original:
-        tipo_original = msg_original.get_tipo_display()
-        template_original = msg_original.template_name
-
-    mensagem = (
-        f"*Nova resposta de cliente!*\n\n"
-        f"*Cliente:* {nome_cliente}\n"
-        f"*Telefone:* {telefone_cliente}\n"
-        f"*Respondeu a:* {tipo_original}"
-    )
-    if template_original:
-        mensagem += f" ({template_original})"
-    mensagem += f"\n\n*Mensagem:*\n{texto_resposta}\n\n"
-    mensagem += f"Responda diretamente: https://wa.me/{telefone_cliente}"
-
-    # Enviar via W-API (atendente humano usa W-API)
-    from customers.services.wapi import _get_wapi_client
-    client = _get_wapi_client(empresa, 'lead')
-    if client.esta_configurado():
-        resultado = client.enviar_mensagem(whatsapp_humano, mensagem)
-        if resultado.get('success'):
-            # Marcar a mensagem original como encaminhada
-            if msg_original:
-                msg_original.encaminhado_humano = True
-                msg_original.encaminhado_humano_em = timezone.now()
-                msg_original.save(update_fields=[
-                    'encaminhado_humano', 'encaminhado_humano_em',
-                ])
-            logger.info(
-                f'[{empresa.slug}] Resposta de {telefone_cliente} '
-                f'encaminhada para humano {whatsapp_humano}'
-            )
-        else:
-            logger.error(
-                f'[{empresa.slug}] Erro ao encaminhar para humano: '
-                f'{resultado.get("error")}'
-            )
-    else:
-        logger.warning(f'[{empresa.slug}] W-API nao configurado para encaminhar resposta')
@@ -106,6 +106,16 @@ class ProgressWriter:
         return self.stats
 
 
+def _invalidar_estatisticas(empresa_slug):
+    """Dashboards da empresa voltam a ler do banco após a importação."""
+    from customers.services.estatisticas import invalidar
+    from tenants.cache import get_empresa_por_slug
+
+    empresa = get_empresa_por_slug(empresa_slug)
+    if empresa:
+        invalidar(empresa.id)
+
+
 @shared_task(bind=True, max_retries=0)
 def import_customers_task(self, task_id, start_date, end_date, import_type, empresa_slug):
     """
@@ -135,6 +145,7 @@ def import_customers_task(self, task_id, start_date, end_date, import_type, empr
             empresa=empresa_slug,
             stdout=out
         )
+        _invalidar_estatisticas(empresa_slug)
 
         output = out.getvalue()
         stats = out.get_stats()
@@ -171,6 +182,8 @@ def import_customers_task(self, task_id, start_date, end_date, import_type, empr
     except Exception as e:
         error_traceback = traceback.format_exc()
         logger.error(f'[CELERY] Erro na task {task_id}: {str(e)}\n{error_traceback}')
+        # Importação parcial também altera os números
+        _invalidar_estatisticas(empresa_slug)
 
         # Em caso de erro
         cache.set(f'import_{task_id}', {
@@ -294,6 +307,7 @@ def import_leads_task(self, task_id, start_date, end_date, empresa_slug):
             empresa=empresa_slug,
             stdout=out
         )
+        _invalidar_estatisticas(empresa_slug)
 
         output = out.getvalue()
         stats = out.get_stats()
@@ -327,6 +341,7 @@ def import_leads_task(self, task_id, start_date, end_date, empresa_slug):
     except Exception as e:
         error_traceback = traceback.format_exc()
         logger.error(f'[CELERY] Erro na leads task {task_id}: {str(e)}\n{error_traceback}')
+        _invalidar_estatisticas(empresa_slug)
 
         cache.set(f'import_leads_{task_id}', {
             'status': 'erro',
@@ -388,6 +403,10 @@ def check_recovery_task(self, empresa_slug):
             else:
                 waiting += 1
 
+        if recovered:
+            from customers.services.estatisticas import invalidar
+            invalidar(empresa.id)
+
         total = recovered + abandoned
         rate = (recovered / total * 100) if total > 0 else 0
 
@@ -108,7 +108,7 @@ class ImportStatusView(View):
         
         # Retornar estatísticas gerais - FILTRADO POR EMPRESA
         from customers.models import Customer, Cart, Order
-        from django.db.models import Count, Sum, Q
+        from customers.services import estatisticas
 
         # Filtrar por empresa do usuário (tenant)
         empresa = getattr(request, 'tenant', None)
@@ -129,32 +129,39 @@ class ImportStatusView(View):
             carts_qs = Cart.objects.none()
             orders_qs = Order.objects.none()
 
-        stats = {
-            'total_customers': customers_qs.count(),
-            'customers_with_phone': customers_qs.exclude(
-                Q(phone='') | Q(phone__isnull=True)
-            ).count(),
-            'abandoned_carts': carts_qs.filter(status='abandoned').count(),
-            'total_orders': orders_qs.count(),
-            'recent_imports': []
-        }
-
-        # Últimas importações (últimas 24h)
-        last_24h = timezone.now() - timedelta(hours=24)
-
-        recent_customers = customers_qs.filter(
-            created_at__gte=last_24h
-        ).count()
-
-        recent_carts = carts_qs.filter(
-            created_at__gte=last_24h
-        ).count()
-
-        stats['recent_imports'] = {
-            'customers': recent_customers,
-            'carts': recent_carts,
-            'last_import': customers_qs.latest('created_at').created_at.isoformat() if customers_qs.exists() else None
-        }
+        def calcular():
+            # Uma consulta por tabela (status e últimas 24h)
+            clientes = estatisticas.customers(customers_qs)
+            carrinhos = estatisticas.carts(carts_qs)
+            if empresa:
+                # Acumulados: ultimo snapshot diario + delta de hoje
+                from customers.services.snapshots import totais
+                totais_empresa = totais(empresa, tabelas=('customers', 'orders'))
+                total_customers = totais_empresa['customers']
+                customers_with_phone = totais_empresa['customers_with_phone']
+                total_orders = totais_empresa['orders']
+            else:
+                total_customers = clientes['total']
+                customers_with_phone = clientes['com_telefone']
+                total_orders = orders_qs.count()
+
+            return {
+                'total_customers': total_customers,
+                'customers_with_phone': customers_with_phone,
+                'abandoned_carts': carrinhos['abandonados'],
+                'total_orders': total_orders,
+                # Últimas importações (últimas 24h)
+                'recent_imports': {
+                    'customers': clientes['recentes'],
+                    'carts': carrinhos['recentes'],
+                    'last_import': clientes['ultimo_criado'].isoformat() if clientes['ultimo_criado'] else None
+                },
+            }
+
+        if empresa or request.user.is_superuser:
+            stats = estatisticas.em_cache(empresa, 'importacao', calcular)
+        else:
+            stats = calcular()
         
         return JsonResponse(stats)
 
@@ -171,7 +178,7 @@ def leads_dashboard_view(request):
 def leads_stats_view(request):
     """Retorna estatísticas dos leads em JSON - FILTRADO POR EMPRESA"""
     from customers.models import Lead
-    from django.db.models import Count
+    from customers.services import estatisticas
 
     # Filtrar por empresa do usuário (tenant)
     empresa = getattr(request, 'tenant', None)
@@ -183,27 +190,29 @@ def leads_stats_view(request):
     else:
         leads_qs = Lead.objects.none()
 
-    total_leads = leads_qs.count()
-    new_leads = leads_qs.filter(status='new').count()
-    existing_customers = leads_qs.filter(is_customer=True).count()
-    prospects = leads_qs.filter(is_customer=False).count()
-
-    # Leads por status
-    status_breakdown = leads_qs.values('status').annotate(count=Count('id'))
-
-    # Leads recentes (últimas 24h)
-    from datetime import timedelta
-    last_24h = timezone.now() - timedelta(hours=24)
-    recent_leads = leads_qs.filter(created_at__gte=last_24h).count()
+    def calcular():
+        # Uma consulta com status e últimas 24h
+        stats = estatisticas.leads(leads_qs)
+        if empresa:
+            # Acumulado: ultimo snapshot diario + delta de hoje
+            from customers.services.snapshots import totais
+            total_leads = totais(empresa, tabelas=('leads',))['leads']
+        else:
+            total_leads = stats['total']
+        return {
+            'total_leads': total_leads,
+            'new_leads': stats['novos'],
+            'existing_customers': stats['clientes'],
+            'prospects': stats['prospects'],
+            'recent_leads': stats['recentes'],
+            'status_breakdown': [
+                {'status': status, 'count': n} for status, n in stats['por_status'].items()
+            ],
+        }
 
-    return JsonResponse({
-        'total_leads': total_leads,
-        'new_leads': new_leads,
-        'existing_customers': existing_customers,
-        'prospects': prospects,
-        'recent_leads': recent_leads,
-        'status_breakdown': list(status_breakdown)
-    })
+    if empresa or request.user.is_superuser:
+        return JsonResponse(estatisticas.em_cache(empresa, 'leads', calcular))
+    return JsonResponse(calcular())
 
 @csrf_exempt
 @staff_member_required
@@ -1,6 +1,7 @@
 from django.contrib import admin, messages
 from django.contrib.auth.models import User
-from django.utils.html import format_html
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
 from .models import Empresa, EmpresaUsuario, InstanciaWAPI
 
 
@@ -176,7 +177,7 @@ class EmpresaAdmin(admin.ModelAdmin):
         ('Meta WhatsApp Business API', {
             'fields': ('meta_waba_id', 'meta_phone_number_id', 'meta_access_token',
                         'meta_template_transito', 'meta_webhook_verify_token',
-                        'meta_whatsapp_humano'),
+                        'meta_whatsapp_humano', 'circuitos_display'),
             'description': 'Cloud API oficial do WhatsApp (Meta). Templates precisam ser aprovados no WhatsApp Manager.'
         }),
         ('Meta Templates - Promocoes e Cupons', {
@@ -237,7 +238,7 @@ class EmpresaAdmin(admin.ModelAdmin):
         ('Meta WhatsApp Business API', {
             'fields': ('meta_waba_id', 'meta_phone_number_id', 'meta_access_token',
                         'meta_template_transito', 'meta_webhook_verify_token',
-                        'meta_whatsapp_humano'),
+                        'meta_whatsapp_humano', 'circuitos_display'),
             'description': 'Cloud API oficial do WhatsApp (Meta). Templates precisam ser aprovados no WhatsApp Manager.'
         }),
         ('Meta Templates - Promocoes e Cupons', {
@@ -260,9 +261,9 @@ class EmpresaAdmin(admin.ModelAdmin):
     def get_readonly_fields(self, request, obj=None):
         """Usuarios normais so podem editar mensagens WhatsApp"""
         if request.user.is_superuser:
-            return ['created_at', 'updated_at', 'bling_status_display']
+            return ['created_at', 'updated_at', 'bling_status_display', 'circuitos_display']
         # Usuarios normais: nome eh readonly
-        return ['nome', 'created_at', 'updated_at', 'bling_status_display']
+        return ['nome', 'created_at', 'updated_at', 'bling_status_display', 'circuitos_display']
 
     def get_queryset(self, request):
         """Usuarios normais so veem sua propria empresa"""
@@ -313,37 +314,59 @@ class EmpresaAdmin(admin.ModelAdmin):
         return format_html(f'{status} &nbsp; <a href="{authorize_url}" class="button">Autorizar Bling</a>')
     bling_status_display.short_description = 'Status Bling'
 
+    def circuitos_display(self, obj):
+        """Estado do circuit breaker dos provedores de envio (Meta e W-API)."""
+        from comunicacao.services.circuito import situacao
+
+        provedores = [('Meta', 'meta', obj.meta_phone_number_id), ('W-API', 'wapi', obj.wapi_instance)]
+        if obj.pk:
+            provedores += [
+                (f'W-API {inst.nome}', 'wapi', inst.wapi_instance)
+                for inst in obj.instancias_wapi.filter(ativo=True)
+            ]
+
+        cores = {'fechado': 'green', 'meio-aberto': 'orange', 'aberto': 'red'}
+        linhas = []
+        for rotulo, provedor, instancia in provedores:
+            estado = situacao(provedor, instancia)
+            if not estado:
+                continue
+            detalhe = f" (reabre em {estado['reabre_em']}s)" if estado['estado'] == 'aberto' else ''
+            linhas.append(format_html(
+                '{}: <span style="color:{};">{}</span> — {} falhas seguidas{}',
+                rotulo, cores[estado['estado']], estado['estado'], estado['falhas'], detalhe,
+            ))
+        if not linhas:
+            return format_html('<span style="color:gray;">Sem provedor configurado</span>')
+        return format_html_join(mark_safe('<br>'), '{}', ((linha,) for linha in linhas))
+    circuitos_display.short_description = 'Circuit breaker'
+
     def sync_bling_agora(self, request, queryset):
         """Action: sincronizar pedidos de todos os status configurados no Bling."""
-        from bling.tasks import sync_empresa_pedidos_por_status, BLING_STATUS_MAP
+        from bling.tasks import sincronizar_empresa
         for empresa in queryset:
             if not empresa.bling_client_id:
                 self.message_user(request, f"{empresa.nome}: Bling não configurado", messages.WARNING)
                 continue
 
-            total_enviados = 0
+            total_agendados = 0
             total_erros = 0
             status_processados = []
 
-            for status, config in BLING_STATUS_MAP.items():
-                sit_id = getattr(empresa, config['campo_situacao'], '')
-                if not sit_id:
-                    continue
-                try:
-                    stats = sync_empresa_pedidos_por_status(empresa, status)
-                    total_enviados += stats['enviados']
-                    total_erros += stats['erros']
-                    if stats['total'] > 0:
-                        status_processados.append(f"{status}: {stats['enviados']}/{stats['total']}")
-                except Exception as e:
-                    total_erros += 1
-                    self.message_user(request, f"{empresa.nome} [{status}]: Erro - {e}", messages.ERROR)
+            # Todos os status configurados de uma vez (páginas buscadas em paralelo)
+            for status, stats in sincronizar_empresa(empresa).items():
+                total_agendados += stats['agendados']
+                total_erros += stats['erros']
+                if stats['erros']:
+                    self.message_user(request, f"{empresa.nome} [{status}]: Erro - veja o log", messages.ERROR)
+                if stats['total'] > 0:
+                    status_processados.append(f"{status}: {stats['agendados']}/{stats['total']}")
 
             if status_processados:
                 detail = " | ".join(status_processados)
                 self.message_user(
                     request,
-                    f"{empresa.nome}: {total_enviados} enviados ({detail})",
+                    f"{empresa.nome}: {total_agendados} envios agendados ({detail})",
                     messages.SUCCESS if total_erros == 0 else messages.WARNING
                 )
             else:
@@ -0,0 +1,291 @@
+"""
+Registro de tenants em cache.
+
+Resolve Empresa por id, slug ou meta_phone_number_id sem tocar o banco
+nos caminhos quentes (webhooks, API de eventos, extensão Chrome, middleware).
+
+Duas camadas:
+1. LRU local em memória (por processo), com TTL curto
+2. Cache Django (Redis em produção) compartilhado entre workers
+
+Invalidação: tenants.signals chama invalidar_empresa() / invalidar_usuario()
+em save/delete de Empresa e EmpresaUsuario. Um contador de versão no Redis
+derruba o LRU local dos outros processos.
+"""
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'tenants:registro'
+VERSAO_KEY = f'{CACHE_PREFIX}:versao'
+
+# Marca "não existe" (evita ir ao banco a cada slug inválido)
+_AUSENTE = 0
+
+
+def _config(nome, default):
+    return getattr(settings, nome, default)
+
+
+class _LRULocal:
+    """LRU thread-safe com TTL por entrada."""
+
+    def __init__(self, max_itens=256, ttl=30):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                return None
+            valor, expira_em = item
+            if expira_em < time.monotonic():
+                del self._dados[chave]
+                return None
+            self._dados.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = (valor, time.monotonic() + self.ttl)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+
+    def delete(self, chave):
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+
+
+_local = _LRULocal(
+    max_itens=_config('TENANT_CACHE_LOCAL_SIZE', 256),
+    ttl=_config('TENANT_CACHE_LOCAL_TTL', 30),
+)
+_versao_local = {'versao': None, 'checado_em': 0.0}
+_versao_lock = threading.Lock()
+
+
+def _redis_ttl():
+    return _config('TENANT_CACHE_TTL', 60 * 60)
+
+
+def _checar_versao():
+    """
+    Compara a versão local com a do Redis (no máximo 1x por intervalo).
+    Se mudou, outro processo invalidou algo: limpa o LRU local inteiro.
+    """
+    agora = time.monotonic()
+    intervalo = _config('TENANT_CACHE_VERSION_CHECK', 2)
+    if agora - _versao_local['checado_em'] < intervalo:
+        return
+
+    with _versao_lock:
+        if agora - _versao_local['checado_em'] < intervalo:
+            return
+        try:
+            versao = cache.get(VERSAO_KEY, 0)
+        except Exception as e:
+            logger.warning(f'Tenant cache: erro ao ler versão ({e})')
+            versao = None
+        if versao != _versao_local['versao']:
+            _local.clear()
+            _versao_local['versao'] = versao
+        _versao_local['checado_em'] = agora
+
+
+def _bump_versao():
+    try:
+        cache.incr(VERSAO_KEY)
+    except ValueError:
+        cache.set(VERSAO_KEY, 1, timeout=None)
+    except Exception as e:
+        logger.warning(f'Tenant cache: erro ao incrementar versão ({e})')
+    _local.clear()
+    _versao_local['checado_em'] = 0.0
+
+
+# ---------------------------------------------------------------------------
+# Chaves
+# ---------------------------------------------------------------------------
+
+def _key_id(empresa_id):
+    return f'{CACHE_PREFIX}:id:{empresa_id}'
+
+
+def _key_slug(slug):
+    return f'{CACHE_PREFIX}:slug:{slug}'
+
+
+def _key_phone(phone_number_id):
+    return f'{CACHE_PREFIX}:phone:{phone_number_id}'
+
+
+def _key_usuario(usuario_id):
+    return f'{CACHE_PREFIX}:usuario:{usuario_id}'
+
+
+# ---------------------------------------------------------------------------
+# Leitura em duas camadas
+# ---------------------------------------------------------------------------
+
+def _get_em_camadas(chave, carregar):
+    """Busca no LRU local → Redis → carregar() (banco)."""
+    _checar_versao()
+
+    valor = _local.get(chave)
+    if valor is not None:
+        return valor
+
+    try:
+        valor = cache.get(chave)
+    except Exception as e:
+        logger.warning(f'Tenant cache: erro ao ler {chave} ({e})')
+        valor = None
+
+    if valor is None:
+        valor = carregar()
+        try:
+            cache.set(chave, valor, timeout=_redis_ttl())
+        except Exception as e:
+            logger.warning(f'Tenant cache: erro ao gravar {chave} ({e})')
+
+    _local.set(chave, valor)
+    return valor
+
+
+def _carregar_empresa(empresa_id):
+    from tenants.models import Empresa
+    empresa = Empresa.objects.filter(id=empresa_id).first()
+    return empresa if empresa else _AUSENTE
+
+
+def get_empresa_por_id(empresa_id, ativo=True):
+    """
+    Retorna Empresa pelo id (ou None).
+    Com ativo=True, empresas desativadas retornam None.
+
+    A instância retornada é uma cópia: pode ser alterada/salva pelo chamador
+    sem contaminar o cache.
+    """
+    if not empresa_id:
+        return None
+    try:
+        empresa_id = int(empresa_id)
+    except (TypeError, ValueError):
+        return None
+
+    empresa = _get_em_camadas(
+        _key_id(empresa_id), lambda: _carregar_empresa(empresa_id),
+    )
+    if empresa == _AUSENTE:
+        return None
+    if ativo and not empresa.ativo:
+        return None
+    return copy.copy(empresa)
+
+
+def get_empresa_por_slug(slug, ativo=True):
+    """Retorna Empresa pelo slug (ou None)."""
+    if not slug:
+        return None
+
+    def carregar():
+        from tenants.models import Empresa
+        empresa_id = Empresa.objects.filter(slug=slug).values_list('id', flat=True).first()
+        return empresa_id or _AUSENTE
+
+    empresa_id = _get_em_camadas(_key_slug(slug), carregar)
+    if empresa_id == _AUSENTE:
+        return None
+    return get_empresa_por_id(empresa_id, ativo=ativo)
+
+
+def get_empresa_por_phone_number_id(phone_number_id, ativo=True):
+    """Retorna Empresa pelo meta_phone_number_id (webhook Meta)."""
+    if not phone_number_id:
+        return None
+
+    def carregar():
+        from tenants.models import Empresa
+        empresa_id = Empresa.objects.filter(
+            ativo=True, meta_phone_number_id=phone_number_id,
+        ).values_list('id', flat=True).first()
+        return empresa_id or _AUSENTE
+
+    empresa_id = _get_em_camadas(_key_phone(phone_number_id), carregar)
+    if empresa_id == _AUSENTE:
+        return None
+    return get_empresa_por_id(empresa_id, ativo=ativo)
+
+
+def get_empresas_do_usuario(usuario_id):
+    """
+    Retorna lista de (empresa_id, is_default) dos vínculos do usuário,
+    na ordem de criação. Não filtra empresas inativas: use
+    get_empresa_por_id(..., ativo=True) para isso.
+    """
+    if not usuario_id:
+        return []
+
+    def carregar():
+        from tenants.models import EmpresaUsuario
+        return list(
+            EmpresaUsuario.objects.filter(usuario_id=usuario_id)
+            .order_by('id')
+            .values_list('empresa_id', 'is_default')
+        )
+
+    return _get_em_camadas(_key_usuario(usuario_id), carregar)
+
+
+# ---------------------------------------------------------------------------
+# Invalidação
+# ---------------------------------------------------------------------------
+
+def invalidar_empresa(empresa):
+    """
+    Remove a empresa do cache (id, slug e phone_number_id atuais e anteriores).
+    Chamado em Empresa.save/delete via tenants.signals.
+    """
+    chaves = {_key_id(empresa.id), _key_slug(empresa.slug)}
+    if empresa.meta_phone_number_id:
+        chaves.add(_key_phone(empresa.meta_phone_number_id))
+
+    # Valores antigos (slug/phone podem ter mudado)
+    try:
+        anterior = cache.get(_key_id(empresa.id))
+    except Exception:
+        anterior = None
+    if anterior and anterior != _AUSENTE:
+        chaves.add(_key_slug(anterior.slug))
+        if anterior.meta_phone_number_id:
+            chaves.add(_key_phone(anterior.meta_phone_number_id))
+
+    try:
+        cache.delete_many(list(chaves))
+    except Exception as e:
+        logger.warning(f'Tenant cache: erro ao invalidar empresa {empresa.id} ({e})')
+    _bump_versao()
+
+
+def invalidar_usuario(usuario_id):
+    """Remove os vínculos do usuário do cache (EmpresaUsuario mudou)."""
+    try:
+        cache.delete(_key_usuario(usuario_id))
+    except Exception as e:
+        logger.warning(f'Tenant cache: erro ao invalidar usuário {usuario_id} ({e})')
+    _bump_versao()
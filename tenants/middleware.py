@@ -65,9 +65,10 @@ class TenantMiddleware:
 
     def _get_tenant_from_session(self, request):
         """
-        Detecta empresa pela sessao do usuario logado
+        Detecta empresa pela sessao do usuario logado.
+        Usa o registro em cache (tenants.cache): zero queries no caminho quente.
         """
-        from tenants.models import Empresa, EmpresaUsuario
+        from tenants.cache import get_empresa_por_id, get_empresas_do_usuario
 
         if not request.user.is_authenticated:
             return None
@@ -78,48 +79,35 @@ class TenantMiddleware:
         # Verificar sessao
         tenant_id = request.session.get('current_tenant_id')
         if tenant_id:
-            try:
-                # Superuser pode acessar qualquer empresa
-                if request.user.is_superuser:
-                    return Empresa.objects.get(id=tenant_id, ativo=True)
-
+            # Superuser pode acessar qualquer empresa
+            if request.user.is_superuser:
+                empresa = get_empresa_por_id(tenant_id)
+            else:
                 # Usuario normal precisa ter acesso
-                empresa_usuario = EmpresaUsuario.objects.select_related('empresa').get(
-                    empresa_id=tenant_id,
-                    usuario=request.user,
-                    empresa__ativo=True
-                )
-                return empresa_usuario.empresa
-            except (Empresa.DoesNotExist, EmpresaUsuario.DoesNotExist):
-                # Remover tenant invalido da sessao
-                if 'current_tenant_id' in request.session:
-                    del request.session['current_tenant_id']
+                vinculos = get_empresas_do_usuario(request.user.id)
+                permitido = any(eid == tenant_id for eid, _ in vinculos)
+                empresa = get_empresa_por_id(tenant_id) if permitido else None
+
+            if empresa:
+                return empresa
+
+            # Remover tenant invalido da sessao
+            if 'current_tenant_id' in request.session:
+                del request.session['current_tenant_id']
 
         # Superuser sem empresa selecionada - nao forcar
         if request.user.is_superuser:
             return None
 
-        # Tentar empresa padrao do usuario
-        try:
-            empresa_usuario = EmpresaUsuario.objects.select_related('empresa').get(
-                usuario=request.user,
-                is_default=True,
-                empresa__ativo=True
-            )
-            request.session['current_tenant_id'] = empresa_usuario.empresa.id
-            return empresa_usuario.empresa
-        except EmpresaUsuario.DoesNotExist:
-            pass
-
-        # Pegar primeira empresa do usuario
-        empresa_usuario = EmpresaUsuario.objects.select_related('empresa').filter(
-            usuario=request.user,
-            empresa__ativo=True
-        ).first()
-
-        if empresa_usuario:
-            request.session['current_tenant_id'] = empresa_usuario.empresa.id
-            return empresa_usuario.empresa
+        vinculos = get_empresas_do_usuario(request.user.id)
+
+        # Tentar empresa padrao do usuario, depois a primeira ativa
+        ordenados = [v for v in vinculos if v[1]] + [v for v in vinculos if not v[1]]
+        for empresa_id, _ in ordenados:
+            empresa = get_empresa_por_id(empresa_id)
+            if empresa:
+                request.session['current_tenant_id'] = empresa.id
+                return empresa
 
         return None
 
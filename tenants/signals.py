@@ -0,0 +1,23 @@
+"""
+Invalidação do registro de tenants (tenants.cache).
+Conectado em TenantsConfig.ready().
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from tenants.cache import invalidar_empresa, invalidar_usuario
+from tenants.models import Empresa, EmpresaUsuario
+
+
+@receiver(post_save, sender=Empresa)
+@receiver(post_delete, sender=Empresa)
+def _empresa_alterada(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidar_empresa(instance))
+
+
+@receiver(post_save, sender=EmpresaUsuario)
+@receiver(post_delete, sender=EmpresaUsuario)
+def _empresa_usuario_alterado(sender, instance, **kwargs):
+    usuario_id = instance.usuario_id
+    transaction.on_commit(lambda: invalidar_usuario(usuario_id))
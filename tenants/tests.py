@@ -1,3 +1,62 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from tenants import cache as tenant_cache
+from tenants.models import Empresa, EmpresaUsuario
+
+
+class TenantCacheTests(TestCase):
+    """Testes do registro de tenants em cache"""
+
+    def setUp(self):
+        cache.clear()
+        tenant_cache._local.clear()
+        self.empresa = Empresa.objects.create(
+            nome='Loja Teste', slug='loja-teste', meta_phone_number_id='123456',
+        )
+
+    def test_lookup_sem_queries_apos_aquecer(self):
+        """Depois da primeira busca, slug/id/phone resolvem sem banco"""
+        tenant_cache.get_empresa_por_slug('loja-teste')
+        tenant_cache.get_empresa_por_phone_number_id('123456')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(tenant_cache.get_empresa_por_slug('loja-teste').id, self.empresa.id)
+            self.assertEqual(tenant_cache.get_empresa_por_id(self.empresa.id).slug, 'loja-teste')
+            self.assertEqual(tenant_cache.get_empresa_por_phone_number_id('123456').id, self.empresa.id)
+
+    def test_inexistente_retorna_none(self):
+        self.assertIsNone(tenant_cache.get_empresa_por_slug('nao-existe'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(tenant_cache.get_empresa_por_slug('nao-existe'))
+
+    def test_invalida_ao_salvar(self):
+        """Mudar slug/ativo invalida o cache"""
+        tenant_cache.get_empresa_por_slug('loja-teste')
+
+        self.empresa.slug = 'loja-nova'
+        self.empresa.ativo = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.empresa.save()
+
+        self.assertIsNone(tenant_cache.get_empresa_por_slug('loja-teste'))
+        self.assertIsNone(tenant_cache.get_empresa_por_slug('loja-nova'))
+        self.assertIsNotNone(tenant_cache.get_empresa_por_slug('loja-nova', ativo=False))
+
+    def test_copia_nao_contamina_cache(self):
+        empresa = tenant_cache.get_empresa_por_id(self.empresa.id)
+        empresa.nome = 'Alterado sem salvar'
+        self.assertEqual(tenant_cache.get_empresa_por_id(self.empresa.id).nome, 'Loja Teste')
+
+    def test_vinculos_do_usuario(self):
+        user = User.objects.create_user('operador', password='x')
+        self.assertEqual(tenant_cache.get_empresas_do_usuario(user.id), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            EmpresaUsuario.objects.create(empresa=self.empresa, usuario=user, is_default=True)
+
+        self.assertEqual(
+            tenant_cache.get_empresas_do_usuario(user.id),
+            [(self.empresa.id, True)],
+        )
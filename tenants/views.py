@@ -158,13 +158,15 @@ def configuracoes(request):
     config_form = EmpresaConfigForm(instance=tenant)
     woo_form = WooCommerceConfigForm(instance=tenant)
 
-    # Estatisticas da empresa
-    stats = {
-        'customers': tenant.customers.count(),
-        'carts': tenant.carts.count(),
-        'orders': tenant.orders.count(),
-        'leads': tenant.leads.count(),
-    }
+    # Estatisticas da empresa (ultimo snapshot diario + delta de hoje)
+    from customers.services.estatisticas import em_cache
+    from customers.services.snapshots import totais
+
+    def calcular():
+        stats = totais(tenant)
+        return {k: stats[k] for k in ('customers', 'carts', 'orders', 'leads')}
+
+    stats = em_cache(tenant, 'configuracoes', calcular)
 
     return render(request, 'tenants/configuracoes.html', {
         'empresa': tenant,